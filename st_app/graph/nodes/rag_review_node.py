@@ -2,45 +2,54 @@
 FAISS-based Review RAG node: retrieves relevant review chunks and generates
 an LLM answer grounded in those reviews. Use when the user asks for
 reviews, opinions, or audience reactions.
+
+rag_review_node is the blocking version used by graph.invoke();
+arag_review_node awaits the embedding and LLM calls and is used by
+graph.ainvoke(), so one process can serve many review questions at once.
+Both search the index of state["title"] when set (see st_app.rag.namespaces).
 """
-from st_app.rag.llm import generate_text
+from langchain_core.documents import Document
+
+from st_app.rag.llm import agenerate_text, generate_text
 from st_app.rag.prompt import RAG_SYSTEM_PROMPT, RAG_USER_PROMPT_TEMPLATE
-from st_app.rag.retriever import retrieve
+from st_app.rag.retriever import aretrieve, retrieve
 
 MAX_CONTEXT_CHARS = 12_000
 
+NO_DOCS_RESPONSE = {
+    "messages": [{"role": "assistant", "content": "리뷰 정보를 충분히 찾지 못했습니다."}],
+    "route": "review",
+    "retrieved_docs": [],
+}
 
-def rag_review_node(state: dict) -> dict:
-    last_user_msg = ""
+
+def _last_user_message(state: dict) -> str:
     for msg in reversed(state.get("messages", [])):
         if msg.get("role") == "user":
-            last_user_msg = msg.get("content", "")
-            break
+            return msg.get("content", "")
+    return ""
 
-    docs = retrieve(query=last_user_msg, top_k=3)
 
-    if not docs:
-        return {
-            "messages": [{"role": "assistant", "content": "리뷰 정보를 충분히 찾지 못했습니다."}],
-            "route": "review",
-            "retrieved_docs": [],
-        }
-
-    context_parts = [d.page_content for d in docs]
+def _build_user_prompt(question: str, docs: list[Document]) -> str:
+    # Each doc is one whole review; keep whole reviews and only cut the one that overflows.
+    context_parts = []
+    remaining = MAX_CONTEXT_CHARS
+    for d in docs:
+        if remaining <= 0:
+            break
+        part = d.page_content
+        if len(part) > remaining:
+            part = part[:remaining] + "\n\n[... truncated]"
+        context_parts.append(part)
+        remaining -= len(part)
     context = "\n\n---\n\n".join(context_parts)
 
-    if len(context) > MAX_CONTEXT_CHARS:
-        context = context[:MAX_CONTEXT_CHARS] + "\n\n[... truncated]"
-
-    user_prompt = RAG_USER_PROMPT_TEMPLATE.format(
-        question=last_user_msg, context=context,
-    )
-    answer = generate_text(
-        system_prompt=RAG_SYSTEM_PROMPT,
-        user_prompt=user_prompt,
-        temperature=0.2,
+    return RAG_USER_PROMPT_TEMPLATE.format(
+        question=question, context=context,
     )
 
+
+def _build_response(answer: str, docs: list[Document]) -> dict:
     retrieved_docs = [
         {"content": d.page_content, "metadata": d.metadata} for d in docs
     ]
@@ -50,3 +59,35 @@ def rag_review_node(state: dict) -> dict:
         "route": "review",
         "retrieved_docs": retrieved_docs,
     }
+
+
+def rag_review_node(state: dict) -> dict:
+    last_user_msg = _last_user_message(state)
+
+    docs = retrieve(query=last_user_msg, top_k=3, title=state.get("title"))
+
+    if not docs:
+        return NO_DOCS_RESPONSE
+
+    answer = generate_text(
+        system_prompt=RAG_SYSTEM_PROMPT,
+        user_prompt=_build_user_prompt(last_user_msg, docs),
+        temperature=0.2,
+    )
+    return _build_response(answer, docs)
+
+
+async def arag_review_node(state: dict) -> dict:
+    last_user_msg = _last_user_message(state)
+
+    docs = await aretrieve(query=last_user_msg, top_k=3, title=state.get("title"))
+
+    if not docs:
+        return NO_DOCS_RESPONSE
+
+    answer = await agenerate_text(
+        system_prompt=RAG_SYSTEM_PROMPT,
+        user_prompt=_build_user_prompt(last_user_msg, docs),
+        temperature=0.2,
+    )
+    return _build_response(answer, docs)
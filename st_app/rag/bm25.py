@@ -0,0 +1,282 @@
+"""
+Lexical (BM25) index over the preprocessed `clean_comment` column.
+
+One BM25 document is one review row (see st_app.rag.reviews). Postings are kept as CSR arrays in a
+single .npz file next to the FAISS index:
+
+    terms          sorted vocabulary (looked up with np.searchsorted)
+    term_ptr       postings offsets per term (len = n_terms + 1)
+    post_rows      row ids of each posting
+    post_tf        term frequency of each posting
+    row_len        token count per row
+    row_chunk_ptr  offsets into row_chunks per row (len = n_rows + 1)
+    row_chunks     vector ids of the chunks cut from each row
+    chunk_rows     row id of every vector id (-1 if the chunk has no row)
+
+Scoring a query is a handful of array slices, so keyword lookups take
+microseconds and need no embedding call. In-place review updates (see
+st_app.rag.updates) patch the postings with update_bm25_index() instead of
+re-tokenizing every row.
+"""
+import math
+import re
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from st_app.rag.files import save_arrays
+
+BM25_FILE = "bm25.npz"
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase alphabetic tokens, matching the preprocessing of clean_comment."""
+    return _TOKEN_RE.findall(text.lower()) if isinstance(text, str) else []
+
+
+class BM25Writer:
+    """
+    Build bm25.npz batch by batch: every row is tokenized once and only its
+    postings, as (term id, row, tf) arrays, are kept until close().
+
+        writer = BM25Writer(index_dir)
+        for row_texts in batches:
+            writer.add(row_texts)
+        writer.close(chunk_rows)
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self._vocab: dict[str, int] = {}
+        self._term_ids: list[np.ndarray] = [np.empty(0, dtype=np.int64)]
+        self._rows: list[np.ndarray] = [np.empty(0, dtype=np.int32)]
+        self._tf: list[np.ndarray] = [np.empty(0, dtype=np.uint16)]
+        self._row_len: list[np.ndarray] = [np.empty(0, dtype=np.int32)]
+        self.n_rows = 0
+
+    def add(self, row_texts: list[str]) -> None:
+        """Append review rows; see build_bm25_index for row_texts."""
+        term_ids, rows, tfs, lengths = [], [], [], []
+        for row, text in enumerate(row_texts, start=self.n_rows):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_ids.append(self._vocab.setdefault(term, len(self._vocab)))
+                rows.append(row)
+                tfs.append(tf)
+        self._term_ids.append(np.array(term_ids, dtype=np.int64))
+        self._rows.append(np.array(rows, dtype=np.int32))
+        self._tf.append(np.array(tfs, dtype=np.uint16))
+        self._row_len.append(np.array(lengths, dtype=np.int32))
+        self.n_rows += len(row_texts)
+
+    def close(self, chunk_rows: np.ndarray) -> None:
+        """
+        Sort the postings by term and row and write bm25.npz.
+
+        Args:
+            chunk_rows: Row of every vector id (-1 if the chunk has no row).
+        """
+        terms = np.array(list(self._vocab), dtype=str)
+        by_term = np.argsort(terms)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[by_term] = np.arange(len(terms))
+        term_ids = rank[np.concatenate(self._term_ids)]
+        post_rows, post_tf = np.concatenate(self._rows), np.concatenate(self._tf)
+        order = np.lexsort((post_rows, term_ids))
+        term_ptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=term_ptr[1:])
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        _save(
+            self.index_dir, terms[by_term], term_ptr, post_rows[order], post_tf[order],
+            np.concatenate(self._row_len), np.asarray(chunk_rows, dtype=np.int32),
+        )
+
+
+def build_bm25_index(index_dir: Path, row_texts: list[str], chunk_rows: np.ndarray) -> None:
+    """
+    Build bm25.npz over one text per review row.
+
+    Args:
+        index_dir: Index directory to write into.
+        row_texts: clean_comment of every review row, in review position order
+            ("" for rows that should not match, e.g. deleted reviews).
+        chunk_rows: Row of every vector id (-1 if the chunk has no row).
+    """
+    writer = BM25Writer(index_dir)
+    writer.add(row_texts)
+    writer.close(chunk_rows)
+
+
+def update_bm25_index(index_dir: Path, dead_rows: np.ndarray, new_texts: list[str], chunk_rows: np.ndarray) -> None:
+    """
+    Patch bm25.npz after an in-place update without re-tokenizing the existing rows.
+
+    Args:
+        index_dir: Index directory holding bm25.npz.
+        dead_rows: Rows that must stop matching (deleted and replaced reviews).
+        new_texts: clean_comment of the rows appended to the review store, in order.
+        chunk_rows: Row of every vector id after the update (-1 if the chunk has no row).
+    """
+    with np.load(index_dir / BM25_FILE) as data:
+        terms, term_ptr = data["terms"], data["term_ptr"]
+        post_rows, post_tf, row_len = data["post_rows"], data["post_tf"], data["row_len"].copy()
+
+    term_ids = np.repeat(np.arange(len(terms)), np.diff(term_ptr))
+    keep = ~np.isin(post_rows, dead_rows)
+    term_ids, post_rows, post_tf = term_ids[keep], post_rows[keep], post_tf[keep]
+    row_len[dead_rows] = 0
+
+    new_terms, new_rows, new_tf, new_len = [], [], [], []
+    for row, text in enumerate(new_texts, start=len(row_len)):
+        tokens = tokenize(text)
+        new_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            new_terms.append(term)
+            new_rows.append(row)
+            new_tf.append(tf)
+    new_terms = np.array(new_terms, dtype=str)
+
+    # Terms left without postings stay in the vocabulary; they score like unknown terms
+    vocab = np.union1d(terms, new_terms)
+    term_ids = np.concatenate([np.searchsorted(vocab, terms)[term_ids], np.searchsorted(vocab, new_terms)])
+    post_rows = np.concatenate([post_rows, np.array(new_rows, dtype=np.int32)])
+    post_tf = np.concatenate([post_tf, np.array(new_tf, dtype=np.uint16)])
+    order = np.lexsort((post_rows, term_ids))
+    term_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=term_ptr[1:])
+
+    _save(
+        index_dir, vocab, term_ptr, post_rows[order], post_tf[order],
+        np.concatenate([row_len, np.array(new_len, dtype=np.int32)]), np.asarray(chunk_rows, dtype=np.int32),
+    )
+
+
+def _save(
+    index_dir: Path,
+    terms: np.ndarray,
+    term_ptr: np.ndarray,
+    post_rows: np.ndarray,
+    post_tf: np.ndarray,
+    row_len: np.ndarray,
+    chunk_rows: np.ndarray,
+) -> None:
+    """Write bm25.npz, deriving the row -> chunks mapping from chunk_rows."""
+    order = np.argsort(chunk_rows, kind="stable")
+    order = order[chunk_rows[order] >= 0]
+    row_chunk_ptr = np.zeros(len(row_len) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(chunk_rows[order], minlength=len(row_len)), out=row_chunk_ptr[1:])
+    save_arrays(
+        index_dir / BM25_FILE,
+        compressed=True,
+        terms=terms,
+        term_ptr=term_ptr,
+        post_rows=post_rows,
+        post_tf=post_tf,
+        row_len=row_len,
+        row_chunk_ptr=row_chunk_ptr,
+        row_chunks=order.astype(np.int64),
+        chunk_rows=chunk_rows,
+    )
+
+
+class BM25Index:
+    """Read-only BM25 index loaded from bm25.npz."""
+
+    def __init__(self, path: Path, k1: float = BM25_K1, b: float = BM25_B):
+        with np.load(path) as data:
+            self.terms = data["terms"]
+            self.term_ptr = data["term_ptr"]
+            self.post_rows = data["post_rows"]
+            self.post_tf = data["post_tf"].astype(np.float32)
+            self.row_len = data["row_len"].astype(np.float32)
+            self.row_chunk_ptr = data["row_chunk_ptr"]
+            self.row_chunks = data["row_chunks"]
+            self.chunk_rows = data["chunk_rows"]
+        self.k1 = k1
+        self.b = b
+        self.n_rows = len(self.row_len)
+        self.avg_len = float(self.row_len.mean()) if self.n_rows else 0.0
+        # Length normalization term of BM25, fixed per row
+        self._norm = k1 * (1.0 - b + b * self.row_len / max(self.avg_len, 1.0))
+
+    def _term_id(self, term: str) -> int:
+        # clean_comment is lemmatized; fall back to a naive singular form
+        candidates = (term, term[:-1]) if term.endswith("s") else (term,)
+        for candidate in candidates:
+            t = int(np.searchsorted(self.terms, candidate))
+            if t < len(self.terms) and self.terms[t] == candidate:
+                return t
+        return -1
+
+    def score_rows(self, query: str) -> np.ndarray:
+        """BM25 score of every row for the query (zeros when no term matches)."""
+        scores = np.zeros(self.n_rows, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self._term_id(term)
+            if t < 0:
+                continue
+            start, end = self.term_ptr[t], self.term_ptr[t + 1]
+            rows, tf = self.post_rows[start:end], self.post_tf[start:end]
+            df = end - start
+            idf = math.log(1.0 + (self.n_rows - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (self.k1 + 1.0) / (tf + self._norm[rows])
+        return scores
+
+    def score_chunks(self, query: str, ids: np.ndarray) -> np.ndarray:
+        """BM25 score of the row each vector id was cut from (0 for chunks without a row)."""
+        rows = self.chunk_rows[ids]
+        row_scores = self.score_rows(query)
+        return np.where(rows >= 0, row_scores[np.maximum(rows, 0)], 0.0).astype(np.float32)
+
+    def top_rows(
+        self, query: str, k: int, allowed: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return (row ids, scores) of the k best matching rows, best first.
+        allowed is an optional bool mask over vector ids; rows without an allowed chunk are skipped.
+        """
+        scores = self.score_rows(query)
+        if allowed is not None:
+            scores[~self._rows_with(allowed)] = 0.0
+        hits = np.flatnonzero(scores)
+        if k <= 0:
+            hits = hits[:0]
+        elif len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return hits, scores[hits]
+
+    def _rows_with(self, allowed: np.ndarray) -> np.ndarray:
+        rows = self.chunk_rows[allowed]
+        return np.bincount(rows[rows >= 0], minlength=self.n_rows) > 0
+
+    def chunks_of(self, row: int) -> np.ndarray:
+        """Vector ids of the chunks cut from a row."""
+        return self.row_chunks[self.row_chunk_ptr[row]:self.row_chunk_ptr[row + 1]]
+
+    def search(
+        self, query: str, k: int, allowed: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Lexical top-k over vector ids: rows ranked by BM25, each expanded to its chunks.
+        Returns (ids, scores) arrays of length <= k.
+        """
+        rows, row_scores = self.top_rows(query, k, allowed)
+        ids: list[int] = []
+        scores: list[float] = []
+        for row, score in zip(rows, row_scores):
+            for chunk in self.chunks_of(row):
+                if allowed is not None and not allowed[chunk]:
+                    continue
+                ids.append(int(chunk))
+                scores.append(float(score))
+                if len(ids) == k:
+                    return np.array(ids, dtype=np.int64), np.array(scores, dtype=np.float32)
+        return np.array(ids, dtype=np.int64), np.array(scores, dtype=np.float32)
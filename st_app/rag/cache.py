@@ -0,0 +1,349 @@
+"""
+RAG caches:
+- QueryEmbeddingCache: query embeddings in an in-memory LRU tier and a SQLite
+  tier that survives restarts, so repeated questions skip the embedding API call.
+- ResultCache: finished retrieval results per index build, so repeated
+  questions skip both the embedding API and the FAISS search.
+- EmbeddingStore: content-addressed, append-only document embeddings shared
+  by every index build, so re-chunked or re-indexed text is never paid for twice.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from hashlib import sha1, sha256
+from pathlib import Path
+from typing import Any, Hashable
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / "db" / "cache"
+QUERY_CACHE_PATH = Path(os.getenv("RAG_QUERY_CACHE_PATH", CACHE_DIR / "query_embeddings.sqlite3"))
+QUERY_CACHE_MEMORY_SIZE = int(os.getenv("RAG_QUERY_CACHE_MEMORY_SIZE", "1024"))
+RESULT_CACHE_SIZE = int(os.getenv("RAG_RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_TTL = float(os.getenv("RAG_RESULT_CACHE_TTL", "3600"))
+EMBEDDING_STORE_DIR = Path(os.getenv("RAG_EMBEDDING_STORE_DIR", CACHE_DIR / "embeddings"))
+
+
+def normalize_query(text: str) -> str:
+    """Normalize query text for cache keys (Unicode NFKC, casefold, collapsed whitespace)."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping; entries optionally expire ttl seconds after put()."""
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class QueryEmbeddingCache:
+    """
+    Two-tier cache of query embeddings keyed by (model, normalized query).
+
+    Vectors are stored as float32 blobs in SQLite; the hottest entries are
+    also kept in memory as ready-to-return lists.
+    """
+
+    def __init__(self, path: Path = QUERY_CACHE_PATH, memory_size: int = QUERY_CACHE_MEMORY_SIZE):
+        self.path = Path(path)
+        self._memory = LRUCache(memory_size)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _key(model: str, query: str) -> str:
+        return sha256(f"{model}\x00{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, query: str) -> list[float] | None:
+        """Return the cached embedding, or None on a miss (counted in stats())."""
+        key = self._key(model, query)
+        vector = self._memory.get(key)
+        if vector is not None:
+            self.memory_hits += 1
+            return vector
+
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        self._memory.put(key, vector)
+        self.disk_hits += 1
+        return vector
+
+    def put(self, model: str, query: str, vector: list[float]) -> None:
+        """Store an embedding in both tiers."""
+        key = self._key(model, query)
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, model, query, vector) VALUES (?, ?, ?, ?)",
+                (key, model, normalize_query(query), blob),
+            )
+            conn.commit()
+        self._memory.put(key, list(vector))
+
+    def stats(self) -> dict:
+        """Hit/miss counters since process start."""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves embed_query() from a QueryEmbeddingCache.
+    Document embeddings are passed straight through to the wrapped model.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: QueryEmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        # The SQLite tier blocks, so both cache calls run in a worker thread
+        vector = await asyncio.to_thread(self.cache.get, self.model, text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put, self.model, text, vector)
+        return vector
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed several queries, sending only the cache misses to the wrapped model
+        in one batched call when it provides embed_queries().
+        """
+        vectors: list[list[float] | None] = [self.cache.get(self.model, t) for t in texts]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            miss_texts = [texts[i] for i in missing]
+            batch_embed = getattr(self.embeddings, "embed_queries", None)
+            if batch_embed is not None:
+                new_vectors = batch_embed(miss_texts)
+            else:
+                new_vectors = [self.embeddings.embed_query(t) for t in miss_texts]
+            for i, text, vector in zip(missing, miss_texts, new_vectors):
+                self.cache.put(self.model, text, vector)
+                vectors[i] = vector
+        return vectors
+
+
+class ResultCache:
+    """
+    Retrieval results keyed by (index build id, normalized query, retrieval options).
+    Rebuilding an index changes its build id, so stale results are never served;
+    they simply age out of the LRU. Several title indexes can share one cache.
+    Documents are copied on put() and get(), so callers may modify what they get.
+    """
+
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self._entries = LRUCache(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, build_id: str, query: str, options: Hashable) -> list[Document] | None:
+        results = self._entries.get((build_id, normalize_query(query), options))
+        if results is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [doc.model_copy(deep=True) for doc in results]
+
+    def put(self, build_id: str, query: str, options: Hashable, results: list[Document]) -> None:
+        copies = tuple(doc.model_copy(deep=True) for doc in results)
+        self._entries.put((build_id, normalize_query(query), options), copies)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+class EmbeddingStore:
+    """
+    Content-addressed document embeddings, keyed by sha1(model, text).
+
+    Each model has two append-only files: <model>.keys holds the 20-byte keys
+    and <model>.f32 an 8-byte dimension header followed by the float32 vectors
+    in the same row order. Vectors are written before their keys, so a crash
+    leaves at most trailing vector bytes, which the next append overwrites.
+    Assumes a single writing process; reads are safe at any time.
+    """
+
+    _KEY_BYTES = 20
+    _HEADER_BYTES = 8
+
+    def __init__(self, root: Path = EMBEDDING_STORE_DIR):
+        self.root = Path(root)
+        self._rows: dict[str, dict[bytes, int]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, model: str) -> tuple[Path, Path]:
+        name = f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', model)[:64]}-{sha1(model.encode('utf-8')).hexdigest()[:8]}"
+        return self.root / f"{name}.keys", self.root / f"{name}.f32"
+
+    @staticmethod
+    def _key(model: str, text: str) -> bytes:
+        return sha1(f"{model}\x00{text}".encode("utf-8")).digest()
+
+    def _model_rows(self, model: str) -> dict[bytes, int]:
+        rows = self._rows.get(model)
+        if rows is None:
+            keys_path, _ = self._paths(model)
+            data = keys_path.read_bytes() if keys_path.exists() else b""
+            n = len(data) // self._KEY_BYTES
+            rows = {data[i * self._KEY_BYTES:(i + 1) * self._KEY_BYTES]: i for i in range(n)}
+            self._rows[model] = rows
+        return rows
+
+    def lookup(self, model: str, texts: list[str]) -> np.ndarray:
+        """Row of every text in the model's store, -1 where it has not been embedded yet."""
+        with self._lock:
+            rows = self._model_rows(model)
+            found = np.fromiter(
+                (rows.get(self._key(model, t), -1) for t in texts), dtype=np.int64, count=len(texts)
+            )
+        hits = int((found >= 0).sum())
+        self.hits += hits
+        self.misses += len(texts) - hits
+        return found
+
+    def _dim(self, vectors_path: Path) -> int | None:
+        if not vectors_path.exists() or vectors_path.stat().st_size < self._HEADER_BYTES:
+            return None
+        return int(np.fromfile(vectors_path, dtype=np.uint64, count=1)[0])
+
+    def vectors(self, model: str, rows: np.ndarray) -> np.ndarray:
+        """Vectors of the given rows (all must exist) as an (n, dim) float32 array."""
+        _, vectors_path = self._paths(model)
+        with self._lock:
+            n = len(self._model_rows(model))
+        data = np.memmap(
+            vectors_path, dtype=np.float32, mode="r", offset=self._HEADER_BYTES, shape=(n, self._dim(vectors_path))
+        )
+        return np.array(data[rows])
+
+    def append(self, model: str, texts: list[str], vectors: np.ndarray) -> np.ndarray:
+        """Add the vectors of texts not stored yet; returns the row of every text, as lookup() would."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        keys_path, vectors_path = self._paths(model)
+        with self._lock:
+            rows = self._model_rows(model)
+            dim = self._dim(vectors_path)
+            if dim is not None and dim != vectors.shape[1]:
+                raise ValueError(f"Embedding store for {model!r} holds {dim}-d vectors, got {vectors.shape[1]}-d")
+
+            n = len(rows)
+            keys = [self._key(model, text) for text in texts]
+            new_keys, new_rows, text_rows = {}, [], np.empty(len(texts), dtype=np.int64)
+            for i, key in enumerate(keys):
+                row = rows.get(key, new_keys.get(key))
+                if row is None:
+                    row = new_keys[key] = n + len(new_rows)
+                    new_rows.append(i)
+                text_rows[i] = row
+            if not new_keys:
+                return text_rows
+
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(vectors_path, "r+b" if dim is not None else "wb") as f:
+                if dim is None:
+                    f.write(np.uint64(vectors.shape[1]).tobytes())
+                # Drop vectors left behind by an append that never wrote its keys
+                f.truncate(self._HEADER_BYTES + n * vectors.shape[1] * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(vectors[new_rows]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(keys_path, "ab") as f:
+                f.truncate(n * self._KEY_BYTES)
+                f.write(b"".join(new_keys))
+            rows.update(new_keys)
+            return text_rows
+
+    def stats(self) -> dict:
+        """Hit/miss counters since process start."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
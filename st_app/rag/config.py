@@ -0,0 +1,79 @@
+"""
+RAG index and embedding settings. Every value can be overridden with the
+environment variable of the same name prefixed with RAG_ (e.g. RAG_INDEX_TYPE=hnsw).
+"""
+import os
+
+# Index layout built by st_app.rag.embedder: flat | ivf_flat | ivf_pq | hnsw
+INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat")
+
+# IVF: number of coarse clusters (0 = about 4 * sqrt(n), capped by training size)
+IVF_NLIST = int(os.getenv("RAG_IVF_NLIST", "0"))
+# IVF: clusters visited per query (runtime; higher = better recall, slower)
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "8"))
+
+# IVF-PQ: sub-quantizers (must divide the vector dimension) and bits per code
+PQ_M = int(os.getenv("RAG_PQ_M", "64"))
+PQ_NBITS = int(os.getenv("RAG_PQ_NBITS", "8"))
+
+# Optional PCA projection learned at build time (0 = keep the embedding dimension).
+# Queries are projected by the same matrix inside the FAISS index.
+PCA_DIM = int(os.getenv("RAG_PCA_DIM", "0"))
+# Stored vector encoding: float32 | fp16 | int8 | pq (PQ_M x PQ_NBITS codes)
+VECTOR_CODEC = os.getenv("RAG_VECTOR_CODEC", "float32")
+
+# HNSW: graph degree, build-time and runtime beam widths
+HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF_SEARCH", "64"))
+
+# Threads used to search the per-site shards concurrently (FAISS releases the GIL)
+SHARD_WORKERS = int(os.getenv("RAG_SHARD_WORKERS", "3"))
+
+# Published index versions kept per index root (see st_app.rag.versions); older
+# ones are deleted after each build. The current and previous versions always stay.
+INDEX_KEEP_VERSIONS = int(os.getenv("RAG_INDEX_KEEP_VERSIONS", "3"))
+
+# Title namespaces (see st_app.rag.namespaces): the title served from the legacy
+# st_app/db/faiss_index directory, and the budget for indexes kept open at once.
+# Least recently used titles are closed when either limit is exceeded.
+DEFAULT_TITLE = os.getenv("RAG_DEFAULT_TITLE", "zootopia")
+NAMESPACE_MAX_MB = float(os.getenv("RAG_NAMESPACE_MAX_MB", "2048"))
+NAMESPACE_MAX_RESIDENT = int(os.getenv("RAG_NAMESPACE_MAX_RESIDENT", "8"))
+
+# Embedding provider used for new index builds: upstage | local (see st_app.rag.embeddings).
+# Queries always use the provider recorded in the index directory.
+EMBEDDING_PROVIDER = os.getenv("RAG_EMBEDDING_PROVIDER", "upstage")
+EMBEDDING_MODEL = os.getenv("RAG_EMBEDDING_MODEL", "solar-embedding-1-large")
+# Output dimension of the local TF-IDF + SVD embedder
+LOCAL_EMBEDDING_DIM = int(os.getenv("RAG_LOCAL_EMBEDDING_DIM", "256"))
+# Review comments longer than this many characters are split into overlapping
+# chunks (well inside the 4000-token window of solar-embedding-1-large)
+REVIEW_CHUNK_CHARS = int(os.getenv("RAG_REVIEW_CHUNK_CHARS", "2000"))
+REVIEW_CHUNK_OVERLAP = int(os.getenv("RAG_REVIEW_CHUNK_OVERLAP", "200"))
+
+# Index build embedding jobs (see st_app.rag.embed_jobs): texts per request,
+# requests in flight, request rate limit (per second, 0 = unlimited), and
+# retries per batch with exponential backoff starting at EMBED_BACKOFF seconds.
+# Upstage takes at most 100 texts per request; larger batches are sent as several.
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "100"))
+EMBED_CONCURRENCY = int(os.getenv("RAG_EMBED_CONCURRENCY", "4"))
+EMBED_RATE_LIMIT = float(os.getenv("RAG_EMBED_RATE_LIMIT", "0"))
+EMBED_MAX_RETRIES = int(os.getenv("RAG_EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF = float(os.getenv("RAG_EMBED_BACKOFF", "1.0"))
+
+# Index builds stream each review CSV in batches of this many rows and
+# checkpoint the embedded vectors after every batch (see st_app.rag.embedder)
+BUILD_BATCH_ROWS = int(os.getenv("RAG_BUILD_BATCH_ROWS", "1000"))
+
+# Parallel index builds: FAISS OpenMP threads and, with the local (CPU-bound)
+# provider, worker processes for CSV parsing, content hashing and embedding
+# (0 = every core).
+BUILD_WORKERS = int(os.getenv("RAG_BUILD_WORKERS", "0"))
+# Vectors sampled to train IVF centroids, PCA and PQ codebooks (raised to at
+# least 64 per IVF list and PQ centroid), and vectors per FAISS add call
+TRAIN_SAMPLE_SIZE = int(os.getenv("RAG_TRAIN_SAMPLE_SIZE", "65536"))
+ADD_BATCH_SIZE = int(os.getenv("RAG_ADD_BATCH_SIZE", "65536"))
+# Measure recall vs memory of every built shard and of each vector codec
+# (build_report.json; slow on large shards, so off unless set to 1)
+RECALL_REPORT = os.getenv("RAG_RECALL_REPORT", "0") == "1"
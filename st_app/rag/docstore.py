@@ -0,0 +1,345 @@
+"""
+Columnar chunk store of a ReviewIndex directory, sliced lazily by vector id.
+
+    docs.text          UTF-8 page_content of every slot, concatenated
+    docs.offsets.npy   uint64 byte offsets into docs.text (len = slots + 1)
+    docs.meta.json     metadata keys and the type of each one's column
+    docs.meta.<key>.npy, docs.meta.<key>.missing.npy | docs.meta.<key>.values.npy
+                       one uncompressed column per metadata key, in slot order
+
+docs.text and every column are memory-mapped, so opening a store reads only
+headers and a lookup decodes one slice and one value per key. Metadata columns
+are typed: ints and floats are stored as arrays with a missing mask, strings
+are dictionary-encoded (codes into a table of values), and anything else as
+dictionary-encoded JSON. A key that is missing or None in a document is left
+out of its metadata. Appending documents appends to each column in place.
+
+Indexes written before docs.text keep docs.jsonl (one JSON object per slot,
+with the same offsets file), and ones written before the column files keep
+docs.meta.npz (every column in one archive); both are still read and updating
+one converts it.
+"""
+import json
+import mmap
+import os
+from numbers import Integral, Real
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from st_app.rag.files import TMP_SUFFIX, append_array, replace_text, save_array
+
+DOCS_TEXT_FILE = "docs.text"
+DOC_OFFSETS_FILE = "docs.offsets.npy"
+DOC_META_FILE = "docs.meta.json"
+LEGACY_META_FILE = "docs.meta.npz"
+LEGACY_DOCS_FILE = "docs.jsonl"
+DOCSTORE_FILES = (DOCS_TEXT_FILE, DOC_OFFSETS_FILE, DOC_META_FILE)
+_SCHEMA = "__schema__"
+# Column type of values of two types together (see _column_kind)
+_WIDER_KIND = {frozenset(("int", "float")): "float", frozenset(("str", "json")): "json"}
+
+
+def _column_kind(values: list) -> str:
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, bool) for v in present):
+        return "bool"
+    if all(isinstance(v, Integral) and not isinstance(v, bool) for v in present):
+        return "int"
+    if all(isinstance(v, Real) and not isinstance(v, bool) for v in present):
+        return "float"
+    if all(isinstance(v, str) for v in present):
+        return "str"
+    return "json"
+
+
+def _encode_column(key: str, values: list, kind: str) -> dict[str, np.ndarray]:
+    """Arrays of one metadata column of the given kind (see encode_metadata)."""
+    missing = np.array([v is None for v in values], dtype=bool)
+    if kind in ("bool", "int"):
+        data = np.array([0 if v is None else v for v in values], dtype=np.int64)
+        return {key: data, f"{key}.missing": missing}
+    if kind == "float":
+        data = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        return {key: data, f"{key}.missing": missing}
+    texts = [None if v is None else (v if kind == "str" else json.dumps(v, ensure_ascii=False)) for v in values]
+    table = list(dict.fromkeys(t for t in texts if t is not None))
+    codes = {t: i for i, t in enumerate(table)}
+    return {
+        key: np.array([-1 if t is None else codes[t] for t in texts], dtype=np.int32),
+        f"{key}.values": np.array(table, dtype=str),
+    }
+
+
+def encode_metadata(metadatas: list[dict]) -> dict[str, np.ndarray]:
+    """Metadata dicts (one per slot) as typed columns, with the schema under _SCHEMA."""
+    keys = list(dict.fromkeys(k for metadata in metadatas for k in metadata))
+    columns, schema = {}, {}
+    for key in keys:
+        values = [metadata.get(key) for metadata in metadatas]
+        schema[key] = _column_kind(values)
+        columns.update(_encode_column(key, values, schema[key]))
+    columns[_SCHEMA] = np.array(json.dumps(schema))
+    return columns
+
+
+def decode_metadata(columns: dict[str, np.ndarray]) -> list[dict]:
+    """Inverse of encode_metadata()."""
+    schema = json.loads(str(columns[_SCHEMA]))
+    n = len(next(iter(columns[k] for k in schema))) if schema else 0
+    metadatas: list[dict] = [{} for _ in range(n)]
+    for key, kind in schema.items():
+        for i, value in enumerate(_ColumnReader(key, kind, columns).values()):
+            if value is not None:
+                metadatas[i][key] = value
+    return metadatas
+
+
+class _ColumnReader:
+    """One metadata column, decoded one value at a time; get(i) returns None for missing values."""
+
+    def __init__(self, key: str, kind: str, columns: dict[str, np.ndarray]):
+        self.key = key
+        self.kind = kind
+        self.data = columns[key]
+        self.missing = columns.get(f"{key}.missing")
+        self.table = columns.get(f"{key}.values")
+
+    def get(self, i: int):
+        if self.table is not None:
+            code = int(self.data[i])
+            if code < 0:
+                return None
+            text = str(self.table[code])
+            return text if self.kind == "str" else json.loads(text)
+        if self.missing[i]:
+            return None
+        value = self.data[i]
+        return bool(value) if self.kind == "bool" else (int(value) if self.kind == "int" else float(value))
+
+    def values(self, n: int | None = None) -> list:
+        return [self.get(i) for i in range(len(self.data) if n is None else n)]
+
+
+def _column_path(index_dir: Path, name: str) -> Path:
+    return index_dir / f"docs.meta.{name}.npy"
+
+
+def _column_names(key: str, kind: str) -> list[str]:
+    return [key, f"{key}.values" if kind in ("str", "json") else f"{key}.missing"]
+
+
+def _load_schema(index_dir: Path) -> dict[str, str]:
+    return json.loads((index_dir / DOC_META_FILE).read_text(encoding="utf-8"))
+
+
+def _open_columns(index_dir: Path, schema: dict[str, str]) -> dict[str, np.ndarray]:
+    """Memory-mapped column arrays of a schema; nothing is decoded."""
+    return {
+        name: np.load(_column_path(index_dir, name), mmap_mode="r")
+        for key, kind in schema.items()
+        for name in _column_names(key, kind)
+    }
+
+
+def metadata_files(index_dir: Path) -> list[Path]:
+    """docs.meta.json and the column files it lists (empty for stores without them)."""
+    if not (index_dir / DOC_META_FILE).exists():
+        return []
+    names = [name for key, kind in _load_schema(index_dir).items() for name in _column_names(key, kind)]
+    return [index_dir / DOC_META_FILE] + [_column_path(index_dir, name) for name in names]
+
+
+def _append_metadata(index_dir: Path, n: int, metadatas: list[dict], schema: dict[str, str]) -> dict[str, str]:
+    """
+    Write the metadata of the slots after slot n into the column files of schema
+    and return the extended schema; the caller saves it as docs.meta.json.
+
+    Existing columns are appended to in place (see append_array): only the new
+    values are encoded, and strings new to a column join the end of its table.
+    A new key gets a column with the first n slots missing, and a column whose
+    type changes (e.g. int to float) is rewritten in the wider type.
+    """
+    schema = dict(schema)
+    keys = list(dict.fromkeys([*schema, *(k for metadata in metadatas for k in metadata)]))
+    for key in keys:
+        values = [metadata.get(key) for metadata in metadatas]
+        # Values that are all None have no type of their own
+        kind = _column_kind(values) if any(v is not None for v in values) else None
+        old_kind = schema.get(key)
+        if old_kind is None and kind is None:
+            continue
+        if old_kind is None or (kind is not None and kind != old_kind):
+            wider = kind if old_kind is None else _WIDER_KIND.get(frozenset((old_kind, kind)), "json")
+            if wider != old_kind:
+                old_values = (
+                    _ColumnReader(key, old_kind, _open_columns(index_dir, {key: old_kind})).values(n)
+                    if old_kind is not None else [None] * n
+                )
+                for name in _column_names(key, old_kind or wider):
+                    _column_path(index_dir, name).unlink(missing_ok=True)
+                for name, array in _encode_column(key, old_values + values, wider).items():
+                    save_array(_column_path(index_dir, name), array)
+                schema[key] = wider
+                continue
+
+        kind = schema[key]
+        arrays = _encode_column(key, values, kind)
+        if kind in ("str", "json"):
+            table_path = _column_path(index_dir, f"{key}.values")
+            start = len(np.load(table_path, mmap_mode="r"))
+            codes = arrays[key]
+            arrays[key] = np.where(codes >= 0, codes + start, -1).astype(np.int32)
+            append_array(table_path, start, arrays[f"{key}.values"])
+        else:
+            append_array(_column_path(index_dir, f"{key}.missing"), n, arrays[f"{key}.missing"])
+        append_array(_column_path(index_dir, key), n, arrays[key])
+    return schema
+
+
+class DocumentWriter:
+    """
+    Write a docstore batch by batch: page_content goes straight to docs.text
+    and metadata is appended to the column files, so nothing is kept in memory.
+
+        writer = DocumentWriter(index_dir)
+        for documents in batches:
+            writer.add(documents)
+        offsets = writer.close()
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._text_path = self.index_dir / (DOCS_TEXT_FILE + TMP_SUFFIX)
+        self._text = open(self._text_path, "wb")
+        self._offsets = [np.zeros(1, dtype=np.uint64)]
+        self._schema: dict[str, str] = {}
+        # Columns of an earlier, interrupted write are started over
+        for path in self.index_dir.glob("docs.meta.*.npy"):
+            path.unlink()
+
+    def __len__(self) -> int:
+        return int(sum(len(offsets) for offsets in self._offsets)) - 1
+
+    def add(self, documents: list[Document]) -> None:
+        """Append documents; they take the next slots."""
+        sizes = np.zeros(len(documents), dtype=np.uint64)
+        for i, doc in enumerate(documents):
+            data = doc.page_content.encode("utf-8")
+            self._text.write(data)
+            sizes[i] = len(data)
+        self._schema = _append_metadata(self.index_dir, len(self), [doc.metadata for doc in documents], self._schema)
+        self._offsets.append(self._offsets[-1][-1] + np.cumsum(sizes, dtype=np.uint64))
+
+    def close(self) -> np.ndarray:
+        """
+        Publish docs.text and docs.meta.json.
+
+        Returns:
+            The byte offsets; the caller publishes them as docs.offsets.npy.
+        """
+        self._text.close()
+        os.replace(self._text_path, self.index_dir / DOCS_TEXT_FILE)
+        replace_text(self.index_dir / DOC_META_FILE, json.dumps(self._schema))
+        (self.index_dir / LEGACY_META_FILE).unlink(missing_ok=True)
+        return np.concatenate(self._offsets)
+
+
+def write_documents(index_dir: Path, documents: list[Document]) -> np.ndarray:
+    """
+    Write docs.text and the metadata columns for documents in slot order.
+
+    Returns:
+        The byte offsets; the caller publishes them as docs.offsets.npy.
+    """
+    writer = DocumentWriter(index_dir)
+    writer.add(documents)
+    return writer.close()
+
+
+def append_documents(index_dir: Path, offsets: np.ndarray, documents: list[Document]) -> np.ndarray:
+    """
+    Append documents after the last indexed slot and return the extended offsets.
+    Readers only follow the offsets, so nothing appended is visible until the
+    caller replaces docs.offsets.npy. docs.text and the column files are written
+    in place; detach them first when they are hard-linked (see metadata_files).
+    """
+    if not (index_dir / DOCS_TEXT_FILE).exists():
+        existing = DocStore(index_dir, offsets).documents()
+        return write_documents(index_dir, existing + documents)
+
+    n = len(offsets) - 1
+    if (index_dir / DOC_META_FILE).exists():
+        schema = _load_schema(index_dir)
+    else:
+        # Stores written with docs.meta.npz are converted to column files once
+        with np.load(index_dir / LEGACY_META_FILE) as data:
+            metadatas = decode_metadata(dict(data))[:n]
+        schema = _append_metadata(index_dir, 0, metadatas, {})
+
+    end = int(offsets[-1])
+    new_offsets = [end]
+    with open(index_dir / DOCS_TEXT_FILE, "r+b") as f:
+        f.truncate(end)
+        f.seek(end)
+        for doc in documents:
+            data = doc.page_content.encode("utf-8")
+            f.write(data)
+            new_offsets.append(new_offsets[-1] + len(data))
+
+    schema = _append_metadata(index_dir, n, [doc.metadata for doc in documents], schema)
+    replace_text(index_dir / DOC_META_FILE, json.dumps(schema))
+    (index_dir / LEGACY_META_FILE).unlink(missing_ok=True)
+    return np.concatenate([offsets, np.array(new_offsets[1:], dtype=np.uint64)])
+
+
+def docstore_exists(index_dir: Path) -> bool:
+    """Whether index_dir holds documents in either format."""
+    return (index_dir / DOC_OFFSETS_FILE).exists() and (
+        (index_dir / DOCS_TEXT_FILE).exists() or (index_dir / LEGACY_DOCS_FILE).exists()
+    )
+
+
+class DocStore:
+    """Read-only documents of an index directory, decoded one slot at a time."""
+
+    def __init__(self, index_dir: Path, offsets: np.ndarray | None = None):
+        self.index_dir = Path(index_dir)
+        self._offsets = offsets if offsets is not None else np.load(self.index_dir / DOC_OFFSETS_FILE, mmap_mode="r")
+        self._legacy = not (self.index_dir / DOCS_TEXT_FILE).exists()
+        path = self.index_dir / (LEGACY_DOCS_FILE if self._legacy else DOCS_TEXT_FILE)
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b""
+        self._columns: list[_ColumnReader] = []
+        if self._legacy:
+            return
+        if (self.index_dir / DOC_META_FILE).exists():
+            schema = _load_schema(self.index_dir)
+            columns = _open_columns(self.index_dir, schema)
+        else:
+            with np.load(self.index_dir / LEGACY_META_FILE) as data:
+                columns = dict(data)
+            schema = json.loads(str(columns[_SCHEMA]))
+        self._columns = [_ColumnReader(key, kind, columns) for key, kind in schema.items()]
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, i: int) -> Document:
+        """Decode the document of slot i."""
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        if self._legacy:
+            record = json.loads(self._data[start:end])
+            return Document(page_content=record["page_content"], metadata=record["metadata"])
+        metadata = {}
+        for column in self._columns:
+            value = column.get(i)
+            if value is not None:
+                metadata[column.key] = value
+        return Document(page_content=self._data[start:end].decode("utf-8"), metadata=metadata)
+
+    def documents(self) -> list[Document]:
+        """Every slot's document, in slot order."""
+        return [self.get(i) for i in range(len(self))]
@@ -0,0 +1,104 @@
+"""
+How reviews become indexed chunks, and the content hash used to tell whether
+a review changed since the last build.
+
+Only the comment body is embedded. Rating, date, site and subjectivity travel
+as typed chunk metadata (they are filtered and re-ranked on, not matched as
+text), and a comment is split only when it exceeds REVIEW_CHUNK_CHARS, so most
+reviews are exactly one vector. Reviews without a comment get no vector.
+
+Every ReviewIndex directory keeps content_hashes.json, mapping the review_id
+of each indexed review to its content hash, including reviews that have no
+vector. An incremental build diffs the CSVs against it and embeds only new
+or changed reviews.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Iterable
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from st_app.rag import config
+from st_app.rag.files import replace_text
+
+CONTENT_HASHES_FILE = "content_hashes.json"
+# Review record fields whose change requires re-indexing the review
+HASHED_FIELDS = ("site", "rating_value", "date", "comment", "clean_comment", "word_count", "subjectivity_score")
+# Identifies how chunks are cut; shards built with another layout are rebuilt in full
+CHUNK_LAYOUT = f"comment-{config.REVIEW_CHUNK_CHARS}-{config.REVIEW_CHUNK_OVERLAP}"
+
+
+def text_splitter() -> RecursiveCharacterTextSplitter:
+    """Splitter for comments longer than one embedding window."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=config.REVIEW_CHUNK_CHARS,
+        chunk_overlap=config.REVIEW_CHUNK_OVERLAP,
+    )
+
+
+def chunk_metadata(record: dict) -> dict:
+    """Typed metadata of every chunk of a review record."""
+    return {
+        "review_id": record["review_id"],
+        "source": record.get("source"),
+        "row": record.get("row"),
+        "site": record.get("site"),
+        "rating": record.get("rating_value"),
+        "date": record.get("date"),
+        "subjectivity": record.get("subjectivity_score"),
+    }
+
+
+def review_chunks(records: list[dict]) -> tuple[list[Document], list[int]]:
+    """
+    Chunks to embed for review records: the comment, split only if longer than REVIEW_CHUNK_CHARS.
+
+    Returns:
+        chunks: Documents in vector order.
+        chunk_records: Index into records of every chunk.
+    """
+    splitter = text_splitter()
+    chunks, chunk_records = [], []
+    for i, record in enumerate(records):
+        comment = (record.get("comment") or "").strip()
+        if not comment:
+            continue
+        pieces = [comment] if len(comment) <= config.REVIEW_CHUNK_CHARS else splitter.split_text(comment)
+        metadata = chunk_metadata(record)
+        for piece in pieces:
+            chunks.append(Document(page_content=piece, metadata=dict(metadata)))
+            chunk_records.append(i)
+    return chunks, chunk_records
+
+
+def content_hash(record: dict) -> str:
+    """Hash of the indexed content of a review record (see st_app.rag.reviews.review_record)."""
+    payload = json.dumps({name: record.get(name) for name in HASHED_FIELDS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def content_hashes(records: Iterable[dict]) -> dict[str, str]:
+    """review_id -> content hash of review records."""
+    return {record["review_id"]: content_hash(record) for record in records}
+
+
+def write_content_hashes(index_dir: Path, hashes: dict[str, str]) -> None:
+    """
+    Write content_hashes.json.
+
+    Args:
+        index_dir: ReviewIndex directory.
+        hashes: review_id -> content hash of every review in the index, with or
+            without chunks (see content_hashes()).
+    """
+    replace_text(index_dir / CONTENT_HASHES_FILE, json.dumps(hashes, ensure_ascii=False))
+
+
+def load_content_hashes(index_dir: Path) -> dict[str, str] | None:
+    """review_id -> content hash of an index directory, or None if it predates content hashes."""
+    try:
+        return json.loads((index_dir / CONTENT_HASHES_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
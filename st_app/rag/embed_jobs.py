@@ -0,0 +1,209 @@
+"""
+Embedding job runner for index builds.
+
+Texts are cut into batches and embedded by a bounded pool of worker threads,
+each request waiting on the runner's token bucket, so a build that shares one
+runner across all its calls never exceeds the provider's request rate. A batch
+failing with a transient error (rate limit, timeout, dropped connection) is
+retried with exponential backoff and jitter; other errors, and transient ones
+once retries run out, fail the build instead of indexing a hole. Progress and
+the final throughput are printed in chunks per second.
+
+    runner = EmbeddingJobRunner(embeddings)
+    vectors = embed_texts(runner, [c.page_content for c in chunks])
+
+Batch size, concurrency, rate limit and retries default to the RAG_EMBED_*
+settings in st_app.rag.config. CPU-bound local models can instead be fanned
+out over a process pool (pool=..., model_dir=...), which sidesteps the GIL;
+each pool process loads the model from model_dir once and keeps it for every
+later batch of the build. Rate limits and retries do not apply there.
+
+With an EmbeddingStore, texts already embedded by the same model are read
+from it and only the rest are sent to the model.
+"""
+import random
+import threading
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import openai
+from langchain_core.embeddings import Embeddings
+
+from st_app.rag import config
+from st_app.rag.cache import EmbeddingStore
+from st_app.rag.embeddings import load_embedding_info, load_embeddings
+
+# Errors worth retrying a batch for: rate limits, timeouts, dropped connections and API server errors
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# Embeddings loaded by a pool process, keyed by (model directory, model name)
+_worker_embeddings: dict[tuple[str, str], Embeddings] = {}
+
+
+def _embed_in_worker(model_dir: str, texts: list[str]) -> np.ndarray:
+    """Embed texts in a pool process, loading the embeddings of model_dir on first use."""
+    info = load_embedding_info(Path(model_dir))
+    key = (model_dir, info["model"])
+    if key not in _worker_embeddings:
+        _worker_embeddings[key] = load_embeddings(Path(model_dir), info)[0]
+    return np.asarray(_worker_embeddings[key].embed_documents(texts), dtype=np.float32)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` acquisitions per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available (never blocks when rate <= 0)."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EmbeddingJobRunner:
+    """
+    Embeds a corpus in batches with bounded concurrency, rate limiting and retries.
+
+    Create one runner per build and pass it to every embed_texts() call, so the
+    rate limit holds across calls instead of restarting with a full bucket.
+
+    Batches sent to a process pool are not rate limited or retried: local
+    embeddings make no requests, so a failure there is a bug or a broken
+    pool (BrokenProcessPool), and it fails the build on the first attempt.
+
+    Args:
+        embeddings: Embeddings used for documents (embed_documents).
+        batch_size: Texts per request.
+        max_workers: Requests in flight at once.
+        requests_per_second: Token bucket rate (0 = unlimited).
+        max_retries: Retries per batch before the job fails; only TRANSIENT_ERRORS are retried.
+        backoff: Base delay in seconds, doubled on every retry.
+        pool: Process pool to embed in instead of threads, for CPU-bound local
+            embeddings; None = threads.
+        model_dir: Index directory the pool processes load the embeddings
+            from (see st_app.rag.embeddings.load_embeddings); required with pool.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = config.EMBED_BATCH_SIZE,
+        max_workers: int = config.EMBED_CONCURRENCY,
+        requests_per_second: float = config.EMBED_RATE_LIMIT,
+        max_retries: int = config.EMBED_MAX_RETRIES,
+        backoff: float = config.EMBED_BACKOFF,
+        pool: Executor | None = None,
+        model_dir: Path | None = None,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.bucket = TokenBucket(requests_per_second)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        if pool is not None and model_dir is None:
+            raise ValueError("Embedding in a process pool needs the model_dir to load the embeddings from.")
+        self.pool = pool
+        self.model_dir = model_dir
+        self._done = 0
+        self._lock = threading.Lock()
+
+    def _embed_batch(self, texts: list[str], total: int, started: float) -> np.ndarray:
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+                break
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                print(f"\nEmbedding batch failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+        if len(vectors) != len(texts):
+            raise ValueError(f"Embedding returned {len(vectors)} vectors for {len(texts)} texts")
+
+        self._progress(len(texts), total, started)
+        return vectors
+
+    def _progress(self, n: int, total: int, started: float) -> None:
+        with self._lock:
+            self._done += n
+            done = self._done
+        elapsed = time.perf_counter() - started
+        print(f"\rEmbedded {done}/{total} chunks ({done / max(elapsed, 1e-9):.0f} chunks/s)", end="", flush=True)
+
+    def _run_in_pool(self, batches: list[list[str]], total: int, started: float) -> list[np.ndarray]:
+        results = []
+        for vectors in self.pool.map(partial(_embed_in_worker, str(self.model_dir)), batches):
+            results.append(vectors)
+            self._progress(len(vectors), total, started)
+        return results
+
+    def run(self, texts: list[str]) -> np.ndarray:
+        """Embed texts into an (n, dim) float32 array in input order."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        self._done = 0
+        started = time.perf_counter()
+        if self.pool is not None and len(batches) > 1:
+            results = self._run_in_pool(batches, len(texts), started)
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+                results = list(pool.map(lambda batch: self._embed_batch(batch, len(texts), started), batches))
+        elapsed = time.perf_counter() - started
+        print(f"\nEmbedded {len(texts)} chunks in {len(batches)} batches in {elapsed:.1f}s "
+              f"({len(texts) / max(elapsed, 1e-9):.0f} chunks/s)")
+        return np.concatenate(results)
+
+
+def embed_texts(
+    runner: EmbeddingJobRunner,
+    texts: list[str],
+    store: EmbeddingStore | None = None,
+    model: str | None = None,
+) -> np.ndarray:
+    """
+    Embed texts with an EmbeddingJobRunner into an (n, dim) float32 array.
+
+    Args:
+        runner: Runner shared by every call of the build.
+        texts: Chunk texts, in output order.
+        store: Embedding store consulted first and extended with new vectors.
+        model: Model name the store keys vectors by (required with store).
+    """
+    if store is None:
+        return runner.run(texts)
+
+    rows = store.lookup(model, texts)
+    missing = np.flatnonzero(rows < 0)
+    print(f"Embedding store: {len(texts) - len(missing)}/{len(texts)} chunks already embedded by {model}")
+    if len(missing):
+        miss_texts = [texts[i] for i in missing]
+        rows[missing] = store.append(model, miss_texts, runner.run(miss_texts))
+    return store.vectors(model, rows)
@@ -1,73 +1,633 @@
 """
-RAG embedder: load review CSVs, generate embeddings, and save FAISS index.
+RAG embedder: load review CSVs, generate embeddings, and save one FAISS index shard per site.
+
+Every run writes a new version under <index_dir>/versions and publishes it by
+swapping the CURRENT pointer (see st_app.rag.versions), so running retrievers
+switch over without ever loading a partial build.
+
+Builds are incremental by default: when the current version was built with the
+same provider and index settings, each site's shard is copied and diffed
+against its content hashes (see st_app.rag.documents), and only new or changed
+reviews are embedded; removed reviews are dropped. The embedding model, IVF
+centroids and PCA stay those of the last full build; pass --full to refit them
+and to compact shards that accumulated deletions.
+
+Builds stream each CSV in batches of RAG_BUILD_BATCH_ROWS rows: every batch
+goes straight into the shard's FAISS index, docstore and review store, so
+memory does not grow with the site, and the embedded vectors and a row cursor
+are checkpointed after every batch. Finished shards are
+recorded in the staged version's build.json, so rerunning an interrupted build
+with the same settings and inputs skips them and resumes the site it stopped
+in at its cursor (--restart starts over).
+
+Builds use every core by default (--workers / RAG_BUILD_WORKERS): FAISS trains
+on a sample and adds vectors in batches on its OpenMP threads, and with the
+local provider, whose embedding is CPU-bound, one process pool per build parses
+and chunks CSV batches, computes content hashes and embeds. Remote providers
+keep to the embedding threads of st_app.rag.embed_jobs. Parallel and serial
+builds write identical shards.
+
+--recall-report (RAG_RECALL_REPORT=1) also measures the recall vs memory of
+every rebuilt shard and vector codec; it is off by default because the codec
+sweep trains a quantizer per codec.
 """
 import json
+import os
+import shutil
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Callable, Iterable, Iterator
 
+import faiss
+import numpy as np
 from dotenv import load_dotenv
-from langchain_community.document_loaders import CSVLoader, TextLoader
-from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_upstage import UpstageEmbeddings
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
+from st_app.rag import config
+from st_app.rag.bm25 import BM25Writer
+from st_app.rag.cache import EmbeddingStore
+from st_app.rag.docstore import DocumentWriter
+from st_app.rag.documents import (
+    CHUNK_LAYOUT,
+    content_hash,
+    content_hashes,
+    load_content_hashes,
+    review_chunks,
+    write_content_hashes,
+)
+from st_app.rag.embed_jobs import EmbeddingJobRunner, embed_texts
+from st_app.rag.embeddings import (
+    EMBEDDING_INFO_FILE,
+    EMBEDDING_PROVIDERS,
+    LOCAL_MODEL_FILE,
+    build_embeddings,
+    document_store,
+    is_cpu_bound,
+    load_embedding_info,
+    load_embeddings,
+)
+from st_app.rag.files import replace_text
+from st_app.rag.filters import SITES, FilterIndexWriter, site_of
+from st_app.rag.namespaces import DEFAULT_INDEX_DIR, title_index_dir
+from st_app.rag.reviews import (
+    CHUNK_REVIEWS_FILE,
+    ReviewStoreWriter,
+    iter_review_rows,
+    load_review_rows,
+    review_record,
+)
+from st_app.rag.shards import shard_dirs
+from st_app.rag.updates import update_shard
+from st_app.rag.versions import (
+    BUILD_STATE_FILE,
+    MANIFEST_FILE,
+    collect_garbage,
+    link_tree,
+    load_build_state,
+    load_manifest,
+    publish_version,
+    resolve_index_dir,
+    save_build_state,
+    stage_version,
+    write_manifest,
+)
+from st_app.rag.index_store import (
+    DELETED_FILE,
+    DOC_OFFSETS_FILE,
+    VECTOR_CODECS,
+    VERSION_FILE,
+    IndexBuilder,
+    describe_index,
+    recall_report,
+    write_build_id,
+    write_review_index,
+)
 
-def create_vector_db() -> None:
-    """Load review data, build embeddings, and save FAISS index to st_app/db/faiss_index."""
-    load_dotenv()
 
-    # Paths: script lives in st_app/rag/, project root is two levels up
-    project_root = Path(__file__).resolve().parent.parent.parent
-    index_dir = Path(__file__).resolve().parent.parent / "db" / "faiss_index"
+# Paths: script lives in st_app/rag/, project root is two levels up
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+DEFAULT_DATA_DIR = PROJECT_ROOT / "database"
+# Embedding cursor and vectors of a site whose shard is still being built
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_VECTORS_FILE = "checkpoint.f32"
+
 
+def _input_files(data_dir: Path) -> dict[str, Path]:
+    """Preprocessed review CSV per site."""
     input_files = [
-        project_root / "database" / "preprocessed_reviews_imdb.csv",
-        project_root / "database" / "preprocessed_reviews_letterboxd.csv",
-        project_root / "database" / "preprocessed_reviews_RottenTomatoes.csv",
+        data_dir / "preprocessed_reviews_imdb.csv",
+        data_dir / "preprocessed_reviews_letterboxd.csv",
+        data_dir / "preprocessed_reviews_RottenTomatoes.csv",
     ]
+    return {site_of(path): path for path in input_files}
+
+
+def _file_signature(path: Path) -> list[int]:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _row_record(row: dict) -> dict:
+    return review_record(row, source=row["source"], row=row["row"])
+
+
+def _row_hash(row: dict) -> str:
+    return content_hash(_row_record(row))
+
+
+def _parse_batch(rows: list[dict]) -> tuple[list[dict], list[Document], list[int]]:
+    """Review records of CSV rows with their chunks and the record index of every chunk."""
+    records = [_row_record(row) for row in rows]
+    chunks, chunk_records = review_chunks(records)
+    return records, chunks, chunk_records
+
+
+def _ordered_map(pool: Executor | None, fn: Callable, items: Iterable, ahead: int) -> Iterator:
+    """
+    fn over items in order, at most `ahead` items in flight in the pool.
+    Unlike Executor.map this does not drain items up front, so CSV batches stay streamed.
+    """
+    if pool is None:
+        yield from map(fn, items)
+        return
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
 
-    print("Loading data...")
-    all_docs = []
-    for path in input_files:
-        if not path.exists():
-            raise FileNotFoundError(f"Input file not found: {path}")
-        if path.suffix == ".csv":
-            loader = CSVLoader(str(path), encoding="utf-8")
-        else:
-            loader = TextLoader(str(path), encoding="utf-8")
-        all_docs.extend(loader.load())
-
-    print(f"Loaded {len(all_docs)} document(s). Splitting into chunks...")
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50,
+def _iter_review_batches(
+    path: Path, pool: Executor | None = None, workers: int = 1
+) -> Iterator[tuple[list[dict], list[Document], list[int]]]:
+    """Parsed and chunked reviews of a preprocessed CSV (see _parse_batch), BUILD_BATCH_ROWS rows at a time."""
+    if not path.exists():
+        raise FileNotFoundError(f"Input file not found: {path}")
+    yield from _ordered_map(pool, _parse_batch, iter_review_rows(path, config.BUILD_BATCH_ROWS), 2 * workers)
+
+
+def _corpus_texts(paths: list[Path], pool: Executor | None = None, workers: int = 1) -> list[str]:
+    """Chunk texts of the given CSVs, for providers that fit a model on the corpus."""
+    return [
+        chunk.page_content
+        for path in paths
+        for _, chunks, _ in _iter_review_batches(path, pool, workers)
+        for chunk in chunks
+    ]
+
+
+def _load_checkpoint(shard_dir: Path, model: str) -> dict:
+    """Cursor of a site's interrupted embedding pass, or an empty one."""
+    empty = {"model": model, "rows": 0, "chunks": 0, "dim": 0}
+    try:
+        checkpoint = json.loads((shard_dir / CHECKPOINT_FILE).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return empty
+    return checkpoint if checkpoint.get("model") == model else empty
+
+
+def _clear_checkpoint(shard_dir: Path) -> None:
+    for name in (CHECKPOINT_FILE, CHECKPOINT_VECTORS_FILE):
+        (shard_dir / name).unlink(missing_ok=True)
+
+
+def _shared_embeddings(
+    build_dir: Path, current_dir: Path, texts: list[str], provider: str, all_sites: bool
+) -> Embeddings:
+    """
+    Embeddings for the shards being built. A full build (re)creates them in the
+    new version; re-indexing some sites copies the ones recorded in the current
+    version so every shard stays in the same vector space.
+    """
+    if not all_sites and (current_dir / EMBEDDING_INFO_FILE).exists():
+        info = load_embedding_info(current_dir)
+        if info["provider"] != provider:
+            raise ValueError(
+                f"Index at {current_dir} was built with the {info['provider']!r} provider; "
+                f"rebuild all sites to switch to {provider!r}."
+            )
+        print(f"Reusing {info['model']} embeddings from {current_dir}")
+        for name in (EMBEDDING_INFO_FILE, LOCAL_MODEL_FILE):
+            if (current_dir / name).exists():
+                shutil.copy2(current_dir / name, build_dir / name)
+        return load_embeddings(build_dir, info)[0]
+    return build_embeddings(texts, build_dir, provider)
+
+
+def _build_shard(
+    shard_dir: Path,
+    path: Path,
+    runner: EmbeddingJobRunner,
+    store: EmbeddingStore | None,
+    model: str,
+    pca_dim: int,
+    codec: str,
+    pool: Executor | None = None,
+    workers: int = 1,
+    report: bool = False,
+) -> tuple[int, int]:
+    """
+    Stream a review CSV into one complete site shard, BUILD_BATCH_ROWS rows at a time.
+
+    Each batch is chunked, embedded and handed straight to the FAISS index
+    (see IndexBuilder) and to the docstore, review store, BM25 and filter
+    writers, so memory holds one batch and the per-vector arrays, not the
+    site's texts and vectors. The vectors are also appended to checkpoint.f32
+    and the row cursor saved to checkpoint.json: after an interruption the
+    rows before the cursor are parsed again and their vectors read back from
+    checkpoint.f32 instead of being embedded. With a pool, the next batches
+    are parsed by its `workers` processes while the current one is embedded
+    (by them too when the runner embeds in the pool). With report, the
+    recall vs memory of the shard is measured (see recall_report). The build
+    id is stamped last. A site without chunks leaves an incomplete shard to discard.
+
+    Returns:
+        The number of reviews and chunks of the site.
+    """
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    checkpoint = _load_checkpoint(shard_dir, model)
+    if checkpoint["rows"]:
+        print(f"Resuming after row {checkpoint['rows']} ({checkpoint['chunks']} chunks already embedded)")
+    vectors_path = shard_dir / CHECKPOINT_VECTORS_FILE
+    with open(vectors_path, "ab") as f:
+        # Drop vectors written after the last saved cursor
+        f.truncate(checkpoint["chunks"] * checkpoint["dim"] * 4)
+    embedded = (
+        np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(checkpoint["chunks"], checkpoint["dim"]))
+        if checkpoint["chunks"] else None
     )
-    chunks = splitter.split_documents(all_docs)
-    print(f"Created {len(chunks)} chunks.")
 
-    print("Creating index...")
-    embeddings = UpstageEmbeddings(model="solar-embedding-1-large")
-    vectorstore = FAISS.from_documents(chunks, embeddings)
+    # Index type and build parameters come from st_app.rag.config (RAG_INDEX_TYPE, ...)
+    builder = IndexBuilder(index_type=config.INDEX_TYPE, pca_dim=pca_dim, codec=codec)
+    documents = DocumentWriter(shard_dir)
+    reviews = ReviewStoreWriter(shard_dir)
+    bm25 = BM25Writer(shard_dir)
+    filters = FilterIndexWriter(shard_dir)
+    hashes: dict[str, str] = {}
+    with open(vectors_path, "ab") as f:
+        for records, chunks, chunk_records in _iter_review_batches(path, pool, workers):
+            # Chunks of rows before the cursor are already in checkpoint.f32
+            done = sum(1 for i in chunk_records if reviews.n_reviews + i < checkpoint["rows"])
+            if done:
+                builder.add(embedded[len(documents):len(documents) + done])
+            texts = [c.page_content for c in chunks[done:]]
+            if texts:
+                vectors = embed_texts(runner, texts, store=store, model=model)
+                f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+                checkpoint["dim"] = int(vectors.shape[1])
+                builder.add(vectors)
+            documents.add(chunks)
+            reviews.add(records, chunk_records)
+            bm25.add([r["clean_comment"] for r in records])
+            filters.add(records, chunk_records)
+            hashes.update(content_hashes(records))
+            if reviews.n_reviews > checkpoint["rows"]:
+                checkpoint.update(rows=reviews.n_reviews, chunks=len(documents))
+                replace_text(shard_dir / CHECKPOINT_FILE, json.dumps(checkpoint))
+                print(f"Checkpoint: {checkpoint['rows']} rows, {checkpoint['chunks']} chunks")
+
+    n_reviews, n_chunks = reviews.n_reviews, len(documents)
+    if not n_chunks:
+        documents.close()
+        reviews.close()
+        return n_reviews, n_chunks
+    print(f"{shard_dir.name}: {n_reviews} reviews, {n_chunks} chunks.")
+    index = builder.finish()
+    print(f"Built {describe_index(index)} over {index.ntotal} vectors.")
+
+    # Native FAISS file + offset-indexed docs, memory-mapped by the retriever
+    write_review_index(shard_dir, index, documents)
+    del index
+    print("Saved successfully to", shard_dir)
+
+    if report:
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(n_chunks, checkpoint["dim"]))
+        _print_recall_report(shard_dir, vectors, pca_dim)
+
+    print("Writing parent reviews...")
+    chunk_reviews = reviews.close()
+
+    print("Building BM25 index over clean_comment...")
+    bm25.close(chunk_reviews)
+
+    print("Precomputing metadata filters (site, date, rating)...")
+    filters.close()
+    write_content_hashes(shard_dir, hashes)
+
+    # Written last: running retrievers reload this shard once the build id changes.
+    build_id = write_build_id(shard_dir)
+    print(f"Build id: {build_id}")
+    return n_reviews, n_chunks
+
+
+def _print_recall_report(shard_dir: Path, vectors: np.ndarray, pca_dim: int) -> None:
+    print("Measuring recall vs memory...")
+    report = recall_report(shard_dir, vectors, pca_dim=pca_dim)
+    built = report["index"]
+    print(
+        f"  {built['type']}: recall@{report['k']}={built['recall']:.3f}, "
+        f"{built['bytes_per_vector']:.0f} B/vector (float32: {report['float32_bytes_per_vector']} B)"
+    )
+    for row in report["codecs"]:
+        print(f"  {row['codec']:>7} @ {row['pca_dim']}d: recall@{report['k']}={row['recall']:.3f}, "
+              f"{row['bytes_per_vector']} B/vector")
+
+
+def _deleted_ids(shard_dir: Path) -> set[int]:
+    path = shard_dir / DELETED_FILE
+    return set(np.load(path).tolist()) if path.exists() else set()
+
+
+def _previous_build(current_dir: Path, provider: str, pca_dim: int, codec: str) -> dict | None:
+    """Manifest of the current version if an incremental build can extend it, else None."""
+    if not (current_dir / MANIFEST_FILE).exists():
+        return None
+    manifest = load_manifest(current_dir)
+    built = (
+        manifest["embedding"]["provider"], manifest["index_type"], manifest["codec"], manifest["pca_dim"],
+        manifest.get("chunk_layout"),
+    )
+    wanted = (provider, config.INDEX_TYPE, codec, pca_dim, CHUNK_LAYOUT)
+    if built != wanted:
+        print(f"Current version {manifest['version']} was built with {built}; doing a full build for {wanted}.")
+        return None
+    return manifest
+
+
+def _update_shard_incremental(
+    shard_dir: Path,
+    rows: list[dict],
+    runner: EmbeddingJobRunner,
+    store: EmbeddingStore | None,
+    model: str,
+    pool: Executor | None = None,
+) -> dict:
+    """
+    Bring a copied shard up to date with the CSV rows: embed new and changed
+    reviews, drop removed ones. Returns the embedding counts for the manifest.
+    Content hashes are computed in the pool when one is given.
+    """
+    previous = load_content_hashes(shard_dir)
+    row_hashes = pool.map(_row_hash, rows, chunksize=256) if pool is not None else map(_row_hash, rows)
+    hashes = {row["review_id"]: row_hash for row, row_hash in zip(rows, row_hashes)}
+    changed = [row for row in rows if previous.get(row["review_id"]) != hashes[row["review_id"]]]
+    removed = set(previous) - set(hashes)
+    print(f"{len(changed)} new or changed reviews, {len(removed)} removed, "
+          f"{len(hashes) - len(changed)} unchanged.")
+
+    remove_ids = removed | {row["review_id"] for row in changed}
+    result = update_shard(shard_dir, remove_ids, changed, runner, store=store, model=model)
+    embedded = result["vectors_added"] if result else 0
+    if result is not None and result["build_id"] is not None:
+        print(f"Build id: {result['build_id']}")
+    chunk_reviews = np.load(shard_dir / CHUNK_REVIEWS_FILE)
+    total = int((chunk_reviews >= 0).sum())
+    print(f"Embedded {embedded} chunks; reused {total - embedded} (embedding calls saved vs a full build).")
+    return {"embedded_chunks": embedded, "reused_chunks": total - embedded}
+
+
+def _shard_counts(shard_dir: Path) -> dict:
+    """Live vector and review counts and build id of a finished shard, for the manifest."""
+    chunk_reviews = np.load(shard_dir / CHUNK_REVIEWS_FILE)
+    return {
+        "vectors": len(np.load(shard_dir / DOC_OFFSETS_FILE, mmap_mode="r")) - 1 - len(_deleted_ids(shard_dir)),
+        "reviews": len(np.unique(chunk_reviews[chunk_reviews >= 0])),
+        "build_id": (shard_dir / VERSION_FILE).read_text(encoding="utf-8").strip(),
+    }
+
+
+def create_vector_db(
+    provider: str = config.EMBEDDING_PROVIDER,
+    index_dir: Path = DEFAULT_INDEX_DIR,
+    pca_dim: int = config.PCA_DIM,
+    codec: str = config.VECTOR_CODEC,
+    sites: list[str] | None = None,
+    data_dir: Path = DEFAULT_DATA_DIR,
+    keep_versions: int = config.INDEX_KEEP_VERSIONS,
+    full: bool = False,
+    resume: bool = True,
+    workers: int = config.BUILD_WORKERS,
+    report: bool = config.RECALL_REPORT,
+) -> Path:
+    """
+    Load review data, build embeddings, and save one FAISS index shard per site
+    as a new version of st_app/db/faiss_index, then publish it.
+
+    Args:
+        provider: Embedding provider ("upstage" or "local", default RAG_EMBEDDING_PROVIDER).
+        index_dir: Output directory (default st_app/db/faiss_index).
+        pca_dim: PCA projection dimension, 0 to keep the embedding dimension (default RAG_PCA_DIM).
+        codec: Stored vector encoding: float32, fp16, int8 or pq (default RAG_VECTOR_CODEC).
+        sites: Sites to (re)index (default all). Other shards are copied from the
+            current version and the recorded embedding provider is reused.
+        data_dir: Directory of the preprocessed review CSVs (default database/).
+        keep_versions: Published versions kept after garbage collection (default RAG_INDEX_KEEP_VERSIONS).
+        full: Re-embed everything instead of updating the current version incrementally.
+        resume: Continue an interrupted build with the same settings and inputs
+            instead of starting over.
+        workers: FAISS threads and, with the local provider, processes for
+            parsing, hashing and embedding (0 = every core, 1 = serial;
+            default RAG_BUILD_WORKERS). The FAISS thread count is restored afterwards.
+        report: Measure recall vs memory of every rebuilt shard and vector codec
+            into its build_report.json (default RAG_RECALL_REPORT).
+
+    Returns:
+        The published version directory.
+    """
+    load_dotenv()
+    workers = workers or os.cpu_count() or 1
+    # Local embeddings hold the GIL, so they get one process pool for the whole build;
+    # remote providers wait on requests, which the embedding threads already overlap
+    use_processes = workers > 1 and is_cpu_bound(provider)
+    if use_processes:
+        print(f"Parsing and embedding in {workers} worker processes")
+    omp_threads = faiss.omp_get_max_threads()
+    faiss.omp_set_num_threads(workers)
+    try:
+        with ProcessPoolExecutor(workers) if use_processes else nullcontext() as pool:
+            return _create_vector_db(
+                provider, index_dir, pca_dim, codec, sites, data_dir, keep_versions, full, resume, pool, workers,
+                report,
+            )
+    finally:
+        faiss.omp_set_num_threads(omp_threads)
+
+
+def _create_vector_db(
+    provider: str,
+    index_dir: Path,
+    pca_dim: int,
+    codec: str,
+    sites: list[str] | None,
+    data_dir: Path,
+    keep_versions: int,
+    full: bool,
+    resume: bool,
+    pool: Executor | None,
+    workers: int,
+    report: bool,
+) -> Path:
+    """create_vector_db() with its worker pool set up (None when serial or the provider is remote)."""
+    input_files = _input_files(data_dir)
+    sites = list(sites or input_files)
+    unknown = set(sites) - set(input_files)
+    if unknown:
+        raise ValueError(f"Unknown site(s) {sorted(unknown)}; expected any of {list(input_files)}")
 
     index_dir.mkdir(parents=True, exist_ok=True)
-    vectorstore.save_local(str(index_dir))
-    print("Saved successfully to", index_dir)
-
-    print("Generating meta.json...")
-    
-    meta_data = []
-    for i, chunk in enumerate(chunks):
-        meta_data.append({
-            "id": i,
-            "content": chunk.page_content,
-            "metadata": chunk.metadata
-        })
-
-    meta_path = index_dir / "meta.json"
-    with open(meta_path, "w", encoding="utf-8") as f:
-        json.dump(meta_data, f, ensure_ascii=False, indent=4)
-    
-    print(f"Saved meta.json to {meta_path}")
+    current_dir = resolve_index_dir(index_dir)
+    current_shards = shard_dirs(current_dir)
+    previous = None if full else _previous_build(current_dir, provider, pca_dim, codec)
+    # Sites whose current shard has content hashes are updated in place of a rebuild
+    incremental = [
+        site for site in sites
+        if previous is not None and site in current_shards and load_content_hashes(current_shards[site]) is not None
+    ]
+
+    full_sites = [site for site in sites if site not in incremental]
+    plan = {
+        "provider": provider,
+        "index_type": config.INDEX_TYPE,
+        "codec": codec,
+        "pca_dim": pca_dim,
+        "chunk_layout": CHUNK_LAYOUT,
+        "base": current_dir.name if current_shards else None,
+        "full_sites": full_sites,
+        "incremental_sites": incremental,
+        "inputs": {site: _file_signature(input_files[site]) for site in sites},
+    }
+    version, build_dir = stage_version(index_dir, plan, resume=resume)
+    state = load_build_state(build_dir)
+    if state["done"]:
+        print(f"Resuming version {version} in {build_dir} (finished: {', '.join(state['done'])})")
+    else:
+        print(f"Building version {version} in {build_dir}")
+
+    def finish(site: str, stats: dict) -> None:
+        state["done"][site] = stats
+        save_build_state(build_dir, state)
+
+    for site, shard_dir in current_shards.items():
+        if site not in sites and site not in state["done"]:
+            print(f"Keeping the current {site} shard")
+            shutil.rmtree(build_dir / site, ignore_errors=True)
+            link_tree(shard_dir, build_dir / site)
+            finish(site, {})
+
+    print(f"Creating index with {provider} embeddings...")
+    if (build_dir / EMBEDDING_INFO_FILE).exists():
+        info = load_embedding_info(build_dir)
+        print(f"Reusing {info['model']} embeddings of the interrupted build")
+        embeddings = load_embeddings(build_dir, info)[0]
+    else:
+        all_sites = set(full_sites) == set(input_files)
+        fits_model = all_sites or not (current_dir / EMBEDDING_INFO_FILE).exists()
+        texts = _corpus_texts([input_files[site] for site in full_sites], pool, workers) if fits_model else []
+        embeddings = _shared_embeddings(build_dir, current_dir, texts, provider, all_sites)
+        info = load_embedding_info(build_dir)
+    store = document_store(info)
+    # One runner for the whole build, so its rate limit spans every shard; local
+    # embeddings go to the pool, whose processes load them from build_dir
+    runner = EmbeddingJobRunner(embeddings, pool=pool, model_dir=build_dir)
+
+    for site in incremental:
+        if site in state["done"]:
+            continue
+        print(f"\n[{site}] incremental")
+        # Restart from a clean copy; an interrupted update may have left it half-applied.
+        # update_shard detaches the files it appends to, so the current shard stays intact.
+        shutil.rmtree(build_dir / site, ignore_errors=True)
+        link_tree(current_shards[site], build_dir / site)
+        rows = load_review_rows(input_files[site])
+        finish(site, _update_shard_incremental(build_dir / site, rows, runner, store, info["model"], pool))
+
+    for site in full_sites:
+        if site in state["done"]:
+            continue
+        print(f"\n[{site}]")
+        shard_dir = build_dir / site
+        _, n_chunks = _build_shard(
+            shard_dir, input_files[site], runner, store, info["model"], pca_dim, codec, pool, workers, report,
+        )
+        if not n_chunks:
+            print(f"Skipping {site}: no reviews.")
+            shutil.rmtree(shard_dir)
+            finish(site, {})
+            continue
+        _clear_checkpoint(shard_dir)
+        finish(site, {"embedded_chunks": n_chunks, "reused_chunks": 0})
+
+    stats = {site: site_stats for site, site_stats in state["done"].items() if site_stats}
+    if incremental:
+        embedded = sum(s["embedded_chunks"] for s in stats.values())
+        reused = sum(s["reused_chunks"] for s in stats.values())
+        print(f"\nEmbedded {embedded} chunks, saved {reused} embedding calls by reusing unchanged reviews.")
+
+    print("\nWriting manifest...")
+    (build_dir / BUILD_STATE_FILE).unlink()
+    shards = {site: {**_shard_counts(path), **stats.get(site, {})} for site, path in shard_dirs(build_dir).items()}
+    write_manifest(build_dir, version, {
+        "embedding": load_embedding_info(build_dir),
+        "index_type": config.INDEX_TYPE,
+        "codec": codec,
+        "pca_dim": pca_dim,
+        "chunk_layout": CHUNK_LAYOUT,
+        "vectors": sum(c["vectors"] for c in shards.values()),
+        "reviews": sum(c["reviews"] for c in shards.values()),
+        "shards": shards,
+    })
+    # Atomic pointer swap: retrievers pick up the new version on their next lookup
+    version_dir = publish_version(index_dir, build_dir)
+    print(f"Published version {version} ({version_dir})")
+    removed = collect_garbage(index_dir, keep_versions)
+    if removed:
+        print(f"Removed old versions: {', '.join(removed)}")
+    return version_dir
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--provider', type=str, default=config.EMBEDDING_PROVIDER,
+                        choices=EMBEDDING_PROVIDERS.keys(),
+                        help="Embedding provider. 'local' builds offline with TF-IDF + SVD.")
+    parser.add_argument('-t', '--title', type=str, default=config.DEFAULT_TITLE,
+                        help="Title namespace to build. Default: RAG_DEFAULT_TITLE (st_app/db/faiss_index)")
+    parser.add_argument('-o', '--index_dir', type=Path, default=None,
+                        help="Index root to publish the new version in. Default: the title's namespace directory")
+    parser.add_argument('-d', '--data_dir', type=Path, default=DEFAULT_DATA_DIR,
+                        help="Directory of the preprocessed review CSVs. Default: database/")
+    parser.add_argument('--pca_dim', type=int, default=config.PCA_DIM,
+                        help="Project vectors to this many dimensions with PCA. Default: 0 (off)")
+    parser.add_argument('--codec', type=str, default=config.VECTOR_CODEC, choices=VECTOR_CODECS,
+                        help="Stored vector encoding. Default: float32")
+    parser.add_argument('-s', '--site', type=str, action='append', choices=SITES, dest='sites',
+                        help="Re-index only this site (repeatable). Default: all sites")
+    parser.add_argument('--full', action='store_true',
+                        help="Re-embed every review instead of only new or changed ones")
+    parser.add_argument('--restart', action='store_true',
+                        help="Discard an interrupted build instead of resuming it")
+    parser.add_argument('-j', '--workers', type=int, default=config.BUILD_WORKERS,
+                        help="FAISS threads, and worker processes with the local provider. "
+                             "Default: RAG_BUILD_WORKERS (0 = every core)")
+    parser.add_argument('--keep', type=int, default=config.INDEX_KEEP_VERSIONS,
+                        help="Published versions to keep. Default: RAG_INDEX_KEEP_VERSIONS")
+    parser.add_argument('--recall-report', action='store_true', default=config.RECALL_REPORT,
+                        help="Measure recall vs memory of each rebuilt shard and vector codec (slow). "
+                             "Default: RAG_RECALL_REPORT")
+    return parser
 
 
 if __name__ == "__main__":
-    create_vector_db()
+    args = create_parser().parse_args()
+    index_dir = args.index_dir or title_index_dir(args.title)
+    create_vector_db(provider=args.provider, index_dir=index_dir, pca_dim=args.pca_dim, codec=args.codec,
+                     sites=args.sites, data_dir=args.data_dir, keep_versions=args.keep, full=args.full,
+                     resume=not args.restart, workers=args.workers, report=args.recall_report)
@@ -0,0 +1,280 @@
+"""
+RAG embedding providers: which model turns review chunks and queries into vectors.
+
+An index records the provider and model it was built with in embedding.json,
+and the retriever always queries it with the same provider, so indexes built
+with different providers can coexist.
+
+Providers:
+- upstage: remote solar-embedding-1-large (query/passage models) via the Upstage API.
+- local:   TF-IDF + TruncatedSVD fitted on the review corpus with scikit-learn.
+           Runs on CPU with no network; query embedding takes microseconds.
+"""
+import json
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from hashlib import sha1
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_upstage import UpstageEmbeddings
+from langchain_upstage.embeddings import MAX_EMBED_BATCH_SIZE
+
+from st_app.rag import config
+from st_app.rag.cache import EmbeddingStore
+
+EMBEDDING_INFO_FILE = "embedding.json"
+LOCAL_MODEL_FILE = "local_embedder.npz"
+
+# Same tokenization as scikit-learn's default token_pattern
+_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+
+class UpstageQueryBatchEmbeddings(UpstageEmbeddings):
+    """
+    UpstageEmbeddings that can embed many queries per request with the query model.
+
+    Requests go straight to the OpenAI-compatible client with the query model
+    named explicitly, instead of through UpstageEmbeddings' private request
+    parameters, so a langchain-upstage release changing them cannot silently
+    send queries to the passage model.
+    """
+
+    @property
+    def query_model(self) -> str:
+        """Upstage serves queries from "<model>-query" and documents from "<model>-passage"."""
+        return f"{self.model.removesuffix('-query').removesuffix('-passage')}-query"
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        for i in range(0, len(texts), MAX_EMBED_BATCH_SIZE):
+            response = self.client.create(input=texts[i : i + MAX_EMBED_BATCH_SIZE], model=self.query_model)
+            vectors.extend(r.embedding for r in response.data)
+        return vectors
+
+
+class LazyEmbeddings(Embeddings):
+    """
+    Embeddings created on first use. A build or update whose chunks are all in
+    the EmbeddingStore, or a query served from the query cache, then never
+    creates the API client and needs no API key.
+    """
+
+    def __init__(self, create: Callable[[], Embeddings]):
+        self._create = create
+        self._embeddings: Embeddings | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = self._create()
+        return self._embeddings
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        embed_queries = getattr(self.embeddings, "embed_queries", None)
+        if embed_queries is None:
+            return [self.embeddings.embed_query(text) for text in texts]
+        return embed_queries(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sublinear TF-IDF projected with TruncatedSVD and L2-normalized.
+
+    Only fitting uses scikit-learn; embedding is a vocabulary lookup and one
+    small matrix product in NumPy, identical for documents and queries.
+    """
+
+    def __init__(self, terms: np.ndarray, idf: np.ndarray, components: np.ndarray):
+        self.terms = np.asarray(terms, dtype=str)
+        self.idf = idf.astype(np.float32)
+        # (V, dim) so a document is a weighted sum of rows
+        self.components = np.ascontiguousarray(components.T, dtype=np.float32)
+        self._vocab = {term: i for i, term in enumerate(terms.tolist())}
+        digest = sha1(self.components.tobytes()).hexdigest()[:12]
+        self.model = f"local-tfidf-svd{self.components.shape[1]}-{digest}"
+
+    @classmethod
+    def fit(cls, texts: list[str], dim: int = config.LOCAL_EMBEDDING_DIM) -> "LocalEmbeddings":
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        vectorizer = TfidfVectorizer(sublinear_tf=True, min_df=2, dtype=np.float32)
+        tfidf = vectorizer.fit_transform(texts)
+        n_components = max(1, min(dim, tfidf.shape[1] - 1, tfidf.shape[0] - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=0).fit(tfidf)
+        return cls(vectorizer.get_feature_names_out(), vectorizer.idf_, svd.components_)
+
+    @classmethod
+    def load(cls, path: Path) -> "LocalEmbeddings":
+        with np.load(path) as data:
+            return cls(data["terms"], data["idf"], data["components"])
+
+    def save(self, path: Path) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, terms=self.terms, idf=self.idf, components=self.components.T)
+
+    @property
+    def dimension(self) -> int:
+        return self.components.shape[1]
+
+    def _embed(self, text: str) -> np.ndarray:
+        counts = Counter(
+            i for i in map(self._vocab.get, _TOKEN_RE.findall(text.lower())) if i is not None
+        )
+        out = np.zeros(self.dimension, dtype=np.float32)
+        if not counts:
+            return out
+        idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        weights = (1.0 + np.log(tf)) * self.idf[idx]
+        weights /= np.linalg.norm(weights)
+        out = weights @ self.components[idx]
+        norm = np.linalg.norm(out)
+        return out / norm if norm > 0 else out
+
+    def embed_array(self, texts: list[str]) -> np.ndarray:
+        """Embed texts into an (n, dim) float32 array."""
+        out = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            out[i] = self._embed(text)
+        return out
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text).tolist()
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_array(texts).tolist()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return self.embed_query(text)
+
+
+class EmbeddingProvider(ABC):
+    """Creates the Embeddings used to build an index and, later, to query it."""
+
+    # Whether query vectors are worth caching (remote calls) or cheaper to recompute
+    cache_queries: bool = True
+    # Whether document vectors go to the shared EmbeddingStore (see document_store())
+    cache_documents: bool = True
+    # Whether embedding is CPU-bound in this process, so parallel builds spread it over processes
+    cpu_bound: bool = False
+
+    @abstractmethod
+    def for_build(self, texts: list[str], index_dir: Path) -> tuple[Embeddings, str]:
+        """Return (embeddings, model name) for a new index; may fit and save state into index_dir."""
+
+    @abstractmethod
+    def for_query(self, index_dir: Path, model: str) -> Embeddings:
+        """Return embeddings compatible with an index built by for_build()."""
+
+
+class UpstageProvider(EmbeddingProvider):
+    def for_build(self, texts: list[str], index_dir: Path) -> tuple[Embeddings, str]:
+        return self.for_query(index_dir, config.EMBEDDING_MODEL), config.EMBEDDING_MODEL
+
+    def for_query(self, index_dir: Path, model: str) -> Embeddings:
+        def create() -> Embeddings:
+            load_dotenv()
+            # One embed_documents() call per job batch is one API request, so the
+            # runner's batch size and rate limit describe the real traffic
+            return UpstageQueryBatchEmbeddings(
+                model=model, embed_batch_size=min(config.EMBED_BATCH_SIZE, MAX_EMBED_BATCH_SIZE)
+            )
+
+        # The client (and UPSTAGE_API_KEY) is only needed once something is embedded
+        return LazyEmbeddings(create)
+
+
+class LocalProvider(EmbeddingProvider):
+    cache_queries = False
+    # Refitting changes the model, and re-embedding takes seconds
+    cache_documents = False
+    cpu_bound = True
+
+    def for_build(self, texts: list[str], index_dir: Path) -> tuple[Embeddings, str]:
+        embeddings = LocalEmbeddings.fit(texts)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        embeddings.save(index_dir / LOCAL_MODEL_FILE)
+        return embeddings, embeddings.model
+
+    def for_query(self, index_dir: Path, model: str) -> Embeddings:
+        return LocalEmbeddings.load(index_dir / LOCAL_MODEL_FILE)
+
+
+EMBEDDING_PROVIDERS: dict[str, type[EmbeddingProvider]] = {
+    "upstage": UpstageProvider,
+    "local": LocalProvider,
+}
+
+
+def _get_provider(name: str) -> EmbeddingProvider:
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider {name!r}; expected one of {list(EMBEDDING_PROVIDERS)}")
+    return EMBEDDING_PROVIDERS[name]()
+
+
+def build_embeddings(
+    texts: list[str], index_dir: Path, provider: str = config.EMBEDDING_PROVIDER
+) -> Embeddings:
+    """
+    Create the embeddings for a new index and record the provider in embedding.json.
+
+    Args:
+        texts: Corpus the index is built from (used to fit local models).
+        index_dir: Index directory being built.
+        provider: Name in EMBEDDING_PROVIDERS.
+    """
+    embeddings, model = _get_provider(provider).for_build(texts, index_dir)
+    info = {"provider": provider, "model": model}
+    (index_dir / EMBEDDING_INFO_FILE).write_text(json.dumps(info), encoding="utf-8")
+    return embeddings
+
+
+def load_embedding_info(index_dir: Path) -> dict:
+    """Provider and model recorded for an index (Upstage for indexes without embedding.json)."""
+    path = index_dir / EMBEDDING_INFO_FILE
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    return {"provider": "upstage", "model": config.EMBEDDING_MODEL}
+
+
+def load_embeddings(index_dir: Path, info: dict) -> tuple[Embeddings, bool]:
+    """Return (query embeddings, whether to cache query vectors) for an index."""
+    provider = _get_provider(info["provider"])
+    return provider.for_query(index_dir, info["model"]), provider.cache_queries
+
+
+def document_store(info: dict) -> EmbeddingStore | None:
+    """Shared store for the document vectors of an index's model, or None when they are cheaper to recompute."""
+    if not _get_provider(info["provider"]).cache_documents:
+        return None
+    return EmbeddingStore()
+
+
+def is_cpu_bound(provider: str) -> bool:
+    """Whether a provider's embeddings are computed on the local CPU (see EmbeddingProvider.cpu_bound)."""
+    return _get_provider(provider).cpu_bound
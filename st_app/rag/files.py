@@ -0,0 +1,76 @@
+"""
+Atomic file writes shared by every index writer.
+
+A file is written to <name>.tmp next to its target and moved into place with
+os.replace, so readers (and a build that crashes halfway) only ever see the
+old or the new file, never a partial one.
+"""
+import io
+import os
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+TMP_SUFFIX = ".tmp"
+
+
+def replace_file(path: Path, write: Callable[[Path], None]) -> None:
+    """Write path through a temporary file and os.replace so readers never see a partial file."""
+    tmp_path = path.with_name(path.name + TMP_SUFFIX)
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def replace_text(path: Path, text: str) -> None:
+    """Atomically replace a UTF-8 text file."""
+    replace_file(path, lambda p: p.write_text(text, encoding="utf-8"))
+
+
+def save_array(path: Path, array: np.ndarray) -> None:
+    """Atomically replace a .npy file."""
+    def write(tmp_path: Path) -> None:
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+
+    replace_file(path, write)
+
+
+def save_arrays(path: Path, compressed: bool = False, **arrays: np.ndarray) -> None:
+    """Atomically replace a .npz file (np.savez_compressed when compressed)."""
+    def write(tmp_path: Path) -> None:
+        with open(tmp_path, "wb") as f:
+            (np.savez_compressed if compressed else np.savez)(f, **arrays)
+
+    replace_file(path, write)
+
+
+def append_array(path: Path, keep: int, values: np.ndarray) -> None:
+    """
+    Keep the first `keep` rows of a 1-d .npy file and append values to it in place.
+
+    Only the new rows and the header's shape are written. This is not atomic:
+    readers must take the row count from elsewhere (the docstore follows its
+    offsets), and a hard-linked file must be detached first. Values that do not
+    fit the file's dtype (e.g. longer strings) rewrite it atomically instead.
+    """
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        _, _, dtype = read_header(f)
+        data_start = f.tell()
+        header = io.BytesIO()
+        write_header = np.lib.format.write_array_header_1_0 if version == (1, 0) else np.lib.format.write_array_header_2_0
+        write_header(header, {
+            "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": (keep + len(values),),
+        })
+        # np.save pads the header so the shape can grow in place; older files may not be
+        if np.can_cast(values.dtype, dtype) and header.tell() == data_start:
+            end = data_start + keep * dtype.itemsize
+            f.truncate(end)
+            f.seek(end)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+            f.seek(0)
+            f.write(header.getvalue())
+            return
+    save_array(path, np.concatenate([np.load(path, mmap_mode="r")[:keep], values]))
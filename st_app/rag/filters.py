@@ -0,0 +1,283 @@
+"""
+Metadata filters for retrieval: restrict a search by site, date range,
+year_month or rating.
+
+At index time the per-vector attributes are precomputed into filters.npz:
+
+    site_bitmaps   packed id bitmap per site (one row per entry of SITES)
+    date_order     vector ids sorted by review date
+    date_sorted    review dates (days since epoch) in date_order
+    rating_order   vector ids sorted by normalized rating
+    rating_sorted  normalized ratings (0-10) in rating_order
+
+In-place review updates (see st_app.rag.updates) patch these arrays with
+update_filter_index() rather than recomputing them for every vector.
+
+A ReviewFilter compiles to one packed bitmap with bitwise ANDs and
+np.searchsorted range lookups, and the bitmap is handed to FAISS as an
+IDSelectorBitmap, so filtering happens inside the search instead of by
+post-filtering an oversampled result.
+"""
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from st_app.rag.files import save_arrays
+
+FILTERS_FILE = "filters.npz"
+
+SITES = ("imdb", "letterboxd", "rottentomatoes")
+# Ratings are normalized to a 10-point scale so one filter works across sites
+RATING_SCALE = {"imdb": 10.0, "letterboxd": 5.0, "rottentomatoes": 5.0}
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+def site_of(source: str) -> str | None:
+    """Site name for a review CSV path, e.g. preprocessed_reviews_imdb.csv -> "imdb"."""
+    stem = Path(str(source)).stem.lower()
+    for site in SITES:
+        if stem.endswith(site):
+            return site
+    return None
+
+
+def to_days(value: str | None) -> int | None:
+    """Days since 1970-01-01 of a "YYYY-MM-DD" date (None stays None)."""
+    if value is None:
+        return None
+    return int((np.datetime64(value, "D") - _EPOCH).astype(np.int64))
+
+
+@dataclass(frozen=True)
+class ReviewFilter:
+    """
+    Metadata restriction for retrieve(). All set fields must match.
+
+    Args:
+        sites: Allowed sites (see SITES).
+        date_from: Inclusive lower bound, "YYYY-MM-DD".
+        date_to: Inclusive upper bound, "YYYY-MM-DD".
+        year_month: Shorthand for a single month, "YYYY-MM".
+        min_rating: Inclusive lower bound on the 10-point normalized rating.
+        max_rating: Inclusive upper bound on the 10-point normalized rating.
+    """
+
+    sites: tuple[str, ...] | None = None
+    date_from: str | None = None
+    date_to: str | None = None
+    year_month: str | None = None
+    min_rating: float | None = None
+    max_rating: float | None = None
+
+    def __post_init__(self):
+        if self.sites is not None:
+            # Hashable, so a filter can be part of a ResultCache key
+            object.__setattr__(self, "sites", tuple(self.sites))
+            unknown = set(self.sites) - set(SITES)
+            if unknown:
+                raise ValueError(f"Unknown site(s) {sorted(unknown)}; expected any of {SITES}")
+
+    def is_empty(self) -> bool:
+        return all(v is None for v in (
+            self.sites, self.date_from, self.date_to, self.year_month,
+            self.min_rating, self.max_rating,
+        ))
+
+    def date_range(self) -> tuple[int | None, int | None]:
+        """(from, to) in days since epoch, inclusive; None for an open end."""
+        lo, hi = to_days(self.date_from), to_days(self.date_to)
+        if self.year_month is not None:
+            month = np.datetime64(self.year_month, "M")
+            month_lo = to_days(str(month.astype("datetime64[D]")))
+            month_hi = to_days(str((month + 1).astype("datetime64[D]"))) - 1
+            lo = month_lo if lo is None else max(lo, month_lo)
+            hi = month_hi if hi is None else min(hi, month_hi)
+        return lo, hi
+
+
+def _slot_attributes(records: list[dict], chunk_reviews: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Site index, date in days and normalized rating of every vector id (-1, INT32_MIN, NaN where unknown)."""
+    n = len(chunk_reviews)
+    sites = np.full(n, -1, dtype=np.int16)
+    days = np.full(n, np.iinfo(np.int32).min, dtype=np.int32)
+    ratings = np.full(n, np.nan, dtype=np.float32)
+
+    for i, position in enumerate(np.asarray(chunk_reviews).tolist()):
+        if position < 0:
+            continue
+        record = records[position]
+        site = record.get("site")
+        if site not in SITES:
+            continue
+        sites[i] = SITES.index(site)
+        if record.get("date"):
+            days[i] = to_days(record["date"])
+        if record.get("rating_value") is not None:
+            ratings[i] = float(record["rating_value"]) * 10.0 / RATING_SCALE[site]
+    return sites, days, ratings
+
+
+class FilterIndexWriter:
+    """
+    Build filters.npz batch by batch; only the per-vector attributes (site,
+    day, rating) are kept until close().
+
+        writer = FilterIndexWriter(index_dir)
+        for records, chunk_records in batches:
+            writer.add(records, chunk_records)
+        writer.close()
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self._sites: list[np.ndarray] = [np.empty(0, dtype=np.int16)]
+        self._days: list[np.ndarray] = [np.empty(0, dtype=np.int32)]
+        self._ratings: list[np.ndarray] = [np.empty(0, dtype=np.float32)]
+
+    def add(self, records: list[dict], chunk_records) -> None:
+        """
+        Append the next vector ids.
+
+        Args:
+            records: Review records (see st_app.rag.reviews) with `site`, `date` and `rating_value`.
+            chunk_records: Index into records of every new vector id (-1 if the chunk has no review).
+        """
+        sites, days, ratings = _slot_attributes(records, chunk_records)
+        self._sites.append(sites)
+        self._days.append(days)
+        self._ratings.append(ratings)
+
+    def close(self) -> None:
+        """Sort the attributes and write filters.npz."""
+        sites, days, ratings = np.concatenate(self._sites), np.concatenate(self._days), np.concatenate(self._ratings)
+        site_bitmaps = np.stack([np.packbits(sites == s, bitorder="little") for s in range(len(SITES))])
+        dated = np.flatnonzero(days != np.iinfo(np.int32).min)
+        date_order = dated[np.argsort(days[dated], kind="stable")]
+        rated = np.flatnonzero(~np.isnan(ratings))
+        rating_order = rated[np.argsort(ratings[rated], kind="stable")]
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        save_arrays(
+            self.index_dir / FILTERS_FILE,
+            ntotal=np.int64(len(sites)),
+            site_bitmaps=site_bitmaps,
+            date_order=date_order.astype(np.int64),
+            date_sorted=days[date_order],
+            rating_order=rating_order.astype(np.int64),
+            rating_sorted=ratings[rating_order],
+        )
+
+
+def build_filter_index(index_dir: Path, records: list[dict], chunk_reviews: np.ndarray) -> None:
+    """
+    Precompute filters.npz for every vector id.
+
+    Args:
+        index_dir: Index directory to write into.
+        records: Review records (see st_app.rag.reviews) with `site`, `date` and `rating_value`.
+        chunk_reviews: Review position of every vector id (-1 if the chunk has no review).
+    """
+    writer = FilterIndexWriter(index_dir)
+    writer.add(records, chunk_reviews)
+    writer.close()
+
+
+def _insert_sorted(
+    order: np.ndarray, values: np.ndarray, dead: np.ndarray, ids: np.ndarray, new_values: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Drop dead ids from a sorted (order, values) pair and merge in new ones, keeping build_filter_index's tie order."""
+    keep = ~np.isin(order, dead)
+    order, values = order[keep], values[keep]
+    by_value = np.argsort(new_values, kind="stable")
+    ids, new_values = ids[by_value], new_values[by_value]
+    # New ids are larger than every existing one, so equal values go after the existing ones
+    at = np.searchsorted(values, new_values, side="right")
+    return np.insert(order, at, ids), np.insert(values, at, new_values)
+
+
+def update_filter_index(
+    index_dir: Path, dead_slots: np.ndarray, records: list[dict], chunk_reviews: np.ndarray
+) -> None:
+    """
+    Patch filters.npz after an in-place update: dead_slots stop matching any
+    filter and len(chunk_reviews) new vector ids are appended.
+
+    Args:
+        index_dir: Index directory holding filters.npz.
+        dead_slots: Vector ids removed by the update.
+        records: Review records of the new vector ids.
+        chunk_reviews: Index into records of every new vector id.
+    """
+    with np.load(index_dir / FILTERS_FILE) as data:
+        arrays = {name: data[name] for name in data.files}
+    n_old = int(arrays["ntotal"])
+    sites, days, ratings = _slot_attributes(records, chunk_reviews)
+    ids = np.arange(n_old, n_old + len(sites), dtype=np.int64)
+
+    site_masks = np.unpackbits(arrays["site_bitmaps"], axis=1, count=n_old, bitorder="little").astype(bool)
+    site_masks[:, dead_slots] = False
+    site_masks = np.concatenate([site_masks, np.stack([sites == s for s in range(len(SITES))])], axis=1)
+    dated = days != np.iinfo(np.int32).min
+    date_order, date_sorted = _insert_sorted(
+        arrays["date_order"], arrays["date_sorted"], dead_slots, ids[dated], days[dated]
+    )
+    rated = ~np.isnan(ratings)
+    rating_order, rating_sorted = _insert_sorted(
+        arrays["rating_order"], arrays["rating_sorted"], dead_slots, ids[rated], ratings[rated]
+    )
+    save_arrays(
+        index_dir / FILTERS_FILE,
+        ntotal=np.int64(n_old + len(sites)),
+        site_bitmaps=np.packbits(site_masks, axis=1, bitorder="little"),
+        date_order=date_order,
+        date_sorted=date_sorted,
+        rating_order=rating_order,
+        rating_sorted=rating_sorted,
+    )
+
+
+def _range_bitmap(order: np.ndarray, values: np.ndarray, lo, hi, ntotal: int) -> np.ndarray:
+    start = 0 if lo is None else np.searchsorted(values, lo, side="left")
+    end = len(values) if hi is None else np.searchsorted(values, hi, side="right")
+    mask = np.zeros(ntotal, dtype=bool)
+    mask[order[start:end]] = True
+    return np.packbits(mask, bitorder="little")
+
+
+class FilterIndex:
+    """Precomputed attribute arrays loaded from filters.npz."""
+
+    def __init__(self, path: Path):
+        with np.load(path) as data:
+            self.ntotal = int(data["ntotal"])
+            self.site_bitmaps = data["site_bitmaps"]
+            self.date_order = data["date_order"]
+            self.date_sorted = data["date_sorted"]
+            self.rating_order = data["rating_order"]
+            self.rating_sorted = data["rating_sorted"]
+
+    def bitmap(self, review_filter: ReviewFilter) -> np.ndarray:
+        """Compile a filter into a packed id bitmap (bit i set = vector i allowed)."""
+        bitmap = np.full((self.ntotal + 7) // 8, 0xFF, dtype=np.uint8)
+        if review_filter.sites is not None:
+            allowed = np.zeros_like(bitmap)
+            for site in review_filter.sites:
+                allowed |= self.site_bitmaps[SITES.index(site)]
+            bitmap &= allowed
+
+        lo, hi = review_filter.date_range()
+        if lo is not None or hi is not None:
+            bitmap &= _range_bitmap(self.date_order, self.date_sorted, lo, hi, self.ntotal)
+
+        if review_filter.min_rating is not None or review_filter.max_rating is not None:
+            bitmap &= _range_bitmap(
+                self.rating_order, self.rating_sorted,
+                review_filter.min_rating, review_filter.max_rating, self.ntotal,
+            )
+        return bitmap
+
+    def mask(self, review_filter: ReviewFilter) -> np.ndarray:
+        """Same as bitmap() but as a bool array of length ntotal."""
+        return np.unpackbits(self.bitmap(review_filter), count=self.ntotal, bitorder="little").astype(bool)
@@ -0,0 +1,607 @@
+"""
+On-disk review index: a native FAISS index file plus an offset-indexed document
+store, both opened read-only through mmap.
+
+Layout of an index directory:
+    index.faiss        FAISS index written with faiss.write_index
+    docs.text, docs.offsets.npy, docs.meta.json, docs.meta.<key>*.npy
+                       chunk text and typed metadata columns per vector (see st_app.rag.docstore)
+    deleted.npy        optional vector ids removed by st_app.rag.updates
+    bm25.npz           optional lexical index (see st_app.rag.bm25)
+    filters.npz        optional metadata filter arrays (see st_app.rag.filters)
+    reviews.jsonl, reviews.offsets.npy, chunk_reviews.npy
+                       optional parent reviews of the chunks (see st_app.rag.reviews)
+    embedding.json     embedding provider and model (see st_app.rag.embeddings)
+    build_report.json  optional recall vs memory of the stored vectors (see recall_report)
+    VERSION            build id, written last by write_build_id()
+
+Because nothing is unpickled, every worker process that opens the same
+directory shares one page-cache copy and cold start does no deserialization.
+
+Vector ids are stable slots: the FAISS index stores explicit ids (IndexIDMap2
+for flat and HNSW, native ids for IVF) and slot i is document i of the docstore.
+Updates append new slots and remove old ones without renumbering, so an id
+keeps pointing at the same chunk for the life of the index. HNSW cannot
+remove vectors; its deleted slots stay in the graph and are masked out at
+search time.
+"""
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from st_app.rag import config
+from st_app.rag.bm25 import BM25_FILE, BM25Index
+from st_app.rag.docstore import (
+    DOC_META_FILE,
+    DOC_OFFSETS_FILE,
+    DOCS_TEXT_FILE,
+    LEGACY_DOCS_FILE,
+    LEGACY_META_FILE,
+    DocStore,
+    DocumentWriter,
+    docstore_exists,
+    write_documents,
+)
+from st_app.rag.embeddings import load_embedding_info, load_embeddings
+from st_app.rag.files import replace_file, replace_text, save_array
+from st_app.rag.filters import FILTERS_FILE, FilterIndex
+from st_app.rag.reviews import REVIEW_FEATURE_NAMES, ReviewStore
+
+INDEX_FILE = "index.faiss"
+VERSION_FILE = "VERSION"
+DELETED_FILE = "deleted.npy"
+REPORT_FILE = "build_report.json"
+INDEX_FILES = (INDEX_FILE, DOCS_TEXT_FILE, DOC_META_FILE, LEGACY_META_FILE, LEGACY_DOCS_FILE, DOC_OFFSETS_FILE)
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+VECTOR_CODECS = ("float32", "fp16", "int8", "pq")
+
+# faiss needs about 39 training points per IVF cluster or PQ centroid
+_MIN_POINTS_PER_CENTROID = 39
+# Training points per IVF cluster kept when sampling the training set
+_TRAIN_POINTS_PER_CENTROID = 64
+
+# IO_FLAG_MMAP_IFC also maps flat code arrays (Flat, SQ, PQ and HNSW storage)
+_MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+_MMAP_IFC_FLAGS = _MMAP_FLAGS | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def _read_index_mmap(path: Path) -> faiss.Index:
+    try:
+        return faiss.read_index(str(path), _MMAP_IFC_FLAGS)
+    except RuntimeError:
+        # IVF indexes (ivf_flat, ivf_pq) reject IO_FLAG_MMAP_IFC; their inverted
+        # lists are memory-mapped by IO_FLAG_MMAP alone
+        return faiss.read_index(str(path), _MMAP_FLAGS)
+
+
+def _ivf_nlist(n: int, nlist: int) -> int:
+    if nlist <= 0:
+        nlist = int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // _MIN_POINTS_PER_CENTROID))
+
+
+def _codec_factory(codec: str, d: int, pq_m: int, pq_nbits: int) -> str:
+    if codec == "float32":
+        return "Flat"
+    if codec == "fp16":
+        return "SQfp16"
+    if codec == "int8":
+        return "SQ8"
+    if codec == "pq":
+        if d % pq_m:
+            raise ValueError(f"PQ_M={pq_m} must divide the vector dimension {d}")
+        # "np": skip polysemous training, which costs ~45 s per build and is unused here
+        return f"PQ{pq_m}x{pq_nbits}np"
+    raise ValueError(f"Unknown vector codec {codec!r}; expected one of {VECTOR_CODECS}")
+
+
+def build_faiss_index(
+    vectors: np.ndarray,
+    index_type: str = config.INDEX_TYPE,
+    nlist: int = config.IVF_NLIST,
+    pq_m: int = config.PQ_M,
+    pq_nbits: int = config.PQ_NBITS,
+    hnsw_m: int = config.HNSW_M,
+    ef_construction: int = config.HNSW_EF_CONSTRUCTION,
+    pca_dim: int = config.PCA_DIM,
+    codec: str = config.VECTOR_CODEC,
+    train_size: int = config.TRAIN_SAMPLE_SIZE,
+    add_batch_size: int = config.ADD_BATCH_SIZE,
+) -> faiss.Index:
+    """
+    Build (train and fill) an L2 FAISS index of the requested type.
+
+    Training runs on a seeded random sample of the vectors, and vectors are
+    added in batches; FAISS spreads each batch over its OpenMP threads
+    (faiss.omp_set_num_threads). See IndexBuilder to build from batches.
+
+    Args:
+        vectors: (n, d) float32 embeddings, in document order.
+        index_type: "flat" (exact), "ivf_flat", "ivf_pq" or "hnsw".
+        nlist: IVF cluster count (0 = automatic).
+        pq_m: PQ sub-quantizer count; must divide the (projected) dimension.
+        pq_nbits: Bits per PQ code.
+        hnsw_m: HNSW graph degree.
+        ef_construction: HNSW build-time beam width.
+        pca_dim: Learn a PCA projection to this many dimensions first (0 = none).
+            The index is then an IndexPreTransform, so queries are projected by FAISS.
+            Skipped for n <= pca_dim vectors, which cannot be projected that far.
+        codec: Vector storage for flat, ivf_flat and hnsw: "float32", "fp16", "int8" or "pq".
+            ivf_pq always stores PQ codes. PQ falls back to int8 below 2**pq_nbits
+            vectors, which is too few to train the codebooks.
+        train_size: Vectors sampled for training (at least 64 per IVF list and PQ centroid).
+        add_batch_size: Vectors per add call.
+
+    Returns:
+        The populated faiss.Index. Vector i is added with id i; flat and HNSW
+        indexes are wrapped in an IndexIDMap2 so ids can be removed and added later.
+    """
+    builder = IndexBuilder(
+        index_type=index_type, nlist=nlist, pq_m=pq_m, pq_nbits=pq_nbits, hnsw_m=hnsw_m,
+        ef_construction=ef_construction, pca_dim=pca_dim, codec=codec, train_size=train_size,
+        add_batch_size=add_batch_size,
+    )
+    builder.add(vectors)
+    return builder.finish()
+
+
+def _index_plan(
+    n: int,
+    d: int,
+    index_type: str,
+    nlist: int,
+    pq_m: int,
+    pq_nbits: int,
+    hnsw_m: int,
+    pca_dim: int,
+    codec: str,
+    train_size: int,
+) -> tuple[str, int]:
+    """FAISS factory string and training sample size for n vectors of dimension d (see build_faiss_index)."""
+    prefix = ""
+    if pca_dim:
+        if not 0 < pca_dim < d:
+            raise ValueError(f"PCA_DIM={pca_dim} must be between 1 and the vector dimension {d}")
+        if n <= pca_dim:
+            # Too few vectors to learn the projection (e.g. a small site shard)
+            pca_dim = 0
+    if pca_dim:
+        prefix = f"PCA{pca_dim},"
+        d_stored = pca_dim
+    else:
+        d_stored = d
+
+    if index_type == "ivf_pq":
+        if codec not in ("float32", "pq"):
+            raise ValueError(f"ivf_pq always stores PQ codes; got codec {codec!r}")
+        codec = "pq"
+    if codec == "pq" and n < 2 ** pq_nbits:
+        # Too few vectors to train the PQ codebooks (e.g. a small site shard)
+        codec = "int8"
+    storage = _codec_factory(codec, d_stored, pq_m, pq_nbits)
+    if codec == "pq":
+        # Every PQ codebook centroid needs a training point
+        train_size = max(train_size, 2 ** pq_nbits * _TRAIN_POINTS_PER_CENTROID)
+    if index_type == "flat":
+        factory = prefix + storage
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _ivf_nlist(n, nlist)
+        train_size = max(train_size, nlist * _TRAIN_POINTS_PER_CENTROID)
+        factory = f"{prefix}IVF{nlist},{storage}"
+    elif index_type == "hnsw":
+        factory = f"{prefix}HNSW{hnsw_m},{storage}"
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+
+    if index_type in ("flat", "hnsw"):
+        # IVF keeps arbitrary ids in its inverted lists; the others need an id map
+        factory = "IDMap2," + factory
+    return factory, train_size
+
+
+class IndexBuilder:
+    """
+    build_faiss_index() for vectors that arrive in batches, e.g. while a shard is embedded.
+
+    Vectors are buffered until there are enough to train on (train_size,
+    raised for IVF and PQ as in build_faiss_index); the index is then created
+    and trained on a sample of the buffer, and later batches are added
+    directly. Besides the index, at most one training buffer is held. Fewer
+    vectors than that are built exactly like build_faiss_index(); beyond it an
+    automatic IVF nlist is sized from the buffered vectors.
+
+        builder = IndexBuilder(index_type="ivf_flat")
+        for vectors in batches:
+            builder.add(vectors)
+        index = builder.finish()
+
+    Args are those of build_faiss_index().
+    """
+
+    def __init__(
+        self,
+        index_type: str = config.INDEX_TYPE,
+        nlist: int = config.IVF_NLIST,
+        pq_m: int = config.PQ_M,
+        pq_nbits: int = config.PQ_NBITS,
+        hnsw_m: int = config.HNSW_M,
+        ef_construction: int = config.HNSW_EF_CONSTRUCTION,
+        pca_dim: int = config.PCA_DIM,
+        codec: str = config.VECTOR_CODEC,
+        train_size: int = config.TRAIN_SAMPLE_SIZE,
+        add_batch_size: int = config.ADD_BATCH_SIZE,
+    ):
+        self.index_type = index_type
+        self.ef_construction = ef_construction
+        self.add_batch_size = max(1, add_batch_size)
+        self._plan = dict(
+            index_type=index_type, nlist=nlist, pq_m=pq_m, pq_nbits=pq_nbits, hnsw_m=hnsw_m,
+            pca_dim=pca_dim, codec=codec, train_size=train_size,
+        )
+        self.index: faiss.Index | None = None
+        self.ntotal = 0
+        self._buffer: list[np.ndarray] = []
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Add (n, d) vectors; they get the next n ids."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        if self.index is not None:
+            self._add(vectors)
+            return
+        self._buffer.append(vectors)
+        self.ntotal += len(vectors)
+        _, train_size = _index_plan(self.ntotal, vectors.shape[1], **self._plan)
+        if self.ntotal >= train_size:
+            self._train()
+
+    def finish(self) -> faiss.Index:
+        """The populated index; trains it first if fewer than train_size vectors were added."""
+        if self.index is None:
+            if not self._buffer:
+                raise ValueError("No vectors were added to the index.")
+            self._train()
+        return self.index
+
+    def _train(self) -> None:
+        vectors = self._buffer[0] if len(self._buffer) == 1 else np.concatenate(self._buffer)
+        self._buffer = []
+        n, d = vectors.shape
+        factory, train_size = _index_plan(n, d, **self._plan)
+        index = faiss.index_factory(d, factory, faiss.METRIC_L2)
+        if self.index_type == "hnsw":
+            _base_index(index).hnsw.efConstruction = self.ef_construction
+        if not index.is_trained:
+            index.train(_training_sample(vectors, train_size))
+        self.index = index
+        self.ntotal = 0
+        self._add(vectors)
+
+    def _add(self, vectors: np.ndarray) -> None:
+        for start in range(0, len(vectors), self.add_batch_size):
+            batch = vectors[start:start + self.add_batch_size]
+            self.index.add_with_ids(batch, np.arange(self.ntotal, self.ntotal + len(batch), dtype=np.int64))
+            self.ntotal += len(batch)
+
+
+def _training_sample(vectors: np.ndarray, size: int) -> np.ndarray:
+    """Up to size vectors drawn without replacement (seeded, so builds are reproducible)."""
+    if len(vectors) <= size:
+        return vectors
+    rows = np.sort(np.random.default_rng(0).choice(len(vectors), size, replace=False))
+    return np.ascontiguousarray(vectors[rows])
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    """The index behind an IndexIDMap2 and an IndexPreTransform (PCA), or the index itself."""
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexPreTransform):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def describe_index(index: faiss.Index) -> str:
+    """Short human-readable description, e.g. "IndexIVFFlat(nlist=64)" or "PCA128+IndexScalarQuantizer"."""
+    base = _base_index(index)
+    name = type(base).__name__
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        name = f"{name}(nlist={ivf.nlist})"
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexPreTransform):
+        name = f"PCA{base.d}+{name}"
+    return name
+
+
+def write_review_index(index_dir: Path, index: faiss.Index, documents: list[Document] | DocumentWriter) -> None:
+    """
+    Save a FAISS index and its documents (documents[i] belongs to vector i).
+
+    Args:
+        index_dir: Target directory (created if missing).
+        index: FAISS index holding len(documents) vectors.
+        documents: Documents in vector order, or a DocumentWriter for index_dir
+            that already holds them (closed here).
+    """
+    if index.ntotal != len(documents):
+        raise ValueError(f"Index has {index.ntotal} vectors but {len(documents)} documents were given.")
+    index_dir.mkdir(parents=True, exist_ok=True)
+
+    if isinstance(documents, DocumentWriter):
+        offsets = documents.close()
+    else:
+        offsets = write_documents(index_dir, documents)
+    save_array(index_dir / DOC_OFFSETS_FILE, offsets)
+    replace_file(index_dir / INDEX_FILE, lambda p: faiss.write_index(index, str(p)))
+
+
+def new_build_id() -> str:
+    """Unique, time-sortable id, e.g. 20240501-120000-123456-1a2b3c4d; microseconds order ids of the same second."""
+    now = time.time()
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:8]}"
+
+
+def write_build_id(index_dir: Path) -> str:
+    """
+    Stamp the index directory with a fresh build id. Call after every other file is
+    written: retrievers reload and drop cached results when the id changes.
+    """
+    build_id = new_build_id()
+    replace_text(index_dir / VERSION_FILE, build_id)
+    return build_id
+
+
+class ReviewIndex:
+    """
+    Read-only, memory-mapped view of an index directory written by write_review_index().
+
+    nprobe (IVF) and ef_search (HNSW) are runtime recall/latency knobs applied
+    to every search; they are ignored by index types that do not use them.
+    """
+
+    def __init__(
+        self,
+        index_dir: Path,
+        nprobe: int = config.IVF_NPROBE,
+        ef_search: int = config.HNSW_EF_SEARCH,
+    ):
+        self.index_dir = Path(index_dir)
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        missing = [] if docstore_exists(self.index_dir) else [DOCS_TEXT_FILE, DOC_OFFSETS_FILE]
+        if not (self.index_dir / INDEX_FILE).exists():
+            missing.insert(0, INDEX_FILE)
+        if missing:
+            raise FileNotFoundError(
+                f"Index files missing in {self.index_dir}: {', '.join(missing)}. "
+                "Rebuild the index with python -m st_app.rag.embedder."
+            )
+
+        self.index = _read_index_mmap(self.index_dir / INDEX_FILE)
+        self._is_ivf = faiss.try_extract_index_ivf(self.index) is not None
+        self._is_hnsw = isinstance(_base_index(self.index), faiss.IndexHNSW)
+        self._has_direct_map = False
+        self._direct_map_lock = threading.Lock()
+        self._offsets = np.load(self.index_dir / DOC_OFFSETS_FILE, mmap_mode="r")
+        self._docs = DocStore(self.index_dir, self._offsets)
+
+        # Slots only grow; deleted ones are removed from the index or masked below
+        if self.index.ntotal > len(self._offsets) - 1:
+            raise ValueError(f"Document offsets do not match index size in {self.index_dir}")
+        self._live_bitmap: np.ndarray | None = None
+        deleted_path = self.index_dir / DELETED_FILE
+        if deleted_path.exists():
+            deleted = np.load(deleted_path)
+            if self.index.ntotal > len(self) - len(deleted):
+                # Vectors the index could not remove (HNSW) are still searchable
+                live = np.ones(len(self), dtype=bool)
+                live[deleted] = False
+                self._live_bitmap = np.packbits(live, bitorder="little")
+
+        version_path = self.index_dir / VERSION_FILE
+        if version_path.exists():
+            self.build_id = version_path.read_text(encoding="utf-8").strip()
+        else:
+            self.build_id = f"mtime-{os.stat(self.index_dir / INDEX_FILE).st_mtime_ns}"
+
+        bm25_path = self.index_dir / BM25_FILE
+        self.lexical: BM25Index | None = BM25Index(bm25_path) if bm25_path.exists() else None
+        filters_path = self.index_dir / FILTERS_FILE
+        self.filters: FilterIndex | None = FilterIndex(filters_path) if filters_path.exists() else None
+        self.reviews: ReviewStore | None = ReviewStore(self.index_dir) if ReviewStore.exists(self.index_dir) else None
+
+        self.embedding_info = load_embedding_info(self.index_dir)
+        self._embeddings: tuple[Embeddings, bool] | None = None
+        self._embeddings_lock = threading.Lock()
+
+    @property
+    def embedding_model(self) -> str:
+        return self.embedding_info["model"]
+
+    def query_embeddings(self) -> tuple[Embeddings, bool]:
+        """
+        (embeddings, cache_queries) matching the provider this index was built with.
+        Created on first use, so lexical-only lookups never need an API client.
+        """
+        if self._embeddings is None:
+            with self._embeddings_lock:
+                if self._embeddings is None:
+                    self._embeddings = load_embeddings(self.index_dir, self.embedding_info)
+        return self._embeddings
+
+    def __len__(self) -> int:
+        """Number of id slots, including deleted ones (ids are never reused)."""
+        return len(self._offsets) - 1
+
+    @property
+    def dimension(self) -> int:
+        return self.index.d
+
+    def search(
+        self, vectors: np.ndarray, k: int, bitmap: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Search (n, d) float32 query vectors; returns (distances, ids), each (n, k).
+
+        bitmap is an optional packed id bitmap (see FilterIndex.bitmap) applied
+        as an IDSelector inside the FAISS search.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self._live_bitmap is not None:
+            bitmap = self._live_bitmap if bitmap is None else bitmap & self._live_bitmap
+        selector = faiss.IDSelectorBitmap(bitmap) if bitmap is not None else None
+        if self._is_ivf:
+            params = faiss.SearchParametersIVF(nprobe=self.nprobe)
+        elif self._is_hnsw:
+            params = faiss.SearchParametersHNSW(efSearch=max(self.ef_search, k))
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return self.index.search(vectors, k)
+        if selector is not None:
+            params.sel = selector
+        return self.index.search(vectors, k, params=params)
+
+    def reconstruct(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Stored vectors for the given ids as an (n, d) float32 array. Approximate for
+        quantized codecs, and mapped back through the PCA for projected indexes.
+        """
+        if self._is_ivf and not self._has_direct_map:
+            # Built once, on first use; concurrent searches (retrieve_many) share the index
+            with self._direct_map_lock:
+                if not self._has_direct_map:
+                    # Hashtable rather than array: ids are slots, not 0..ntotal-1, after updates
+                    faiss.extract_index_ivf(self.index).set_direct_map_type(faiss.DirectMap.Hashtable)
+                    self._has_direct_map = True
+        return self.index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+
+    def get_document(self, i: int) -> Document:
+        """Decode the document stored for vector id i."""
+        return self._docs.get(i)
+
+    def get_documents(self, ids) -> list[Document]:
+        """Decode documents for the given ids, skipping FAISS's -1 placeholders."""
+        return [self.get_document(int(i)) for i in ids if i >= 0]
+
+    def review_keys(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Parent review id of every vector id. Chunks without a review (or indexes
+        without a review store) get the unique key -(id + 1), so they never collapse.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.reviews is None:
+            return -(ids + 1)
+        reviews = self.reviews.chunk_reviews[ids]
+        return np.where(reviews >= 0, reviews, -(ids + 1))
+
+    def review_features(self, ids: np.ndarray) -> dict[str, np.ndarray]:
+        """Re-ranking features of the parent review of each vector id (see ReviewStore.review_features)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.reviews is None:
+            return {name: np.full(len(ids), np.nan, dtype=np.float32) for name in REVIEW_FEATURE_NAMES}
+        return self.reviews.review_features(self.reviews.chunk_reviews[ids])
+
+    def get_reviews(self, ids) -> list[Document]:
+        """Whole parent review of each vector id (the chunk itself when it has none)."""
+        docs = []
+        for i, key in zip(ids, self.review_keys(ids)):
+            docs.append(self.reviews.get(int(key)) if key >= 0 else self.get_document(int(i)))
+        return docs
+
+
+def _recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(np.intersect1d(f[f >= 0], t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def recall_report(
+    index_dir: Path,
+    vectors: np.ndarray,
+    k: int = 10,
+    n_queries: int = 200,
+    sweep_size: int = 20000,
+    pca_dim: int = config.PCA_DIM,
+    pq_m: int = config.PQ_M,
+    pq_nbits: int = config.PQ_NBITS,
+) -> dict:
+    """
+    Measure recall@k against exact float32 search and the memory cost of the stored vectors.
+
+    Queries are a fixed sample of the indexed vectors. "index" describes the index
+    just written to index_dir (searched through ReviewIndex with the runtime
+    nprobe/ef_search); "codecs" compares every VECTOR_CODECS option on a flat
+    index over up to sweep_size vectors, with the same PCA setting. PQ is
+    left out when the sample is too small to train its 2**pq_nbits centroids.
+
+    Args:
+        index_dir: Directory written by write_review_index().
+        vectors: The (n, d) float32 vectors that were indexed, in id order.
+        k: Neighbours compared per query.
+        n_queries: Number of sampled queries.
+        sweep_size: Vectors used for the codec comparison.
+        pca_dim: PCA setting for the codec comparison (0 = none).
+        pq_m: PQ sub-quantizers for the codec comparison.
+        pq_nbits: Bits per PQ code for the codec comparison.
+
+    Returns:
+        The report dict (also written to build_report.json).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+    k = min(k, n)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(n, size=min(n_queries, n), replace=False)]
+    _, truth = faiss.knn(queries, vectors, k)
+
+    review_index = ReviewIndex(index_dir)
+    _, found = review_index.search(queries, k)
+    index_bytes = os.path.getsize(index_dir / INDEX_FILE)
+    report = {
+        "k": k,
+        "queries": len(queries),
+        "ntotal": n,
+        "dimension": d,
+        "float32_bytes_per_vector": d * 4,
+        "index": {
+            "type": describe_index(review_index.index),
+            "recall": round(_recall_at_k(found, truth), 4),
+            "file_bytes": index_bytes,
+            "bytes_per_vector": round(index_bytes / max(n, 1), 1),
+        },
+        "codecs": [],
+    }
+
+    sample = vectors if n <= sweep_size else vectors[np.sort(rng.choice(n, size=sweep_size, replace=False))]
+    sample_queries = sample[rng.choice(len(sample), size=min(n_queries, len(sample)), replace=False)]
+    _, sample_truth = faiss.knn(sample_queries, sample, k)
+    for codec in VECTOR_CODECS:
+        if codec == "pq" and len(sample) < _MIN_POINTS_PER_CENTROID * 2 ** pq_nbits:
+            continue
+        try:
+            index = build_faiss_index(sample, "flat", pca_dim=pca_dim, codec=codec, pq_m=pq_m, pq_nbits=pq_nbits)
+        except ValueError:
+            continue
+        _, sample_found = index.search(sample_queries, k)
+        report["codecs"].append({
+            "codec": codec,
+            "pca_dim": _base_index(index).d,
+            "recall": round(_recall_at_k(sample_found, sample_truth), 4),
+            "bytes_per_vector": index.sa_code_size(),
+        })
+
+    replace_text(index_dir / REPORT_FILE, json.dumps(report, indent=4))
+    return report
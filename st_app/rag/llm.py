@@ -13,6 +13,19 @@ DEFAULT_MODEL = os.getenv("LLM_MODEL", "solar-mini")
 UPSTAGE_API_KEY_ENV = "UPSTAGE_API_KEY"
 
 
+def _get_llm(temperature: float) -> ChatUpstage:
+    load_dotenv()
+
+    api_key = os.getenv(UPSTAGE_API_KEY_ENV)
+    if not api_key or not api_key.strip():
+        raise ValueError(
+            f"Missing API key: set {UPSTAGE_API_KEY_ENV} in your environment or .env file."
+        )
+
+    # ChatUpstage reads UPSTAGE_API_KEY from environment by default
+    return ChatUpstage(model=DEFAULT_MODEL, temperature=temperature)
+
+
 def generate_text(
     system_prompt: str,
     user_prompt: str,
@@ -32,16 +45,7 @@ def generate_text(
     Raises:
         ValueError: If UPSTAGE_API_KEY is not set in the environment.
     """
-    load_dotenv()
-
-    api_key = os.getenv(UPSTAGE_API_KEY_ENV)
-    if not api_key or not api_key.strip():
-        raise ValueError(
-            f"Missing API key: set {UPSTAGE_API_KEY_ENV} in your environment or .env file."
-        )
-
-    # ChatUpstage reads UPSTAGE_API_KEY from environment by default
-    llm = ChatUpstage(model=DEFAULT_MODEL, temperature=temperature)
+    llm = _get_llm(temperature)
 
     resp = llm.invoke(
         [
@@ -54,6 +58,27 @@ def generate_text(
     return (getattr(resp, "content", "") or "").strip()
 
 
+async def agenerate_text(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float = 0.2,
+) -> str:
+    """
+    Async version of generate_text(); awaits the LLM call instead of blocking a thread.
+    Arguments, return value and errors are the same as generate_text().
+    """
+    llm = _get_llm(temperature)
+
+    resp = await llm.ainvoke(
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+    )
+
+    return (getattr(resp, "content", "") or "").strip()
+
+
 if __name__ == "__main__":
     # Minimal test call (optional).
     load_dotenv()
@@ -0,0 +1,262 @@
+"""
+Title namespaces: one review index per movie title, opened on first use.
+
+Index directories:
+    DEFAULT_TITLE            st_app/db/faiss_index (the original single-title location)
+    any other title          st_app/db/titles/<title>/faiss_index
+
+Build a title with python -m st_app.rag.embedder --title <title> --data_dir <csv dir>.
+Each directory is an index root whose CURRENT version is served (see st_app.rag.versions).
+
+NamespaceRegistry keeps the open indexes in an LRU bounded by the total size
+of their index files (everything is memory-mapped, so this is the most they
+can keep resident) and by a count. When a newly used title pushes the
+registry over either limit, the least recently used titles are closed;
+pinned titles are never evicted. Searches that already hold an evicted
+index finish normally; its memory is released once the last one returns.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from st_app.rag import config
+from st_app.rag.index_store import INDEX_FILES, VERSION_FILE
+from st_app.rag.shards import SearchIndex, open_index, shard_dirs
+from st_app.rag.versions import current_version, resolve_index_dir
+
+DEFAULT_INDEX_DIR = Path(__file__).resolve().parent.parent / "db" / "faiss_index"
+TITLES_DIR = Path(os.getenv("RAG_TITLES_DIR", Path(__file__).resolve().parent.parent / "db" / "titles"))
+
+_TITLE_RE = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
+# Seconds before an index version that failed to open is tried again
+REOPEN_BACKOFF = 30.0
+
+
+def title_index_dir(title: str, titles_dir: Path = TITLES_DIR) -> Path:
+    """Index directory of a title; raises ValueError for names that are not a plain slug."""
+    if title == config.DEFAULT_TITLE:
+        return DEFAULT_INDEX_DIR
+    if not _TITLE_RE.match(title):
+        raise ValueError(f"Invalid title {title!r}; use lowercase letters, digits, '-' and '_'.")
+    return titles_dir / title / "faiss_index"
+
+
+def index_signature(index_dir: Path) -> tuple:
+    """Cheap fingerprint of the index directory (stat calls and the CURRENT pointer only)."""
+    version = current_version(index_dir)
+    if version is not None:
+        return (version,) + index_signature(resolve_index_dir(index_dir))
+    shards = shard_dirs(index_dir)
+    if shards:
+        return tuple((site, index_signature(path)) for site, path in shards.items())
+    try:
+        st = os.stat(index_dir / VERSION_FILE)
+        return ((VERSION_FILE, st.st_mtime_ns, st.st_size),)
+    except FileNotFoundError:
+        pass
+    signature = []
+    for name in INDEX_FILES:
+        try:
+            st = os.stat(index_dir / name)
+        except FileNotFoundError:
+            continue
+        signature.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class IndexHandle:
+    """Process-wide, thread-safe index handle with hot reload on index rebuild."""
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        # Runtime search knobs applied to every index this handle opens
+        self.search_params: dict = {}
+        # (signature, index) is replaced as a single reference so readers
+        # never see a signature paired with the wrong index.
+        self._state: tuple[tuple, SearchIndex] | None = None
+        # (signature, time.monotonic()) of the last version that failed to open
+        self._failed: tuple[tuple, float] | None = None
+
+    def get(self) -> SearchIndex:
+        """
+        Return the current index, (re)opening it if the index changed on disk.
+
+        When a changed index fails to open, the previous one keeps being served
+        and the failure is printed once; the same version is only tried again
+        after REOPEN_BACKOFF seconds, and a new version right away.
+        """
+        if not self.index_dir.exists():
+            print(f"Error: FAISS index path does not exist: {self.index_dir}")
+            print("Run the embedder first to create the index (e.g. python -m st_app.rag.embedder).")
+            raise FileNotFoundError(f"FAISS index not found: {self.index_dir}")
+
+        signature = index_signature(self.index_dir)
+        state = self._state
+        if state is not None and state[0] == signature:
+            return state[1]
+
+        with self._lock:
+            state = self._state
+            if state is not None and state[0] == signature:
+                return state[1]
+            failed = self._failed
+            retry = failed is None or failed[0] != signature or time.monotonic() - failed[1] >= REOPEN_BACKOFF
+            if state is not None and not retry:
+                return state[1]
+            try:
+                previous = state[1] if state is not None else None
+                index = open_index(resolve_index_dir(self.index_dir), previous, **self.search_params)
+            except Exception as e:
+                if failed is None or failed[0] != signature:
+                    print(f"Error: could not open the index at {self.index_dir}: {e!r}")
+                self._failed = (signature, time.monotonic())
+                # A rebuild may be in progress; keep serving the previous index.
+                if state is not None:
+                    return state[1]
+                raise
+            self._state, self._failed = (signature, index), None
+            return index
+
+    def set_search_params(self, **params) -> None:
+        """Update nprobe / ef_search on the open index and on future reloads."""
+        self.search_params.update(params)
+        state = self._state
+        if state is not None:
+            for name, value in params.items():
+                setattr(state[1], name, value)
+
+    def clear(self) -> None:
+        """Drop the cached index so the next call reopens it from disk."""
+        with self._lock:
+            self._state = None
+
+
+@dataclass
+class _Resident:
+    handle: IndexHandle
+    index: SearchIndex | None = None
+    nbytes: int = 0
+
+
+class NamespaceRegistry:
+    """
+    Open title indexes in an LRU bounded by max_bytes of index files and max_resident titles.
+
+    Args:
+        titles_dir: Parent directory of the per-title index directories.
+        max_bytes: Total index file size kept open before evicting.
+        max_resident: Number of titles kept open before evicting.
+        pinned: Titles that are never evicted.
+    """
+
+    def __init__(
+        self,
+        titles_dir: Path = TITLES_DIR,
+        max_bytes: int = int(config.NAMESPACE_MAX_MB * 1024 * 1024),
+        max_resident: int = config.NAMESPACE_MAX_RESIDENT,
+        pinned: tuple[str, ...] = (config.DEFAULT_TITLE,),
+    ):
+        self.titles_dir = titles_dir
+        self.max_bytes = max_bytes
+        self.max_resident = max_resident
+        self.pinned = set(pinned)
+        self.search_params: dict = {}
+        self._residents: OrderedDict[str, _Resident] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    def index_dir(self, title: str) -> Path:
+        return title_index_dir(title, self.titles_dir)
+
+    def get(self, title: str) -> SearchIndex:
+        """Return the index of a title, opening it (and evicting others) if it is not resident."""
+        with self._lock:
+            resident = self._residents.get(title)
+            if resident is None:
+                resident = _Resident(IndexHandle(self.index_dir(title)))
+                resident.handle.search_params.update(self.search_params)
+                self._residents[title] = resident
+            self._residents.move_to_end(title)
+
+        start = time.perf_counter()
+        try:
+            index = resident.handle.get()
+        except Exception:
+            with self._lock:
+                if self._residents.get(title) is resident and resident.index is None:
+                    del self._residents[title]
+            raise
+
+        if index is resident.index:
+            with self._lock:
+                self.hits += 1
+            return index
+        # First open, or a reload after the title was rebuilt
+        nbytes = _dir_bytes(resolve_index_dir(resident.handle.index_dir))
+        with self._lock:
+            self.loads += 1
+            self.load_seconds += time.perf_counter() - start
+            resident.index, resident.nbytes = index, nbytes
+            self._evict(keep=title)
+        return index
+
+    def _evict(self, keep: str) -> None:
+        """Close least recently used titles until both limits hold. Caller holds the lock."""
+        for title in list(self._residents):
+            if self._within_limits():
+                return
+            if title == keep or title in self.pinned:
+                continue
+            del self._residents[title]
+            self.evictions += 1
+
+    def _within_limits(self) -> bool:
+        return len(self._residents) <= self.max_resident and self.resident_bytes <= self.max_bytes
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(r.nbytes for r in self._residents.values())
+
+    def evict(self, title: str) -> bool:
+        """Close a title now (even if pinned); returns whether it was resident."""
+        with self._lock:
+            if self._residents.pop(title, None) is None:
+                return False
+            self.evictions += 1
+            return True
+
+    def set_search_params(self, **params) -> None:
+        """Apply nprobe / ef_search to every resident title and to titles opened later."""
+        with self._lock:
+            self.search_params.update(params)
+            handles = [r.handle for r in self._residents.values()]
+        for handle in handles:
+            handle.set_search_params(**params)
+
+    def stats(self) -> dict:
+        """Residency and load/eviction counters."""
+        with self._lock:
+            total = self.hits + self.loads
+            return {
+                "resident": list(self._residents),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "max_resident": self.max_resident,
+                "hits": self.hits,
+                "loads": self.loads,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "load_seconds": round(self.load_seconds, 3),
+            }
@@ -1,49 +1,481 @@
 """
 RAG retriever: load FAISS index and return top-k similar documents for a query.
+
+The index is memory-mapped once per process (see st_app.rag.index_store) and
+shared by every caller. Each lookup only stats the index files; when the
+embedder rewrites the index, the new one is opened and swapped in atomically
+while readers keep using the old handle until the swap completes.
+
+An index root holding per-site shards (see st_app.rag.shards) is searched
+across all shards in parallel; re-indexing one site only reopens that shard.
+
+With rerank (off by default; RAG_RERANK=1 turns it on), retrieval has two
+stages: the index search collects RERANK_CANDIDATES distinct reviews, and
+_rerank re-scores them with features computed locally in one vectorized pass
+(dense similarity, BM25 overlap, review length, subjectivity_score, recency)
+before the best top_k are returned.
 """
-from pathlib import Path
+import asyncio
+import os
+from dataclasses import dataclass
 
-from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
+import numpy as np
 from langchain_core.documents import Document
-from langchain_upstage import UpstageEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from st_app.rag import config
+from st_app.rag.cache import CachedQueryEmbeddings, QueryEmbeddingCache, ResultCache
+from st_app.rag.filters import ReviewFilter
+from st_app.rag.namespaces import DEFAULT_INDEX_DIR, NamespaceRegistry
+from st_app.rag.shards import SearchIndex
 
 # Project-root-based path: script lives in st_app/rag/, index is st_app/db/faiss_index
-FAISS_INDEX_DIR = Path(__file__).resolve().parent.parent / "db" / "faiss_index"
+# (the index of the default title; other titles live under st_app/db/titles)
+FAISS_INDEX_DIR = DEFAULT_INDEX_DIR
+
+# Retrieval modes: "dense" (FAISS), "lexical" (BM25 over clean_comment, no
+# embedding call) or "hybrid" (weighted fusion of both).
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+DEFAULT_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "dense")
+# Weight of the dense score in hybrid mode (1 - alpha goes to BM25)
+HYBRID_ALPHA = float(os.getenv("RAG_HYBRID_ALPHA", "0.5"))
+# Each side contributes top_k * HYBRID_FETCH_FACTOR candidates to the fusion
+HYBRID_FETCH_FACTOR = 4
+
+# Hits are collapsed to one whole review per source row; each search fetches
+# k * REVIEW_FETCH_FACTOR chunks, and more when that yields fewer than k reviews.
+REVIEW_FETCH_FACTOR = int(os.getenv("RAG_REVIEW_FETCH_FACTOR", "4"))
+
+# Maximal marginal relevance: candidates fetched = top_k * MMR_FETCH_FACTOR;
+# MMR_LAMBDA = 1 ranks by relevance only, 0 by diversity only.
+MMR_FETCH_FACTOR = int(os.getenv("RAG_MMR_FETCH_FACTOR", "4"))
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.5"))
 
+# Two-stage retrieval: the first stage collects RERANK_CANDIDATES distinct reviews,
+# the second re-scores them with cheap local features and keeps the best top_k.
+# Off by default (RAG_RERANK=1 turns it on for every call; rerank=True per call).
+RERANK_CANDIDATES = int(os.getenv("RAG_RERANK_CANDIDATES", "50"))
+RERANK = os.getenv("RAG_RERANK", "0") == "1" and RERANK_CANDIDATES > 0
+# Weights of the features: dense similarity to the query, BM25 score, log review
+# length, subjectivity_score and review date. Each is min-max normalized over the
+# candidates, so its own scale does not matter (subjectivity_score is an
+# unbounded preprocessing score, about 1.5-10 in the shipped CSVs, not 0-1).
+RERANK_WEIGHTS = {
+    "dense": float(os.getenv("RAG_RERANK_DENSE_WEIGHT", "1.0")),
+    "lexical": float(os.getenv("RAG_RERANK_LEXICAL_WEIGHT", "0.5")),
+    "length": float(os.getenv("RAG_RERANK_LENGTH_WEIGHT", "0.15")),
+    "subjectivity": float(os.getenv("RAG_RERANK_SUBJECTIVITY_WEIGHT", "0.15")),
+    "recency": float(os.getenv("RAG_RERANK_RECENCY_WEIGHT", "0.1")),
+}
 
-def retrieve(query: str, top_k: int = 3) -> list[Document]:
+# Shared across handles so repeated questions never hit the embedding API twice.
+_query_cache = QueryEmbeddingCache()
+# Finished results per index build; hits skip both the embedding API and FAISS.
+_result_cache = ResultCache()
+# Title -> index, opened on first use and evicted least-recently-used (see st_app.rag.namespaces)
+_registry = NamespaceRegistry()
+
+
+def get_index(title: str | None = None) -> SearchIndex:
     """
-    Load the FAISS index and return the top_k most similar documents for the query.
+    Return the shared, memory-mapped index (sharded or single) of a title.
+
+    Args:
+        title: Title namespace (default RAG_DEFAULT_TITLE, served from FAISS_INDEX_DIR).
+    """
+    return _registry.get(title or config.DEFAULT_TITLE)
+
+
+def set_search_params(nprobe: int | None = None, ef_search: int | None = None) -> None:
+    """
+    Tune the recall/latency trade-off of approximate indexes at runtime.
+
+    Args:
+        nprobe: IVF clusters visited per query (IVF-Flat / IVF-PQ indexes).
+        ef_search: HNSW search beam width (HNSW indexes).
+    """
+    params = {"nprobe": nprobe, "ef_search": ef_search}
+    _registry.set_search_params(**{k: v for k, v in params.items() if v is not None})
+
+
+def _query_embeddings(index: SearchIndex) -> Embeddings:
+    """Query embeddings matching the index's provider, behind the query cache for remote models."""
+    embeddings, cache_queries = index.query_embeddings()
+    if not cache_queries:
+        return embeddings
+    return CachedQueryEmbeddings(embeddings, index.embedding_model, _query_cache)
+
+
+def _embed_query(index: SearchIndex, query: str) -> np.ndarray:
+    return np.asarray([_query_embeddings(index).embed_query(query)], dtype=np.float32)
+
+
+async def _aembed_query(index: SearchIndex, query: str) -> np.ndarray:
+    # The first query of an index loads its embeddings (model files or an API client)
+    embeddings = await asyncio.to_thread(_query_embeddings, index)
+    vector = await embeddings.aembed_query(query)
+    return np.asarray([vector], dtype=np.float32)
+
+
+def query_cache_stats() -> dict:
+    """Hit/miss counters of the query-embedding cache."""
+    return _query_cache.stats()
+
+
+def result_cache_stats() -> dict:
+    """Hit/miss counters and size of the retrieval result cache."""
+    return _result_cache.stats()
+
+
+def namespace_stats() -> dict:
+    """Resident titles, memory use, loads and evictions of the title registry."""
+    return _registry.stats()
+
+
+def _compile_filter(index: SearchIndex, filters: ReviewFilter | None) -> np.ndarray | None:
+    """Packed id bitmap for the filter, or None when nothing is filtered."""
+    if filters is None or filters.is_empty():
+        return None
+    if index.filters is None:
+        raise ValueError(
+            "This index has no metadata filter data; rebuild it with python -m st_app.rag.embedder."
+        )
+    return index.filters.bitmap(filters)
+
+
+def _unpack(bitmap: np.ndarray | None, ntotal: int) -> np.ndarray | None:
+    if bitmap is None:
+        return None
+    return np.unpackbits(bitmap, count=ntotal, bitorder="little").astype(bool)
+
+
+def _min_max(x: np.ndarray) -> np.ndarray:
+    span = x.max() - x.min() if len(x) else 0.0
+    return (x - x.min()) / span if span > 0 else np.ones_like(x)
+
+
+def _hybrid_search(
+    index: SearchIndex,
+    query: str,
+    query_vector: np.ndarray,
+    top_k: int,
+    bitmap: np.ndarray | None = None,
+) -> np.ndarray:
+    """Fuse min-max normalized dense similarity and BM25 scores; returns the best top_k ids."""
+    fetch_k = top_k * HYBRID_FETCH_FACTOR
+    distances, dense_ids = index.search(query_vector, fetch_k, bitmap)
+    valid = dense_ids[0] >= 0
+    dense_ids, dense_sim = dense_ids[0][valid], -distances[0][valid]
+    lexical_ids, _ = index.lexical.search(query, fetch_k, _unpack(bitmap, len(index)))
+
+    candidates = np.union1d(dense_ids, lexical_ids)
+    if not len(candidates):
+        return candidates
+
+    # Chunks found only lexically get the lowest dense score among the candidates
+    dense = np.full(len(candidates), dense_sim.min() if len(dense_sim) else 0.0, dtype=np.float32)
+    dense[np.searchsorted(candidates, dense_ids)] = dense_sim
+    lexical = index.lexical.score_chunks(query, candidates)
+
+    fused = HYBRID_ALPHA * _min_max(dense) + (1.0 - HYBRID_ALPHA) * _min_max(lexical)
+    return candidates[np.argsort(-fused, kind="stable")[:top_k]]
+
+
+def _mmr_select(query_vector: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float) -> np.ndarray:
+    """
+    Maximal marginal relevance over an (n, d) candidate matrix; returns the positions
+    of the k picks in selection order. All similarities come from two matrix
+    products, so the only Python loop is over the k picks.
+    """
+    n = len(candidates)
+    if n <= 1 or k <= 0:
+        return np.arange(min(n, max(k, 0)))
+    normed = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+    relevance = normed @ query
+    redundancy = normed @ normed.T
+
+    selected = [int(np.argmax(relevance))]
+    max_sim = redundancy[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    for _ in range(min(k, n) - 1):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_sim
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        np.maximum(max_sim, redundancy[pick], out=max_sim)
+    return np.array(selected, dtype=np.int64)
+
+
+def _rerank(
+    index: SearchIndex,
+    query: str,
+    query_vector: np.ndarray | None,
+    ids: np.ndarray,
+    k: int,
+) -> np.ndarray:
+    """
+    Second stage: re-score candidate chunk ids (one per review) and return the best k.
+
+    Each feature is computed for all candidates in one NumPy pass, min-max
+    normalized over the candidates and weighted by RERANK_WEIGHTS. Unknown
+    values (e.g. no date) score as the worst candidate. query_vector is None
+    for lexical-only queries, which then have no dense feature.
+    """
+    if len(ids) <= 1:
+        return ids[:k]
+    review = index.review_features(ids)
+    features = {
+        "lexical": index.lexical.score_chunks(query, ids) if index.lexical is not None else None,
+        "length": np.log1p(review["word_count"]),
+        "subjectivity": review["subjectivity"],
+        "recency": review["days"],
+    }
+    if query_vector is not None:
+        # Stored vectors are mapped back through any PCA, so they compare with the raw query
+        features["dense"] = -np.square(index.reconstruct(ids) - query_vector[0]).sum(axis=1)
+
+    scores = np.zeros(len(ids), dtype=np.float32)
+    for name, values in features.items():
+        weight = RERANK_WEIGHTS[name]
+        if values is None or not weight:
+            continue
+        known = ~np.isnan(values)
+        if not known.any():
+            continue
+        scores += weight * _min_max(np.where(known, values, values[known].min()))
+    return ids[np.argsort(-scores, kind="stable")[:k]]
+
+
+def _check_mode(mode: str) -> None:
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {RETRIEVAL_MODES}")
+
+
+def _unique_reviews(index: SearchIndex, search, k: int) -> np.ndarray:
+    """
+    Best-ranked chunk id of each of the first k distinct parent reviews.
+
+    search(fetch_k) returns ranked chunk ids. Hits are collapsed by review;
+    when that leaves fewer than k reviews, the search is repeated with twice
+    the fetch size until k reviews are found or the index is exhausted.
+    """
+    fetch_k = max(k, 1) * REVIEW_FETCH_FACTOR
+    while True:
+        ids = np.asarray(search(fetch_k), dtype=np.int64)
+        _, first = np.unique(index.review_keys(ids), return_index=True)
+        unique = ids[np.sort(first)]
+        if len(unique) >= k or len(ids) < fetch_k or fetch_k >= len(index):
+            return unique[:k]
+        fetch_k *= 2
+
+
+def _lexical_only(
+    index: SearchIndex, query: str, top_k: int, mode: str, bitmap: np.ndarray | None, rerank: bool = RERANK
+) -> list[Document] | None:
+    """Answer lexical-mode queries from BM25 alone; None when an embedding is needed."""
+    if mode != "lexical" or index.lexical is None:
+        return None
+    allowed = _unpack(bitmap, len(index))
+
+    def search(fetch_k: int) -> np.ndarray:
+        return index.lexical.search(query, fetch_k, allowed)[0]
+
+    if rerank:
+        ids = _rerank(index, query, None, _unique_reviews(index, search, max(top_k, RERANK_CANDIDATES)), top_k)
+    else:
+        ids = _unique_reviews(index, search, top_k)
+    return index.get_reviews(ids) if len(ids) else None
+
+
+def _search_documents(
+    index: SearchIndex,
+    query: str,
+    query_vector: np.ndarray,
+    top_k: int,
+    mode: str,
+    bitmap: np.ndarray | None,
+    mmr: bool = False,
+    rerank: bool = RERANK,
+) -> list[Document]:
+    """CPU-bound part of retrieval once the query vector is known."""
+
+    def search(fetch_k: int) -> np.ndarray:
+        if mode == "hybrid" and index.lexical is not None:
+            return _hybrid_search(index, query, query_vector, fetch_k, bitmap)
+        _, ids = index.search(query_vector, fetch_k, bitmap)
+        return ids[0][ids[0] >= 0]
+
+    keep = top_k * MMR_FETCH_FACTOR if mmr else top_k
+    if rerank:
+        ids = _rerank(index, query, query_vector, _unique_reviews(index, search, max(keep, RERANK_CANDIDATES)), keep)
+    else:
+        ids = _unique_reviews(index, search, keep)
+    if mmr:
+        ids = ids[_mmr_select(query_vector[0], index.reconstruct(ids), top_k, MMR_LAMBDA)]
+    return index.get_reviews(ids)
+
+
+def retrieve(
+    query: str,
+    top_k: int = 3,
+    mode: str = DEFAULT_RETRIEVAL_MODE,
+    filters: ReviewFilter | None = None,
+    mmr: bool = False,
+    title: str | None = None,
+    rerank: bool = RERANK,
+) -> list[Document]:
+    """
+    Return the top_k most relevant reviews for the query from the shared index.
+
+    Matching chunks are collapsed by source row, and each hit is the whole
+    review (rating, date, site, comment), so the result holds top_k distinct reviews.
 
     Args:
         query: User query string.
         top_k: Number of documents to return (default 3).
+        mode: "dense", "lexical" or "hybrid" (default from RAG_RETRIEVAL_MODE).
+            Lexical and hybrid fall back to dense search when the index has no
+            BM25 data, and lexical also does when no query term is in the vocabulary.
+        filters: Optional site / date / rating restriction, applied inside the search.
+        mmr: Re-rank top_k * MMR_FETCH_FACTOR candidate reviews with maximal marginal
+            relevance (weight MMR_LAMBDA) to avoid near-duplicate reviews.
+            Not applied to pure lexical hits, which have no query vector.
+        title: Title namespace to search (default RAG_DEFAULT_TITLE).
+        rerank: Over-fetch RERANK_CANDIDATES reviews and re-rank them with local
+            features (query overlap, length, subjectivity, recency) before keeping
+            top_k (default off unless RAG_RERANK=1).
 
     Returns:
         List of Document objects (each has .page_content and .metadata).
     """
-    if not FAISS_INDEX_DIR.exists():
-        print(f"Error: FAISS index path does not exist: {FAISS_INDEX_DIR}")
-        print("Run the embedder first to create the index (e.g. python -m st_app.rag.embedder).")
-        raise FileNotFoundError(f"FAISS index not found: {FAISS_INDEX_DIR}")
-
-    load_dotenv()
-    embeddings = UpstageEmbeddings(model="solar-embedding-1-large")
-    vectorstore = FAISS.load_local(
-        str(FAISS_INDEX_DIR),
-        embeddings,
-        allow_dangerous_deserialization=True,
-    )
-    docs = vectorstore.similarity_search(query, k=top_k)
+    _check_mode(mode)
+    index = get_index(title)
+    options = (top_k, mode, filters, mmr, rerank, index.nprobe, index.ef_search)
+    docs = _result_cache.get(index.build_id, query, options)
+    if docs is not None:
+        return docs
+
+    bitmap = _compile_filter(index, filters)
+    docs = _lexical_only(index, query, top_k, mode, bitmap, rerank)
+    if docs is None:
+        docs = _search_documents(index, query, _embed_query(index, query), top_k, mode, bitmap, mmr, rerank)
+    _result_cache.put(index.build_id, query, options, docs)
+    return docs
+
+
+async def aretrieve(
+    query: str,
+    top_k: int = 3,
+    mode: str = DEFAULT_RETRIEVAL_MODE,
+    filters: ReviewFilter | None = None,
+    mmr: bool = False,
+    title: str | None = None,
+    rerank: bool = RERANK,
+) -> list[Document]:
+    """
+    Async retrieve(): the query is embedded with the async embedding client, and
+    opening the index, loading its embeddings, query cache lookups, filters,
+    BM25 lookups and the FAISS search run in worker threads, so the event loop
+    is never blocked on disk or CPU work. Arguments and result
+    are the same as retrieve().
+    """
+    _check_mode(mode)
+    index = await asyncio.to_thread(get_index, title)
+    options = (top_k, mode, filters, mmr, rerank, index.nprobe, index.ef_search)
+    docs = _result_cache.get(index.build_id, query, options)
+    if docs is not None:
+        return docs
+
+    bitmap = await asyncio.to_thread(_compile_filter, index, filters)
+    docs = await asyncio.to_thread(_lexical_only, index, query, top_k, mode, bitmap, rerank)
+    if docs is None:
+        query_vector = await _aembed_query(index, query)
+        loop = asyncio.get_running_loop()
+        docs = await loop.run_in_executor(
+            None, _search_documents, index, query, query_vector, top_k, mode, bitmap, mmr, rerank,
+        )
+    _result_cache.put(index.build_id, query, options, docs)
     return docs
 
 
-def retrieve_debug(query: str, top_k: int = 3) -> list[dict]:
+@dataclass
+class RetrievalBatch:
+    """
+    Compact result of retrieve_many(): row i holds the hits for queries[i].
+
+    ids are positions in the FAISS index (-1 where fewer than top_k hits exist)
+    and scores are the matching L2 distances (lower is closer). Documents are
+    only looked up when documents() is called.
+    """
+
+    ids: np.ndarray
+    scores: np.ndarray
+    index: SearchIndex
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def documents(self, i: int) -> list[Document]:
+        """Hydrate the hits of query i into Document objects."""
+        return self.index.get_documents(self.ids[i])
+
+    def to_documents(self) -> list[list[Document]]:
+        return [self.documents(i) for i in range(len(self))]
+
+
+def retrieve_many(
+    queries: list[str],
+    top_k: int = 3,
+    filters: ReviewFilter | None = None,
+    title: str | None = None,
+) -> RetrievalBatch:
+    """
+    Retrieve top_k documents for many queries at once.
+
+    All queries are embedded in batched requests (cache hits are skipped) and
+    searched with a single matrix FAISS search.
+
+    Args:
+        queries: Query strings.
+        top_k: Number of hits per query (default 3).
+        filters: Optional site / date / rating restriction shared by all queries.
+        title: Title namespace to search (default RAG_DEFAULT_TITLE).
+
+    Returns:
+        RetrievalBatch with (len(queries), top_k) id and score arrays.
+    """
+    index = get_index(title)
+    bitmap = _compile_filter(index, filters)
+    if not queries:
+        empty = np.empty((0, top_k))
+        return RetrievalBatch(empty.astype(np.int64), empty.astype(np.float32), index)
+
+    embeddings = _query_embeddings(index)
+    if hasattr(embeddings, "embed_queries"):
+        vectors = embeddings.embed_queries(queries)
+    else:
+        vectors = [embeddings.embed_query(q) for q in queries]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scores, ids = index.search(vectors, top_k, bitmap)
+    return RetrievalBatch(ids, scores, index)
+
+
+def retrieve_debug(
+    query: str,
+    top_k: int = 3,
+    mode: str = DEFAULT_RETRIEVAL_MODE,
+    filters: ReviewFilter | None = None,
+    mmr: bool = False,
+    title: str | None = None,
+    rerank: bool = RERANK,
+) -> list[dict]:
     """
     Same as retrieve() but returns a debug-friendly list of dicts with 'content' and 'metadata'.
     """
-    docs = retrieve(query, top_k=top_k)
+    docs = retrieve(query, top_k=top_k, mode=mode, filters=filters, mmr=mmr, title=title, rerank=rerank)
     return [{"content": d.page_content, "metadata": d.metadata} for d in docs]
 
 
@@ -0,0 +1,330 @@
+"""
+Parent reviews of the indexed chunks, used to return one whole review per hit.
+
+Long comments are cut into several chunks (see st_app.rag.documents), so
+several hits can point at the same review. The review store maps every
+vector id to its source row and keeps the row itself:
+
+    reviews.jsonl          one JSON object per review: review_id, site, source, row, rating,
+                           rating_value, date, comment, clean_comment, word_count, subjectivity_score
+    reviews.offsets.npy    uint64 byte offsets into reviews.jsonl (len = n_reviews + 1)
+    chunk_reviews.npy      review position of every vector id (-1 if the chunk has no row)
+    review_ids.npy         review_id of every review position
+    review_features.npz    per-review numeric features for re-ranking (see build_review_features)
+
+The .npy files and reviews.jsonl are memory-mapped like the docstore.
+
+review_id is stable across rebuilds and updates: the MongoDB source_id when
+the review has one, else a hash of its site, date and comment. Positions in
+reviews.jsonl are append-only; a replaced or deleted review keeps its line
+but no chunk points at it any more.
+"""
+import hashlib
+import json
+import mmap
+import os
+from pathlib import Path, PureWindowsPath
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+
+from st_app.rag.files import TMP_SUFFIX, save_array, save_arrays
+from st_app.rag.filters import RATING_SCALE, site_of, to_days
+
+REVIEWS_FILE = "reviews.jsonl"
+REVIEW_OFFSETS_FILE = "reviews.offsets.npy"
+CHUNK_REVIEWS_FILE = "chunk_reviews.npy"
+REVIEW_IDS_FILE = "review_ids.npy"
+REVIEW_FEATURES_FILE = "review_features.npz"
+REVIEW_FEATURE_NAMES = ("word_count", "subjectivity", "days")
+
+
+def source_name(source) -> str:
+    """File name of a source path; also strips Windows paths (C:\\...\\reviews.csv) on POSIX."""
+    return PureWindowsPath(str(source)).name
+
+
+def _row_key(metadata: dict) -> tuple[str, int] | None:
+    if "source" not in metadata or "row" not in metadata:
+        return None
+    return source_name(metadata["source"]), int(metadata["row"])
+
+
+def _format_rating(rating: float | None, site: str | None) -> str | None:
+    if rating is None:
+        return None
+    value = f"{rating:g}"
+    return f"{value}/{RATING_SCALE[site]:g}" if site in RATING_SCALE else value
+
+
+def make_review_id(site: str | None, date: str | None, comment: str, source_id=None) -> str:
+    """Stable id of a review: its source_id if known, else a content hash."""
+    if source_id is not None and str(source_id):
+        return str(source_id)
+    key = f"{site or ''}|{date or ''}|{comment}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def review_record(review: dict, source: str | None = None, row: int | None = None) -> dict:
+    """
+    Normalize one preprocessed review (a CSV row or a MongoDB document) into a store record.
+
+    Args:
+        review: Mapping with `site`, `rating`, `date`, `comment` and optionally
+            `clean_comment`, `source_id` or an explicit `review_id`.
+        source: File name the review was read from, if any.
+        row: Row number within source.
+    """
+    site = review.get("site") or (site_of(source) if source else None)
+    rating, date, comment = review.get("rating"), review.get("date"), review.get("comment")
+    rating = float(rating) if rating is not None and pd.notna(rating) else None
+    date = str(date)[:10] if date is not None and pd.notna(date) and str(date) else None
+    comment = comment if isinstance(comment, str) else ""
+    clean_comment = review.get("clean_comment")
+    word_count, subjectivity = review.get("raw_word_count"), review.get("subjectivity_score")
+    record = {
+        "review_id": review.get("review_id") or make_review_id(site, date, comment, review.get("source_id")),
+        "site": site,
+        "source": source_name(source) if source is not None else None,
+        "row": row,
+        "rating": _format_rating(rating, site),
+        "rating_value": rating,
+        "date": date,
+        "comment": comment,
+        # BM25 text; reviews that were never preprocessed fall back to the raw comment
+        "clean_comment": clean_comment if isinstance(clean_comment, str)
+        else ("" if "clean_comment" in review else comment),
+        "word_count": int(word_count) if word_count is not None and pd.notna(word_count) else len(comment.split()),
+        "subjectivity_score": float(subjectivity) if subjectivity is not None and pd.notna(subjectivity) else None,
+    }
+    return record
+
+
+def iter_review_rows(path: Path, batch_rows: int = 1000) -> Iterator[list[dict]]:
+    """
+    Rows of a preprocessed review CSV in batches of up to batch_rows, each row a
+    dict of its columns plus `site`, `source` (file name), `row` and a stable `review_id`.
+    """
+    site = site_of(path.name)
+    seen: dict[str, int] = {}
+    row = 0
+    with pd.read_csv(path, encoding="utf-8-sig", chunksize=batch_rows) as reader:
+        for frame in reader:
+            batch = []
+            for review in frame.to_dict("records"):
+                review.update(site=site, source=path.name, row=row)
+                review_id = review_record(review)["review_id"]
+                # Identical reposts (same site, date and text) still get distinct ids
+                count = seen.get(review_id, 0)
+                seen[review_id] = count + 1
+                review["review_id"] = f"{review_id}-{count}" if count else review_id
+                batch.append(review)
+                row += 1
+            yield batch
+
+
+def load_review_rows(path: Path) -> list[dict]:
+    """Every row of a preprocessed review CSV (see iter_review_rows)."""
+    return [review for batch in iter_review_rows(path) for review in batch]
+
+
+def load_review_records(path: Path) -> list[dict]:
+    """Store records for every row of a preprocessed review CSV, in row order."""
+    return [review_record(row, source=row["source"], row=row["row"]) for row in load_review_rows(path)]
+
+
+def review_document(record: dict) -> Document:
+    """One hydrated review: rating, date, site and the full comment."""
+    lines = [
+        f"{name}: {record[name]}"
+        for name in ("rating", "date", "site")
+        if record.get(name) is not None
+    ]
+    lines.append(f"comment: {record.get('comment') or ''}")
+    metadata = {
+        k: record[k]
+        for k in ("review_id", "source", "row", "site", "rating", "date")
+        if record.get(k) is not None
+    }
+    return Document(page_content="\n".join(lines), metadata=metadata)
+
+
+def _feature_columns(records: list[dict]) -> dict[str, np.ndarray]:
+    def column(values) -> np.ndarray:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float32)
+
+    return {
+        "word_count": column(r.get("word_count") for r in records),
+        "subjectivity": column(r.get("subjectivity_score") for r in records),
+        "days": column(to_days(r.get("date")) for r in records),
+    }
+
+
+def build_review_features(index_dir: Path, records: list[dict]) -> None:
+    """
+    Write review_features.npz: one value per review position, NaN where unknown.
+
+        word_count     words in the comment
+        subjectivity   subjectivity_score from preprocessing
+        days           review date in days since epoch
+    """
+    save_arrays(index_dir / REVIEW_FEATURES_FILE, **_feature_columns(records))
+
+
+def append_review_features(index_dir: Path, records: list[dict]) -> None:
+    """
+    Extend review_features.npz with the records appended to the review store.
+    Stores written before review features get them built from scratch.
+    """
+    path = index_dir / REVIEW_FEATURES_FILE
+    if not path.exists():
+        build_review_features(index_dir, ReviewStore(index_dir).records())
+        return
+    with np.load(path) as data:
+        columns = {name: data[name] for name in REVIEW_FEATURE_NAMES}
+    new = _feature_columns(records)
+    save_arrays(path, **{name: np.concatenate([columns[name], new[name]]) for name in REVIEW_FEATURE_NAMES})
+
+
+class ReviewStoreWriter:
+    """
+    Write a review store batch by batch: lines go straight to reviews.jsonl and
+    only offsets, review ids, features and chunk positions are kept until close().
+
+        writer = ReviewStoreWriter(index_dir)
+        for records, chunk_records in batches:
+            writer.add(records, chunk_records)
+        chunk_reviews = writer.close()
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self._lines_path = self.index_dir / (REVIEWS_FILE + TMP_SUFFIX)
+        self._lines = open(self._lines_path, "wb")
+        self._offsets = [np.zeros(1, dtype=np.uint64)]
+        self._review_ids = [np.empty(0, dtype=str)]
+        self._chunk_reviews = [np.empty(0, dtype=np.int64)]
+        self._features: list[dict[str, np.ndarray]] = []
+        self.n_reviews = 0
+
+    def add(self, records: list[dict], chunk_records) -> None:
+        """
+        Append review records and the chunks added for them.
+
+        Args:
+            records: Review records (see review_record), in review position order.
+            chunk_records: Index into records of every new chunk (-1 if it has no review).
+        """
+        sizes = np.zeros(len(records), dtype=np.uint64)
+        for i, record in enumerate(records):
+            line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+            self._lines.write(line)
+            sizes[i] = len(line)
+        self._offsets.append(self._offsets[-1][-1] + np.cumsum(sizes, dtype=np.uint64))
+        chunk_records = np.asarray(chunk_records, dtype=np.int64)
+        self._chunk_reviews.append(np.where(chunk_records >= 0, chunk_records + self.n_reviews, -1))
+        self._review_ids.append(np.array([r["review_id"] for r in records], dtype=str))
+        self._features.append(_feature_columns(records))
+        self.n_reviews += len(records)
+
+    def close(self) -> np.ndarray:
+        """
+        Publish the review store.
+
+        Returns:
+            chunk_reviews: the review position of every chunk (-1 if it has none).
+        """
+        self._lines.close()
+        os.replace(self._lines_path, self.index_dir / REVIEWS_FILE)
+        chunk_reviews = np.concatenate(self._chunk_reviews)
+        save_array(self.index_dir / REVIEW_OFFSETS_FILE, np.concatenate(self._offsets))
+        save_array(self.index_dir / CHUNK_REVIEWS_FILE, chunk_reviews)
+        save_array(self.index_dir / REVIEW_IDS_FILE, np.concatenate(self._review_ids))
+        features = self._features or [_feature_columns([])]
+        save_arrays(
+            self.index_dir / REVIEW_FEATURES_FILE,
+            **{name: np.concatenate([f[name] for f in features]) for name in REVIEW_FEATURE_NAMES},
+        )
+        return chunk_reviews
+
+
+def build_review_store(index_dir: Path, records: list[dict], documents: list[Document]) -> np.ndarray:
+    """
+    Write the review store for the documents (in vector order).
+
+    Args:
+        index_dir: Index directory to write into.
+        records: Review records (see load_review_records), in review position order.
+        documents: Documents whose metadata carries `source` and `row`.
+
+    Returns:
+        chunk_reviews: the review position of every document (-1 if it has none).
+    """
+    positions = {
+        (record["source"], record["row"]): position
+        for position, record in enumerate(records)
+        if record.get("source") is not None and record.get("row") is not None
+    }
+    writer = ReviewStoreWriter(index_dir)
+    writer.add(records, [positions.get(_row_key(doc.metadata), -1) for doc in documents])
+    return writer.close()
+
+
+class ReviewStore:
+    """Read-only, memory-mapped review store of one index directory."""
+
+    def __init__(self, index_dir: Path):
+        self.chunk_reviews = np.load(index_dir / CHUNK_REVIEWS_FILE, mmap_mode="r")
+        self._offsets = np.load(index_dir / REVIEW_OFFSETS_FILE, mmap_mode="r")
+        with open(index_dir / REVIEWS_FILE, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self._offsets[-1] else b""
+        ids_path = index_dir / REVIEW_IDS_FILE
+        self._review_ids = np.load(ids_path, mmap_mode="r") if ids_path.exists() else None
+        self.features: dict[str, np.ndarray] | None = None
+        if (index_dir / REVIEW_FEATURES_FILE).exists():
+            with np.load(index_dir / REVIEW_FEATURES_FILE) as data:
+                self.features = {name: data[name] for name in REVIEW_FEATURE_NAMES}
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def record(self, position: int) -> dict:
+        """Raw record of the review at a position."""
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        return json.loads(self._data[start:end])
+
+    def records(self) -> list[dict]:
+        """Every record in position order, including replaced and deleted ones."""
+        return [json.loads(line) for line in self._data[:int(self._offsets[-1])].splitlines()]
+
+    def review_ids(self) -> np.ndarray:
+        """
+        review_id of every position ("" for records without one). Stores written
+        before review_ids.npy read them from the records.
+        """
+        if self._review_ids is not None:
+            return self._review_ids
+        return np.array([record.get("review_id") or "" for record in self.records()], dtype=str)
+
+    def get(self, position: int) -> Document:
+        """Hydrate the review at a position."""
+        return review_document(self.record(position))
+
+    def review_features(self, positions: np.ndarray) -> dict[str, np.ndarray]:
+        """Features of the reviews at positions (NaN for -1 positions or an index without features)."""
+        positions = np.asarray(positions, dtype=np.int64)
+        out = {}
+        for name in REVIEW_FEATURE_NAMES:
+            values = np.full(len(positions), np.nan, dtype=np.float32)
+            if self.features is not None:
+                known = positions >= 0
+                values[known] = self.features[name][positions[known]]
+            out[name] = values
+        return out
+
+    @staticmethod
+    def exists(index_dir: Path) -> bool:
+        return all((index_dir / name).exists() for name in (REVIEWS_FILE, REVIEW_OFFSETS_FILE, CHUNK_REVIEWS_FILE))
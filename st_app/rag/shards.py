@@ -0,0 +1,320 @@
+"""
+Per-site sharded review index: one index directory per site under the index root.
+
+Layout:
+    <root>/embedding.json        embedding provider shared by every shard
+    <root>/local_embedder.npz    local model, when the provider is "local"
+    <root>/<site>/...            a complete ReviewIndex directory (see st_app.rag.index_store)
+
+Each shard is built, stamped and reloaded on its own, so re-indexing one site
+leaves the others untouched. ShardedIndex exposes the same search interface
+as ReviewIndex over one global id space: shard s owns the ids
+[offset_s, offset_s + len(shard_s)), with every offset a multiple of 8 so a
+packed filter bitmap is the byte-wise concatenation of the shard bitmaps.
+Searches fan out to the shards in a thread pool (FAISS releases the GIL)
+and the per-shard top-k lists are merged with a heap.
+"""
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from st_app.rag import config
+from st_app.rag.embeddings import load_embedding_info, load_embeddings
+from st_app.rag.filters import SITES, ReviewFilter
+from st_app.rag.index_store import INDEX_FILE, VERSION_FILE, ReviewIndex
+from st_app.rag.reviews import REVIEW_FEATURE_NAMES
+
+_executor = ThreadPoolExecutor(max_workers=config.SHARD_WORKERS, thread_name_prefix="rag-shard")
+
+
+def shard_dirs(index_dir: Path) -> dict[str, Path]:
+    """Shard directories present under index_dir, keyed by site (empty for an unsharded index)."""
+    return {
+        site: index_dir / site
+        for site in SITES
+        if (index_dir / site / INDEX_FILE).exists()
+    }
+
+
+def _read_build_id(shard_dir: Path) -> str | None:
+    try:
+        return (shard_dir / VERSION_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+
+
+def _merge_top_k(rows: list[tuple[np.ndarray, np.ndarray]], k: int, reverse: bool = False):
+    """
+    Merge per-shard (scores, ids) lists, each already sorted, into the global top k.
+    reverse=True for similarity scores (higher is better), False for distances.
+    """
+    streams = [
+        zip(scores.tolist(), ids.tolist()) for scores, ids in rows
+    ]
+    key = (lambda pair: -pair[0]) if reverse else (lambda pair: pair[0])
+    merged = list(islice(heapq.merge(*streams, key=key), k))
+    scores = np.array([s for s, _ in merged], dtype=np.float32)
+    ids = np.array([i for _, i in merged], dtype=np.int64)
+    return scores, ids
+
+
+class _ShardedFilters:
+    """FilterIndex over all shards: bitmaps are the concatenated shard bitmaps."""
+
+    def __init__(self, sharded: "ShardedIndex"):
+        self._sharded = sharded
+
+    def bitmap(self, review_filter: ReviewFilter) -> np.ndarray:
+        parts = []
+        for site, shard, offset in self._sharded.shards():
+            if review_filter.sites is not None and site not in review_filter.sites:
+                # Whole shard excluded: all-zero bytes, skipped by search()
+                parts.append(np.zeros((len(shard) + 7) // 8, dtype=np.uint8))
+            else:
+                parts.append(shard.filters.bitmap(review_filter))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint8)
+
+    def mask(self, review_filter: ReviewFilter) -> np.ndarray:
+        return np.unpackbits(
+            self.bitmap(review_filter), count=len(self._sharded), bitorder="little"
+        ).astype(bool)
+
+
+class _ShardedLexical:
+    """BM25Index over all shards. Each shard scores with its own corpus statistics."""
+
+    def __init__(self, sharded: "ShardedIndex"):
+        self._sharded = sharded
+
+    def search(
+        self, query: str, k: int, allowed: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        def search_shard(shard: ReviewIndex, offset: int):
+            shard_allowed = None if allowed is None else allowed[offset:offset + len(shard)]
+            if shard_allowed is not None and not shard_allowed.any():
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+            ids, scores = shard.lexical.search(query, k, shard_allowed)
+            return scores, ids + offset
+
+        rows = self._sharded.map_shards(search_shard)
+        scores, ids = _merge_top_k(rows, k, reverse=True)
+        return ids, scores
+
+    def score_chunks(self, query: str, ids: np.ndarray) -> np.ndarray:
+        scores = np.zeros(len(ids), dtype=np.float32)
+        for shard, local, positions in self._sharded.split_ids(ids):
+            scores[positions] = shard.lexical.score_chunks(query, local)
+        return scores
+
+
+class ShardedIndex:
+    """
+    Read-only view of a sharded index root with the ReviewIndex search interface.
+
+    Shards whose build id did not change are reused from `previous`, so
+    re-indexing one site only reopens that site's files.
+    """
+
+    def __init__(
+        self,
+        index_dir: Path,
+        nprobe: int = config.IVF_NPROBE,
+        ef_search: int = config.HNSW_EF_SEARCH,
+        previous: "ShardedIndex | None" = None,
+    ):
+        self.index_dir = Path(index_dir)
+        dirs = shard_dirs(self.index_dir)
+        if not dirs:
+            raise FileNotFoundError(
+                f"No shards found in {self.index_dir}. "
+                "Rebuild the index with python -m st_app.rag.embedder."
+            )
+        reusable = previous._shards if previous is not None else {}
+
+        self._shards: dict[str, ReviewIndex] = {}
+        offsets = [0]
+        review_offsets = [0]
+        for site, shard_dir in dirs.items():
+            shard = reusable.get(site)
+            if shard is None or shard.build_id != _read_build_id(shard_dir):
+                shard = ReviewIndex(shard_dir, nprobe=nprobe, ef_search=ef_search)
+            self._shards[site] = shard
+            # Round up to a whole byte so shard bitmaps concatenate without shifting
+            offsets.append(offsets[-1] + (len(shard) + 7) // 8 * 8)
+            review_offsets.append(review_offsets[-1] + (len(shard.reviews) if shard.reviews else 0))
+        self._offsets = np.array(offsets, dtype=np.int64)
+        self._review_offsets = review_offsets
+        self._entries = [
+            (site, shard, offset)
+            for (site, shard), offset in zip(self._shards.items(), offsets)
+        ]
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+
+        self.build_id = "|".join(f"{site}:{shard.build_id}" for site, shard in self._shards.items())
+        shards = self._shards.values()
+        self.lexical = _ShardedLexical(self) if all(s.lexical is not None for s in shards) else None
+        self.filters = _ShardedFilters(self) if all(s.filters is not None for s in shards) else None
+
+        self.embedding_info = load_embedding_info(self.index_dir)
+        self._embeddings: tuple[Embeddings, bool] | None = None
+        self._embeddings_lock = threading.Lock()
+
+    @property
+    def nprobe(self) -> int:
+        return self._nprobe
+
+    @nprobe.setter
+    def nprobe(self, value: int) -> None:
+        self._nprobe = value
+        for shard in self._shards.values():
+            shard.nprobe = value
+
+    @property
+    def ef_search(self) -> int:
+        return self._ef_search
+
+    @ef_search.setter
+    def ef_search(self, value: int) -> None:
+        self._ef_search = value
+        for shard in self._shards.values():
+            shard.ef_search = value
+
+    @property
+    def embedding_model(self) -> str:
+        return self.embedding_info["model"]
+
+    def query_embeddings(self) -> tuple[Embeddings, bool]:
+        """(embeddings, cache_queries) for the provider shared by all shards; created on first use."""
+        if self._embeddings is None:
+            with self._embeddings_lock:
+                if self._embeddings is None:
+                    self._embeddings = load_embeddings(self.index_dir, self.embedding_info)
+        return self._embeddings
+
+    def __len__(self) -> int:
+        """Size of the global id space (shard sizes rounded up to multiples of 8)."""
+        return int(self._offsets[-1])
+
+    @property
+    def dimension(self) -> int:
+        return next(iter(self._shards.values())).dimension
+
+    @property
+    def sites(self) -> tuple[str, ...]:
+        return tuple(self._shards)
+
+    def shards(self):
+        """Iterate (site, shard, id offset)."""
+        return iter(self._entries)
+
+    def map_shards(self, fn) -> list:
+        """Run fn(shard, offset) for every shard in the thread pool; results in shard order."""
+        futures = [_executor.submit(fn, shard, offset) for _, shard, offset in self.shards()]
+        return [future.result() for future in futures]
+
+    def split_ids(self, ids: np.ndarray):
+        """Group global ids by shard: yields (shard, local ids, positions in ids)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        owner = np.searchsorted(self._offsets, ids, side="right") - 1
+        for s, (_, shard, offset) in enumerate(self.shards()):
+            positions = np.flatnonzero((owner == s) & (ids >= 0))
+            if len(positions):
+                yield shard, ids[positions] - offset, positions
+
+    def search(
+        self, vectors: np.ndarray, k: int, bitmap: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Search every shard concurrently and merge; returns (distances, ids), each (n, k),
+        padded with (inf, -1) like FAISS. Shards with no allowed id in bitmap are skipped.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        def search_shard(shard: ReviewIndex, offset: int):
+            shard_bitmap = None
+            if bitmap is not None:
+                shard_bitmap = bitmap[offset // 8:(offset + len(shard) + 7) // 8]
+                if not shard_bitmap.any():
+                    return None
+            distances, ids = shard.search(vectors, k, shard_bitmap)
+            return distances, np.where(ids >= 0, ids + offset, -1)
+
+        results = [r for r in self.map_shards(search_shard) if r is not None]
+        out_distances = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        out_ids = np.full((len(vectors), k), -1, dtype=np.int64)
+        for q in range(len(vectors)):
+            rows = []
+            for distances, ids in results:
+                valid = ids[q] >= 0
+                rows.append((distances[q][valid], ids[q][valid]))
+            scores, ids = _merge_top_k(rows, k)
+            out_distances[q, :len(ids)] = scores
+            out_ids[q, :len(ids)] = ids
+        return out_distances, out_ids
+
+    def reconstruct(self, ids: np.ndarray) -> np.ndarray:
+        """Stored vectors for the given global ids as an (n, d) float32 array."""
+        ids = np.asarray(ids, dtype=np.int64)
+        out = np.zeros((len(ids), self.dimension), dtype=np.float32)
+        for shard, local, positions in self.split_ids(ids):
+            out[positions] = shard.reconstruct(local)
+        return out
+
+    def get_document(self, i: int) -> Document:
+        _, shard, offset = self._entries[int(np.searchsorted(self._offsets, i, side="right")) - 1]
+        return shard.get_document(i - offset)
+
+    def get_documents(self, ids) -> list[Document]:
+        """Decode documents for the given global ids, skipping -1 placeholders."""
+        return [self.get_document(int(i)) for i in ids if i >= 0]
+
+    def review_keys(self, ids: np.ndarray) -> np.ndarray:
+        """Global parent review key of every global id (see ReviewIndex.review_keys)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        keys = -(ids + 1)
+        for s, (_, shard, offset) in enumerate(self._entries):
+            positions = np.flatnonzero((ids >= offset) & (ids < offset + len(shard)))
+            if len(positions):
+                local = shard.review_keys(ids[positions] - offset)
+                keys[positions] = np.where(local >= 0, local + self._review_offsets[s], keys[positions])
+        return keys
+
+    def review_features(self, ids: np.ndarray) -> dict[str, np.ndarray]:
+        """Re-ranking features of the parent review of each global id (NaN where unknown)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        out = {name: np.full(len(ids), np.nan, dtype=np.float32) for name in REVIEW_FEATURE_NAMES}
+        for shard, local, positions in self.split_ids(ids):
+            for name, values in shard.review_features(local).items():
+                out[name][positions] = values
+        return out
+
+    def get_reviews(self, ids) -> list[Document]:
+        """Whole parent review of each global id (the chunk itself when it has none)."""
+        docs = []
+        for i in ids:
+            _, shard, offset = self._entries[int(np.searchsorted(self._offsets, i, side="right")) - 1]
+            docs.extend(shard.get_reviews([int(i) - offset]))
+        return docs
+
+
+# ReviewIndex for a single index directory, ShardedIndex for per-site shards
+SearchIndex = ReviewIndex | ShardedIndex
+
+
+def open_index(index_dir: Path, previous=None, **search_params) -> SearchIndex:
+    """
+    Open index_dir as a ShardedIndex when it holds per-site shards, else as a
+    single ReviewIndex. previous is the index being replaced (shards are reused).
+    """
+    if shard_dirs(index_dir):
+        if not isinstance(previous, ShardedIndex):
+            previous = None
+        return ShardedIndex(index_dir, previous=previous, **search_params)
+    return ReviewIndex(index_dir, **search_params)
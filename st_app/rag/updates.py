@@ -0,0 +1,324 @@
+"""
+Review updates: add, replace or remove reviews without rebuilding the index.
+
+Reviews are addressed by their stable review_id (see st_app.rag.reviews).
+Only the affected reviews are touched: their old vectors are removed by id,
+their new chunks are embedded and added under fresh vector ids, and their
+chunk text and review lines are appended to the existing files. BM25
+postings, filter arrays, review features and content hashes are patched for
+those reviews only; nothing is re-read or re-tokenized for the rest.
+
+    upsert_reviews([{"site": "imdb", "rating": 9, "date": "2024-05-01",
+                     "comment": "...", "source_id": "665f..."}])
+    delete_reviews(["665f..."])
+
+On a versioned root (see st_app.rag.versions) an update never writes to the
+published version: it stages a hard-linked copy, updates the touched shards
+there, re-checksums the changed files and publishes the copy by swapping
+CURRENT, so readers see the whole update or none of it. Unversioned roots
+(built before versioning) are still updated in place. Each touched shard is
+stamped with a new build id last, so running retrievers reload it on their
+next lookup. Updates assume a single writer per index root; a build and an
+update must not run at the same time.
+"""
+import json
+import shutil
+from pathlib import Path
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+from st_app.rag import config
+from st_app.rag.bm25 import BM25_FILE, update_bm25_index
+from st_app.rag.cache import EmbeddingStore
+from st_app.rag.docstore import DOC_META_FILE, DOCS_TEXT_FILE, append_documents, metadata_files
+from st_app.rag.documents import (
+    CONTENT_HASHES_FILE,
+    content_hashes,
+    load_content_hashes,
+    review_chunks,
+    write_content_hashes,
+)
+from st_app.rag.embed_jobs import EmbeddingJobRunner, embed_texts
+from st_app.rag.embeddings import document_store, load_embedding_info, load_embeddings
+from st_app.rag.files import replace_file, save_array
+from st_app.rag.filters import FILTERS_FILE, update_filter_index
+from st_app.rag.index_store import (
+    DELETED_FILE,
+    DOC_OFFSETS_FILE,
+    INDEX_FILE,
+    VERSION_FILE,
+    write_build_id,
+)
+from st_app.rag.namespaces import title_index_dir
+from st_app.rag.reviews import (
+    CHUNK_REVIEWS_FILE,
+    REVIEW_FEATURES_FILE,
+    REVIEW_IDS_FILE,
+    REVIEW_OFFSETS_FILE,
+    REVIEWS_FILE,
+    ReviewStore,
+    append_review_features,
+    review_record,
+)
+from st_app.rag.shards import shard_dirs
+from st_app.rag.versions import (
+    collect_garbage,
+    detach,
+    publish_version,
+    resolve_index_dir,
+    stage_copy,
+    update_manifest,
+)
+
+# Files of a ReviewIndex directory rewritten or appended to by an update
+UPDATED_FILES = (
+    DOCS_TEXT_FILE, DOC_META_FILE, DOC_OFFSETS_FILE, REVIEWS_FILE, REVIEW_OFFSETS_FILE, CHUNK_REVIEWS_FILE,
+    REVIEW_IDS_FILE, REVIEW_FEATURES_FILE, CONTENT_HASHES_FILE, DELETED_FILE, BM25_FILE, FILTERS_FILE,
+    INDEX_FILE, VERSION_FILE,
+)
+
+
+def _index_root(title: str | None, index_dir: Path | None) -> Path:
+    return Path(index_dir) if index_dir is not None else title_index_dir(title or config.DEFAULT_TITLE)
+
+
+def _append_lines(path: Path, offsets: np.ndarray, rows: list[dict]) -> np.ndarray:
+    """
+    Append one JSON line per row after the last indexed byte and return the extended offsets.
+    Readers only follow offsets, so bytes past the old end are invisible until the offsets are replaced.
+    """
+    end = int(offsets[-1])
+    new_offsets = [end]
+    with open(path, "r+b") as f:
+        f.truncate(end)
+        f.seek(end)
+        for row in rows:
+            line = json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n"
+            f.write(line)
+            new_offsets.append(new_offsets[-1] + len(line))
+    return np.concatenate([offsets, np.array(new_offsets[1:], dtype=np.uint64)])
+
+
+def _remove_vectors(index: faiss.Index, slots: np.ndarray) -> bool:
+    """Remove vectors by id; False when the index type cannot (HNSW), leaving them to be masked."""
+    if not len(slots):
+        return True
+    try:
+        index.remove_ids(np.asarray(slots, dtype=np.int64))
+    except RuntimeError:
+        return False
+    return True
+
+
+def update_shard(
+    shard_dir: Path,
+    remove_ids: set[str],
+    new_reviews: list[dict],
+    runner: EmbeddingJobRunner | None,
+    store: EmbeddingStore | None = None,
+    model: str | None = None,
+) -> dict | None:
+    """
+    Apply one batch to a ReviewIndex directory. Returns counts, or None if nothing changed.
+
+    When no vector is removed or added (e.g. the batch only touches reviews
+    without a comment), only content_hashes.json is rewritten and the build
+    id is kept ("build_id" is None), so retrievers keep their cached results.
+    Files appended to in place are detached first, so shard_dir may be a
+    hard-linked copy of a published version (see st_app.rag.versions.stage_copy).
+
+    Args:
+        shard_dir: ReviewIndex directory to update.
+        remove_ids: review_ids whose current chunks are removed (deleted and replaced reviews).
+        new_reviews: Reviews to add; their review_ids must also be in remove_ids.
+        runner: Embedding runner over the embeddings the index was built with (None without new_reviews).
+        store: Embedding store consulted before embedding new chunks (see st_app.rag.cache).
+        model: Model name of the embeddings, the store key.
+    """
+    if not ReviewStore.exists(shard_dir):
+        raise FileNotFoundError(f"No review store in {shard_dir}; rebuild the index with python -m st_app.rag.embedder.")
+    review_store = ReviewStore(shard_dir)
+    review_ids = review_store.review_ids()
+    if len(review_ids) and not review_ids[0]:
+        raise ValueError(f"Index at {shard_dir} has no stable review ids; rebuild it with python -m st_app.rag.embedder.")
+    n_reviews = len(review_store)
+    chunk_reviews = np.array(review_store.chunk_reviews, dtype=np.int64)
+    n_slots = len(chunk_reviews)
+
+    previous = load_content_hashes(shard_dir)
+    if previous is None:
+        # Shards written before content hashes: every review with chunks
+        live_positions = np.unique(chunk_reviews[chunk_reviews >= 0])
+        previous = content_hashes(review_store.record(int(p)) for p in live_positions)
+    # Every position ever holding a removed review; older ones are already dead, which is harmless
+    dead_positions = np.flatnonzero(np.isin(review_ids, list(remove_ids)))
+    dead_slots = np.flatnonzero(np.isin(chunk_reviews, dead_positions))
+    new_records = [review_record(r, source=r.get("source"), row=r.get("row")) for r in new_reviews]
+    new_chunks, chunk_records = review_chunks(new_records)
+    hashes = {review_id: h for review_id, h in previous.items() if review_id not in remove_ids}
+    hashes.update(content_hashes(new_records))
+    counts = {"reviews_removed": len(remove_ids & previous.keys()), "reviews_added": len(new_records)}
+
+    if not len(dead_slots) and not new_chunks:
+        if hashes == previous:
+            return None
+        write_content_hashes(shard_dir, hashes)
+        return {**counts, "vectors_removed": 0, "vectors_added": 0, "masked": False, "build_id": None}
+
+    index = faiss.read_index(str(shard_dir / INDEX_FILE))
+    if faiss.try_extract_index_ivf(index) is None and not isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        raise ValueError(f"Index at {shard_dir} has positional ids; rebuild it with python -m st_app.rag.embedder.")
+
+    # New reviews: chunked like a full build, embed only their chunks, add under fresh ids
+    new_chunk_reviews = np.array([n_reviews + i for i in chunk_records], dtype=np.int64)
+    new_slots = np.arange(n_slots, n_slots + len(new_chunks), dtype=np.int64)
+
+    removed = _remove_vectors(index, dead_slots)
+    if new_chunks:
+        vectors = embed_texts(runner, [c.page_content for c in new_chunks], store=store, model=model)
+        index.add_with_ids(vectors, new_slots)
+
+    deleted_path = shard_dir / DELETED_FILE
+    deleted = np.load(deleted_path) if deleted_path.exists() else np.empty(0, dtype=np.int64)
+    deleted = np.union1d(deleted, dead_slots).astype(np.int64)
+
+    # Docstore and review store: append the new lines, then publish the longer offsets
+    for path in [shard_dir / DOCS_TEXT_FILE, shard_dir / REVIEWS_FILE, *metadata_files(shard_dir)]:
+        if path.exists():
+            detach(path)
+    doc_offsets = np.load(shard_dir / DOC_OFFSETS_FILE)
+    doc_offsets = append_documents(shard_dir, doc_offsets, new_chunks)
+    review_offsets = np.load(shard_dir / REVIEW_OFFSETS_FILE)
+    review_offsets = _append_lines(shard_dir / REVIEWS_FILE, review_offsets, new_records)
+    chunk_reviews[dead_slots] = -1
+    chunk_reviews = np.concatenate([chunk_reviews, new_chunk_reviews])
+
+    save_array(shard_dir / DOC_OFFSETS_FILE, doc_offsets)
+    save_array(shard_dir / REVIEW_OFFSETS_FILE, review_offsets)
+    save_array(shard_dir / CHUNK_REVIEWS_FILE, chunk_reviews)
+    save_array(
+        shard_dir / REVIEW_IDS_FILE,
+        np.concatenate([review_ids, np.array([r["review_id"] for r in new_records], dtype=str)]),
+    )
+    save_array(deleted_path, deleted)
+
+    # Derived arrays, patched for the touched reviews; replaced and deleted reviews match nothing
+    update_bm25_index(shard_dir, dead_positions, [r["clean_comment"] for r in new_records], chunk_reviews)
+    update_filter_index(shard_dir, dead_slots, new_records, np.array(chunk_records, dtype=np.int64))
+    append_review_features(shard_dir, new_records)
+    write_content_hashes(shard_dir, hashes)
+
+    replace_file(shard_dir / INDEX_FILE, lambda p: faiss.write_index(index, str(p)))
+    build_id = write_build_id(shard_dir)
+    return {
+        **counts,
+        "vectors_removed": int(len(dead_slots)),
+        "vectors_added": int(len(new_slots)),
+        "masked": not removed,
+        "build_id": build_id,
+    }
+
+
+def _route(index_dir: Path, new_reviews: list[dict]) -> list[tuple[str | None, Path, list[dict]]]:
+    """(site, shard directory, reviews to add) for every shard of an index directory."""
+    shards = shard_dirs(index_dir)
+    if not shards:
+        return [(None, index_dir, new_reviews)]
+    by_site: dict[str, list[dict]] = {site: [] for site in shards}
+    for review in new_reviews:
+        site = review.get("site")
+        if site not in by_site:
+            raise ValueError(f"No shard for site {site!r} in {index_dir}; expected any of {list(shards)}")
+        by_site[site].append(review)
+    return [(site, path, by_site[site]) for site, path in shards.items()]
+
+
+def _apply(root: Path, remove_ids: set[str], new_reviews: list[dict]) -> dict:
+    """Route a batch to the shards of an index root (or the root itself when unsharded) and publish it."""
+    load_dotenv()
+    current_dir = resolve_index_dir(root)
+    info = load_embedding_info(current_dir)
+    runner = EmbeddingJobRunner(load_embeddings(current_dir, info)[0]) if new_reviews else None
+    store = document_store(info)
+
+    versioned = current_dir != Path(root)
+    version, index_dir = stage_copy(root) if versioned else (None, current_dir)
+    summary = {"reviews_removed": 0, "reviews_added": 0, "vectors_removed": 0, "vectors_added": 0, "shards": {}}
+    changed: list[Path] = []
+    try:
+        for site, path, reviews in _route(index_dir, new_reviews):
+            # A review that moved site is still removed from its old shard
+            result = update_shard(path, remove_ids, reviews, runner, store=store, model=info["model"])
+            if result is None:
+                continue
+            for key in ("reviews_removed", "reviews_added", "vectors_removed", "vectors_added"):
+                summary[key] += result[key]
+            summary["shards"][site or path.name] = result
+            changed.extend(path / name for name in UPDATED_FILES)
+            changed.extend(metadata_files(path))
+    except BaseException:
+        if versioned:
+            shutil.rmtree(index_dir, ignore_errors=True)
+        raise
+
+    if not versioned:
+        update_manifest(index_dir, changed)
+    elif not changed:
+        shutil.rmtree(index_dir)
+    else:
+        update_manifest(index_dir, changed, version=version)
+        publish_version(root, index_dir, verify=False)
+        summary["version"] = version
+        collect_garbage(root)
+    return summary
+
+
+def upsert_reviews(
+    reviews: list[dict],
+    title: str | None = None,
+    index_dir: Path | None = None,
+) -> dict:
+    """
+    Add reviews, replacing any indexed review with the same review_id.
+
+    Args:
+        reviews: Preprocessed reviews (MongoDB documents or CSV rows as dicts) with
+            `site`, `rating`, `date`, `comment` and optionally `clean_comment` and
+            `source_id` (used as the review_id). Without a source_id the review_id
+            is a hash of site, date and comment.
+        title: Title namespace to update (default RAG_DEFAULT_TITLE).
+        index_dir: Explicit index root; overrides title.
+
+    Returns:
+        Counts of removed/added reviews and vectors, per shard under "shards",
+        and the published "version" on a versioned root.
+    """
+    root = _index_root(title, index_dir)
+    latest: dict[str, dict] = {}
+    for review in reviews:
+        record = review_record(review)
+        # The last version of a review in the batch wins
+        latest[record["review_id"]] = {**review, "review_id": record["review_id"], "site": record["site"]}
+    return _apply(root, set(latest), list(latest.values()))
+
+
+def delete_reviews(
+    review_ids: list[str],
+    title: str | None = None,
+    index_dir: Path | None = None,
+) -> dict:
+    """
+    Remove reviews by review_id. Unknown ids are ignored.
+
+    Args:
+        review_ids: review_id values (see the metadata of retrieved reviews).
+        title: Title namespace to update (default RAG_DEFAULT_TITLE).
+        index_dir: Explicit index root; overrides title.
+
+    Returns:
+        Counts of removed reviews and vectors, per shard under "shards", and the
+        published "version" on a versioned root.
+    """
+    return _apply(_index_root(title, index_dir), {str(i) for i in review_ids}, [])
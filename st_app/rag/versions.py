@@ -0,0 +1,328 @@
+"""
+Versioned index snapshots: every build writes a new directory and is published
+by an atomic pointer swap.
+
+Layout of an index root (e.g. st_app/db/faiss_index):
+    CURRENT                      name of the published version
+    versions/<version>/          one complete index (a ReviewIndex directory or per-site shards)
+    versions/<version>/manifest.json
+                                 counts, embedding model, build time and a sha256 of every file
+    versions/<version>.partial/  a build in progress; renamed when complete
+    versions/<version>.partial/build.json
+                                 the build's plan and finished steps, so an interrupted
+                                 build with the same plan resumes instead of restarting
+
+Readers resolve CURRENT on every lookup (see st_app.rag.namespaces), so a
+running retriever keeps serving the old version until the pointer changes and
+then opens the new one; nobody ever sees a half-written index. Roots without
+CURRENT are read directly, which keeps indexes built before versioning working.
+
+In-place review updates (see st_app.rag.updates) also publish a new version:
+stage_copy() hard-links the published files into a staging directory, the
+update replaces or detaches the files it changes, and only those are
+checksummed again before the swap.
+
+Old versions are garbage-collected after each publish; the current and the
+previous version are always kept so readers still finishing a search on the
+previous one are not cut off, and so a bad build can be rolled back:
+
+    python -m st_app.rag.versions --title zootopia --list
+    python -m st_app.rag.versions --title zootopia --rollback
+
+Builds, updates and garbage collection assume a single writer per root.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from st_app.rag import config
+from st_app.rag.files import TMP_SUFFIX, replace_file, replace_text
+from st_app.rag.index_store import new_build_id
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+MANIFEST_FILE = "manifest.json"
+PARTIAL_SUFFIX = ".partial"
+BUILD_STATE_FILE = "build.json"
+
+
+def current_version(root: Path) -> str | None:
+    """Name of the published version of an index root, or None for an unversioned root."""
+    try:
+        return (Path(root) / CURRENT_FILE).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_index_dir(root: Path) -> Path:
+    """Directory holding the published index of root (root itself when unversioned)."""
+    version = current_version(root)
+    return Path(root) / VERSIONS_DIR / version if version else Path(root)
+
+
+def stage_version(root: Path, plan: dict | None = None, resume: bool = True) -> tuple[str, Path]:
+    """
+    Directory for a new build; returns (version, directory).
+
+    Args:
+        root: Index root.
+        plan: JSON-serializable description of the build (settings and inputs).
+            Recorded in build.json; see load_build_state().
+        resume: Reopen the newest interrupted build with an identical plan
+            instead of creating an empty directory.
+    """
+    versions_dir = Path(root) / VERSIONS_DIR
+    if plan is not None and resume and versions_dir.exists():
+        for path in sorted(versions_dir.glob("*" + PARTIAL_SUFFIX), reverse=True):
+            state = load_build_state(path)
+            if state is not None and state["plan"] == json.loads(json.dumps(plan)):
+                return path.name[:-len(PARTIAL_SUFFIX)], path
+    version = new_build_id()
+    build_dir = versions_dir / (version + PARTIAL_SUFFIX)
+    build_dir.mkdir(parents=True)
+    if plan is not None:
+        save_build_state(build_dir, {"plan": plan, "done": {}})
+    return version, build_dir
+
+
+def link_tree(src: Path, dst: Path) -> None:
+    """
+    Recreate the files of src under dst as hard links (copies where the file
+    system has none). A linked file is shared with src: replace it (see
+    st_app.rag.files) or detach() it before writing to it in place.
+    """
+    for path in sorted(Path(src).rglob("*")):
+        target = Path(dst) / path.relative_to(src)
+        if path.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+        elif not path.name.endswith(TMP_SUFFIX):
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(path, target)
+            except OSError:
+                shutil.copy2(path, target)
+
+
+def detach(path: Path) -> None:
+    """Give a hard-linked file its own copy, so writing to it in place leaves other versions untouched."""
+    replace_file(path, lambda p: shutil.copyfile(path, p))
+
+
+def stage_copy(root: Path) -> tuple[str, Path]:
+    """Stage a new version holding a hard-linked copy of the published one; returns (version, directory)."""
+    current = resolve_index_dir(root)
+    version, build_dir = stage_version(root)
+    link_tree(current, build_dir)
+    return version, build_dir
+
+
+def load_build_state(build_dir: Path) -> dict | None:
+    """Plan and finished steps ("done") of a staged build, or None if it has no build.json."""
+    try:
+        return json.loads((build_dir / BUILD_STATE_FILE).read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_build_state(build_dir: Path, state: dict) -> None:
+    """Atomically replace build.json of a staged build."""
+    replace_text(build_dir / BUILD_STATE_FILE, json.dumps(state, indent=2))
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_entries(version_dir: Path, paths=None) -> dict[str, dict]:
+    paths = paths if paths is not None else sorted(p for p in version_dir.rglob("*") if p.is_file())
+    entries = {}
+    for path in paths:
+        name = path.relative_to(version_dir).as_posix()
+        if name == MANIFEST_FILE or name.endswith(TMP_SUFFIX):
+            continue
+        entries[name] = {"bytes": path.stat().st_size, "sha256": _sha256(path)}
+    return entries
+
+
+def write_manifest(version_dir: Path, version: str, info: dict) -> dict:
+    """
+    Checksum every file of a finished build and write manifest.json.
+
+    Args:
+        version_dir: The build directory.
+        version: Version name.
+        info: Build details to record (embedding model, index settings, per-shard counts).
+    """
+    manifest = {
+        "version": version,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        **info,
+        "files": _file_entries(version_dir),
+    }
+    replace_text(version_dir / MANIFEST_FILE, json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
+
+
+def update_manifest(version_dir: Path, paths: list[Path], version: str | None = None) -> None:
+    """
+    Re-checksum files changed by an update (see st_app.rag.updates); no-op for unversioned indexes.
+
+    Args:
+        version_dir: Directory holding manifest.json.
+        paths: Changed files.
+        version: New version name, for a copy staged with stage_copy().
+    """
+    manifest_path = version_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        return
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if version is not None:
+        manifest["version"] = version
+    manifest["files"].update(_file_entries(version_dir, [p for p in paths if p.exists()]))
+    # Files an update removed (e.g. a converted legacy docstore) leave the manifest
+    manifest["files"] = {name: entry for name, entry in manifest["files"].items() if (version_dir / name).exists()}
+    manifest["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    replace_text(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2))
+
+
+def load_manifest(version_dir: Path) -> dict:
+    return json.loads((version_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+
+
+def verify_version(version_dir: Path) -> list[str]:
+    """Files of a version that are missing or whose checksum differs from the manifest."""
+    manifest = load_manifest(version_dir)
+    problems = []
+    for name, entry in manifest["files"].items():
+        path = version_dir / name
+        if not path.exists():
+            problems.append(f"{name}: missing")
+        elif path.stat().st_size != entry["bytes"] or _sha256(path) != entry["sha256"]:
+            problems.append(f"{name}: checksum mismatch")
+    return problems
+
+
+def _set_current(root: Path, version: str) -> None:
+    # os.replace is atomic: readers see either the old or the new name, never a mix
+    replace_text(Path(root) / CURRENT_FILE, version)
+
+
+def publish_version(root: Path, build_dir: Path, verify: bool = True) -> Path:
+    """
+    Verify a finished build against its manifest, move it into place and point CURRENT at it.
+
+    Args:
+        root: Index root.
+        build_dir: Staged version directory with its manifest written.
+        verify: Checksum every file first. Updates skip it: their unchanged
+            files are links to a verified version and the changed ones were
+            just checksummed.
+
+    Returns:
+        The published version directory.
+    """
+    problems = verify_version(build_dir) if verify else []
+    if problems:
+        raise ValueError(f"Build in {build_dir} does not match its manifest: {'; '.join(problems)}")
+    version = load_manifest(build_dir)["version"]
+    version_dir = Path(root) / VERSIONS_DIR / version
+    os.replace(build_dir, version_dir)
+    _set_current(root, version)
+    return version_dir
+
+
+def list_versions(root: Path) -> list[str]:
+    """Complete versions under root, oldest first."""
+    versions_dir = Path(root) / VERSIONS_DIR
+    if not versions_dir.exists():
+        return []
+    return sorted(
+        p.name for p in versions_dir.iterdir()
+        if p.is_dir() and not p.name.endswith(PARTIAL_SUFFIX) and (p / MANIFEST_FILE).exists()
+    )
+
+
+def rollback(root: Path, version: str | None = None) -> str:
+    """Point CURRENT at version (default: the one published before the current one)."""
+    versions = list_versions(root)
+    current = current_version(root)
+    if version is None:
+        older = [v for v in versions if current is None or v < current]
+        if not older:
+            raise ValueError(f"No version older than {current} in {root}")
+        version = older[-1]
+    elif version not in versions:
+        raise ValueError(f"Unknown version {version!r}; available: {versions}")
+    _set_current(root, version)
+    return version
+
+
+def collect_garbage(root: Path, keep: int = config.INDEX_KEEP_VERSIONS) -> list[str]:
+    """
+    Delete all but the newest `keep` versions (at least 2) and abandoned partial builds.
+    The current version is never deleted. Returns the deleted directory names.
+    """
+    versions_dir = Path(root) / VERSIONS_DIR
+    if not versions_dir.exists():
+        return []
+    current = current_version(root)
+    versions = list_versions(root)
+    kept = set(versions[-max(keep, 2):]) | {current}
+    removed = []
+    for path in sorted(versions_dir.iterdir()):
+        if not path.is_dir() or path.name in kept:
+            continue
+        if path.name not in versions and not path.name.endswith(PARTIAL_SUFFIX):
+            continue
+        try:
+            shutil.rmtree(path)
+        except OSError as e:
+            # e.g. files still mapped by a reader on Windows; retried after the next build
+            print(f"Could not remove {path}: {e}")
+            continue
+        removed.append(path.name)
+    return removed
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="List, roll back and garbage-collect index versions.")
+    parser.add_argument('-t', '--title', type=str, default=config.DEFAULT_TITLE,
+                        help="Title namespace. Default: RAG_DEFAULT_TITLE")
+    parser.add_argument('-o', '--index_dir', type=Path, default=None,
+                        help="Index root. Default: the title's namespace directory")
+    parser.add_argument('--list', action='store_true', help="List versions (default action)")
+    parser.add_argument('--rollback', nargs='?', const='', default=None, metavar='VERSION',
+                        help="Publish VERSION, or the previous version when omitted")
+    parser.add_argument('--gc', action='store_true', help="Delete old versions")
+    parser.add_argument('--keep', type=int, default=config.INDEX_KEEP_VERSIONS,
+                        help="Versions kept by --gc. Default: RAG_INDEX_KEEP_VERSIONS")
+    parser.add_argument('--verify', action='store_true', help="Check the current version against its manifest")
+    return parser
+
+
+if __name__ == "__main__":
+    from st_app.rag.namespaces import title_index_dir
+
+    args = create_parser().parse_args()
+    root = args.index_dir or title_index_dir(args.title)
+    if args.rollback is not None:
+        print(f"CURRENT -> {rollback(root, args.rollback or None)}")
+    if args.gc:
+        print(f"Removed: {collect_garbage(root, args.keep) or 'nothing'}")
+    if args.verify:
+        problems = verify_version(resolve_index_dir(root))
+        print("\n".join(problems) if problems else "OK")
+    current = current_version(root)
+    for version in list_versions(root):
+        manifest = load_manifest(root / VERSIONS_DIR / version)
+        marker = "*" if version == current else " "
+        print(f"{marker} {version}  built {manifest['built_at']}  "
+              f"{manifest.get('vectors', '?')} vectors  {manifest.get('embedding', {}).get('model', '?')}")
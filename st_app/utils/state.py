@@ -6,3 +6,4 @@ class ChatState(TypedDict):
     messages: Annotated[list[dict], operator.add]
     route: str
     retrieved_docs: list[dict]
+    title: str
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from st_app.rag import retriever
+from st_app.rag.cache import ResultCache
+from st_app.rag.embedder import create_vector_db
+from st_app.rag.namespaces import NamespaceRegistry, title_index_dir
+
+WORDS = [
+    "great movie with funny animals and a clever plot",
+    "boring story but the animation looks great",
+    "the sloth scene was funny and the city looks amazing",
+    "clever detective plot with a great rabbit and fox",
+    "animation and music were amazing but the story was boring",
+    "funny fox and clever rabbit solve the case in the city",
+]
+SITE_FILES = {
+    "imdb": ("preprocessed_reviews_imdb.csv", [8, 3, 10, 9, 5, 7]),
+    "letterboxd": ("preprocessed_reviews_letterboxd.csv", [4.0, 1.5, 5.0, 4.5, 2.5, 3.5]),
+    "rottentomatoes": ("preprocessed_reviews_RottenTomatoes.csv", [4.0, 2.0, 5.0, 4.5, 3.0, 3.5]),
+}
+
+
+def write_review_csvs(data_dir: Path, words: list[str] = WORDS) -> Path:
+    """Write one small preprocessed review CSV per site, one row per entry of words."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for site, (name, ratings) in SITE_FILES.items():
+        rows = [
+            {
+                "rating": ratings[i % len(ratings)],
+                "date": f"2024-0{1 + i % 3}-1{i % 10}",
+                "comment": f"{site} review {i}: {text}",
+                "raw_word_count": len(text.split()) + 3,
+                "language": "en",
+                "clean_comment": text,
+                "year_month": f"2024-0{1 + i % 3}",
+                "clean_word_count": len(text.split()),
+                "subjectivity_score": 0.5,
+            }
+            for i, text in enumerate(words)
+        ]
+        pd.DataFrame(rows).to_csv(data_dir / name, index=False)
+    return data_dir
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    return write_review_csvs(tmp_path / "data")
+
+
+@pytest.fixture
+def index_root(data_dir, tmp_path):
+    """A freshly built local index root over data_dir."""
+    root = tmp_path / "faiss_index"
+    create_vector_db(provider="local", index_dir=root, data_dir=data_dir, workers=1)
+    return root
+
+
+@pytest.fixture
+def title(data_dir, tmp_path, monkeypatch):
+    """A title built from data_dir, searched by st_app.rag.retriever through a fresh registry and result cache."""
+    titles_dir = tmp_path / "titles"
+    create_vector_db(provider="local", index_dir=title_index_dir("sample", titles_dir), data_dir=data_dir, workers=1)
+    monkeypatch.setattr(retriever, "_registry", NamespaceRegistry(titles_dir, pinned=()))
+    monkeypatch.setattr(retriever, "_result_cache", ResultCache())
+    return "sample"
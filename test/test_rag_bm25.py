@@ -0,0 +1,81 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from st_app.rag import retriever
+from st_app.rag.bm25 import BM25_FILE, BM25Index, BM25Writer, build_bm25_index, update_bm25_index
+from st_app.rag.retriever import _hybrid_search, retrieve
+
+ROWS = [
+    "funny sloth scene at the dmv",
+    "clever rabbit and fox solve the case",
+    "the music was great",
+]
+# Row 1 was cut into two chunks; chunk 4 has no row
+CHUNK_ROWS = np.array([0, 1, 1, 2, -1])
+
+
+@pytest.fixture
+def bm25(tmp_path):
+    build_bm25_index(tmp_path, ROWS, CHUNK_ROWS)
+    return BM25Index(tmp_path / BM25_FILE)
+
+
+def test_bm25_ranks_rows_and_expands_them_to_chunks(bm25):
+    """Test that matching rows come first and each is returned as its chunks."""
+    rows, scores = bm25.top_rows("sloth", 3)
+    assert rows.tolist() == [0] and scores[0] > 0
+
+    ids, scores = bm25.search("clever rabbits", 5)
+    assert ids.tolist() == [1, 2] and scores[0] == scores[1]
+    assert bm25.score_chunks("music", np.array([3, 4, 0])).tolist()[1:] == [0.0, 0.0]
+
+
+def test_bm25_search_respects_the_allowed_mask(bm25):
+    """Test that rows and chunks outside the allowed vector ids are skipped."""
+    allowed = np.array([True, False, True, True, True])
+    assert bm25.search("fox", 5, allowed)[0].tolist() == [2]
+    assert bm25.search("sloth", 5, ~allowed)[0].tolist() == []
+
+
+def test_writer_batches_match_a_single_build(tmp_path, bm25):
+    """Test that adding rows batch by batch writes the same index as one build."""
+    writer = BM25Writer(tmp_path / "batched")
+    writer.add(ROWS[:1])
+    writer.add(ROWS[1:])
+    writer.close(CHUNK_ROWS)
+    batched = BM25Index(tmp_path / "batched" / BM25_FILE)
+    for query in ("sloth", "the fox", "great music case"):
+        assert np.allclose(batched.score_rows(query), bm25.score_rows(query))
+
+
+def test_update_retires_dead_rows_and_indexes_new_ones(tmp_path, bm25):
+    """Test that an in-place update stops dead rows matching and makes appended rows searchable."""
+    chunk_rows = np.array([-1, 1, 1, 2, -1, 3])
+    update_bm25_index(tmp_path, np.array([0]), ["a sloth named flash"], chunk_rows)
+    updated = BM25Index(tmp_path / BM25_FILE)
+    assert updated.search("sloth", 5)[0].tolist() == [5]
+    assert updated.search("flash", 5)[0].tolist() == [5]
+    assert updated.search("fox", 5)[0].tolist() == [1, 2]
+
+
+def test_hybrid_search_fuses_dense_and_lexical_hits(monkeypatch):
+    """Test that chunks found by either search are candidates and ranked by the fused score."""
+    index = MagicMock()
+    index.__len__.return_value = 4
+    # Dense finds 0, 1 and 3 (0 closest, 1 close behind); BM25 finds 2 and, more strongly, 1
+    index.search.return_value = (np.array([[0.1, 0.15, 0.5, -1.0]]), np.array([[0, 1, 3, -1]]))
+    index.lexical.search.return_value = (np.array([1, 2]), np.array([2.0, 1.0]))
+    index.lexical.score_chunks.side_effect = lambda query, ids: np.array([0.0, 2.0, 1.0, 0.0])[ids]
+    monkeypatch.setattr(retriever, "HYBRID_ALPHA", 0.5)
+
+    ids = _hybrid_search(index, "fox", np.zeros((1, 2), dtype=np.float32), 3)
+    assert ids.tolist() == [1, 0, 2]
+
+
+def test_lexical_and_hybrid_modes_find_the_keyword(title):
+    """Test that a rare keyword's reviews are returned by the lexical and hybrid modes."""
+    for mode in ("lexical", "hybrid"):
+        docs = retrieve("sloth", top_k=3, mode=mode, title=title)
+        assert "sloth" in docs[0].page_content
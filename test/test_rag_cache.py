@@ -0,0 +1,66 @@
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+
+from st_app.rag.cache import CachedQueryEmbeddings, QueryEmbeddingCache, ResultCache
+
+
+def test_query_cache_serves_memory_then_disk(tmp_path):
+    """Test that a put is served from memory, and from SQLite once the memory tier is gone."""
+    path = tmp_path / "queries.sqlite3"
+    cache = QueryEmbeddingCache(path, memory_size=1)
+    assert cache.get("m", "funny sloth") is None
+    cache.put("m", "Funny  Sloth", [0.5, 0.25])
+    assert cache.get("m", "funny sloth") == [0.5, 0.25]
+
+    cache.put("m", "other", [1.0, 0.0])
+    assert cache.get("m", "FUNNY SLOTH") == [0.5, 0.25]
+    assert cache.get("other-model", "funny sloth") is None
+    assert cache.stats() == {
+        "memory_hits": 1, "disk_hits": 1, "misses": 2, "hit_rate": 0.5, "memory_entries": 1,
+    }
+
+    # The SQLite tier survives a restart
+    assert QueryEmbeddingCache(path).get("m", "funny sloth") == [0.5, 0.25]
+
+
+def test_cached_embeddings_send_only_misses_to_the_model(tmp_path):
+    """Test that cached queries skip the model and misses go out in one batched call."""
+    embeddings = MagicMock()
+    embeddings.embed_query.return_value = [1.0, 0.0]
+    embeddings.embed_queries.side_effect = lambda texts: [[float(len(t)), 0.0] for t in texts]
+    cached = CachedQueryEmbeddings(embeddings, "m", QueryEmbeddingCache(tmp_path / "q.sqlite3"))
+
+    assert cached.embed_query("sloth") == [1.0, 0.0]
+    assert cached.embed_query("Sloth ") == [1.0, 0.0]
+    embeddings.embed_query.assert_called_once_with("sloth")
+
+    assert cached.embed_queries(["sloth", "fox", "rabbit"]) == [[1.0, 0.0], [3.0, 0.0], [6.0, 0.0]]
+    embeddings.embed_queries.assert_called_once_with(["fox", "rabbit"])
+
+
+def test_result_cache_is_keyed_by_build_and_normalized_query():
+    """Test that hits need the same build id and options, and ignore case and spacing."""
+    cache = ResultCache(maxsize=4, ttl=60)
+    cache.put("build-1", "Funny  Sloth", ("dense", 3), [Document(page_content="a")])
+
+    assert [d.page_content for d in cache.get("build-1", "funny sloth", ("dense", 3))] == ["a"]
+    assert cache.get("build-2", "funny sloth", ("dense", 3)) is None
+    assert cache.get("build-1", "funny sloth", ("lexical", 3)) is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": 1 / 3, "entries": 1}
+
+
+def test_result_cache_returns_copies():
+    """Test that modifying stored or returned documents leaves the cached result intact."""
+    cache = ResultCache(maxsize=4, ttl=60)
+    docs = [Document(page_content="a", metadata={"tags": ["x"]})]
+    cache.put("build-1", "q", (), docs)
+    docs[0].metadata["tags"].append("stored")
+
+    first = cache.get("build-1", "q", ())
+    first[0].metadata["tags"].append("returned")
+    first[0].page_content = "changed"
+
+    second = cache.get("build-1", "q", ())
+    assert second == [Document(page_content="a", metadata={"tags": ["x"]})]
+    assert second[0] is not first[0]
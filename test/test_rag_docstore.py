@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from st_app.rag.docstore import (
+    DOC_META_FILE,
+    LEGACY_META_FILE,
+    DocStore,
+    DocumentWriter,
+    append_documents,
+    decode_metadata,
+    encode_metadata,
+    metadata_files,
+    write_documents,
+)
+from st_app.rag.files import save_arrays
+
+METADATAS = [
+    {"review_id": "a", "site": "imdb", "row": 0, "rating": 8, "tags": ["x"]},
+    {"review_id": "b", "site": "imdb", "row": 1, "rating": None, "flag": True},
+    {"review_id": "c", "site": "letterboxd", "row": 2, "rating": 4.5, "tags": {"k": 1}},
+]
+
+
+@pytest.fixture
+def documents():
+    """Documents of METADATAS as they read back, with None values left out."""
+    return [
+        Document(page_content=f"review {i} ünïcode", metadata={k: v for k, v in m.items() if v is not None})
+        for i, m in enumerate(METADATAS)
+    ]
+
+
+def test_encode_metadata_round_trip():
+    """Test that typed columns decode back to the same metadata, leaving None out."""
+    columns = encode_metadata(METADATAS)
+    assert columns["row"].dtype == np.int64
+    assert columns["rating"].dtype == np.float64
+    assert columns["site"].dtype == np.int32 and columns["site.values"].tolist() == ["imdb", "letterboxd"]
+    expected = [{k: v for k, v in m.items() if v is not None} for m in METADATAS]
+    assert decode_metadata(columns) == expected
+
+
+def test_writer_batches_widen_column_types(tmp_path):
+    """Test that batches disagreeing on a column's type are stored in the wider type."""
+    batches = [
+        [Document(page_content="a", metadata={"n": 1, "s": "x"}), Document(page_content="b", metadata={"n": None})],
+        [Document(page_content="c", metadata={"n": 2.5, "s": {"j": 1}, "late": "new"})],
+        [Document(page_content="d", metadata={"s": None})],
+    ]
+    writer = DocumentWriter(tmp_path)
+    for batch in batches:
+        writer.add(batch)
+    assert len(writer) == 4
+    offsets = writer.close()
+
+    docs = DocStore(tmp_path, offsets).documents()
+    assert [d.page_content for d in docs] == ["a", "b", "c", "d"]
+    assert [d.metadata for d in docs] == [
+        {"n": 1.0, "s": "x"}, {}, {"n": 2.5, "s": {"j": 1}, "late": "new"}, {},
+    ]
+    assert isinstance(docs[0].metadata["n"], float)
+
+
+def test_docstore_memory_maps_columns(tmp_path, documents):
+    """Test that opening a store maps the column files instead of decoding them."""
+    offsets = write_documents(tmp_path, documents)
+    store = DocStore(tmp_path, offsets)
+    assert all(isinstance(column.data, np.memmap) for column in store._columns)
+    assert store.get(2) == documents[2]
+
+
+def test_append_documents_appends_columns_in_place(tmp_path, documents):
+    """Test that an append writes after the existing values without rewriting the columns."""
+    offsets = write_documents(tmp_path, documents[:2])
+    inodes = {path.name: os.stat(path).st_ino for path in metadata_files(tmp_path)}
+
+    offsets = append_documents(tmp_path, offsets, documents[2:])
+    assert DocStore(tmp_path, offsets).documents() == documents
+    # Codes and values only grew; "rating" (int -> float) was rewritten, and so was the
+    # site table, whose strings got longer
+    for name in ("docs.meta.review_id.npy", "docs.meta.review_id.values.npy", "docs.meta.site.npy", "docs.meta.row.npy"):
+        assert os.stat(tmp_path / name).st_ino == inodes[name]
+    assert os.stat(tmp_path / "docs.meta.rating.npy").st_ino != inodes["docs.meta.rating.npy"]
+    assert np.load(tmp_path / "docs.meta.site.values.npy").tolist() == ["imdb", "letterboxd"]
+
+    # Bytes past the offsets of an interrupted append are overwritten
+    more = [Document(page_content="late", metadata={"review_id": "d", "row": 3})]
+    append_documents(tmp_path, offsets, more[:1])
+    offsets = append_documents(tmp_path, offsets, more)
+    assert [d.metadata["row"] for d in DocStore(tmp_path, offsets).documents()] == [0, 1, 2, 3]
+
+
+def test_append_converts_legacy_metadata_archive(tmp_path, documents):
+    """Test that a store with docs.meta.npz is still read and converted by an append."""
+    offsets = write_documents(tmp_path, documents[:2])
+    for path in metadata_files(tmp_path):
+        path.unlink()
+    save_arrays(tmp_path / LEGACY_META_FILE, compressed=True, **encode_metadata(METADATAS[:2]))
+    assert DocStore(tmp_path, offsets).documents() == documents[:2]
+
+    offsets = append_documents(tmp_path, offsets, documents[2:])
+    assert (tmp_path / DOC_META_FILE).exists() and not (tmp_path / LEGACY_META_FILE).exists()
+    assert DocStore(tmp_path, offsets).documents() == documents
@@ -0,0 +1,128 @@
+import time
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from st_app.rag.cache import EmbeddingStore
+from st_app.rag.embed_jobs import EmbeddingJobRunner, TokenBucket, embed_texts
+from st_app.rag.embeddings import LazyEmbeddings
+
+
+def _vectors(texts: list[str]) -> list[list[float]]:
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+@pytest.fixture
+def embeddings():
+    mock = MagicMock()
+    mock.embed_documents.side_effect = _vectors
+    return mock
+
+
+def test_runner_keeps_input_order_across_batches(embeddings):
+    """Test that concurrent batches are reassembled in input order."""
+    texts = ["a" * i for i in range(1, 8)]
+    vectors = EmbeddingJobRunner(embeddings, batch_size=2, max_workers=3).run(texts)
+    assert vectors.dtype == np.float32
+    assert vectors[:, 0].tolist() == list(range(1, 8))
+    assert embeddings.embed_documents.call_count == 4
+
+
+def test_runner_retries_transient_errors(embeddings):
+    """Test that rate limits and dropped connections are retried with backoff."""
+    embeddings.embed_documents.side_effect = [ConnectionError("reset"), TimeoutError(), _vectors(["ab"])]
+    runner = EmbeddingJobRunner(embeddings, max_retries=2, backoff=0.001)
+    assert runner.run(["ab"]).tolist() == [[2.0, 1.0]]
+    assert embeddings.embed_documents.call_count == 3
+
+
+def test_runner_gives_up_after_max_retries(embeddings):
+    """Test that a batch still failing after max_retries fails the job."""
+    embeddings.embed_documents.side_effect = ConnectionError("down")
+    with pytest.raises(ConnectionError):
+        EmbeddingJobRunner(embeddings, max_retries=2, backoff=0.001).run(["ab"])
+    assert embeddings.embed_documents.call_count == 3
+
+
+def test_runner_does_not_retry_other_errors(embeddings):
+    """Test that errors a retry cannot fix (bad input, bugs) fail at once."""
+    embeddings.embed_documents.side_effect = ValueError("input too long")
+    with pytest.raises(ValueError, match="input too long"):
+        EmbeddingJobRunner(embeddings, max_retries=5, backoff=0.001).run(["ab"])
+    assert embeddings.embed_documents.call_count == 1
+
+
+def test_token_bucket_limits_rate_after_burst():
+    """Test that acquisitions beyond the burst capacity wait for the refill rate."""
+    bucket = TokenBucket(rate=100, capacity=2)
+    started = time.monotonic()
+    for _ in range(7):
+        bucket.acquire()
+    assert time.monotonic() - started >= 0.045
+
+
+def test_rate_limit_spans_embed_texts_calls(embeddings):
+    """Test that one runner shares its token bucket across calls instead of refilling per call."""
+    runner = EmbeddingJobRunner(embeddings, batch_size=1, requests_per_second=100)
+    runner.bucket.capacity = runner.bucket._tokens = 2
+    started = time.monotonic()
+    for _ in range(3):
+        embed_texts(runner, ["a", "b"])
+    assert time.monotonic() - started >= 0.035
+
+
+def test_embedding_store_embeds_only_new_texts(tmp_path, embeddings):
+    """Test that stored texts are read back and only new ones are embedded and appended."""
+    store = EmbeddingStore(tmp_path)
+    runner = EmbeddingJobRunner(embeddings)
+    assert embed_texts(runner, ["ab", "abc"], store, "m")[:, 0].tolist() == [2.0, 3.0]
+
+    vectors = embed_texts(runner, ["abc", "abcd", "abcd", "ab"], store, "m")
+    assert vectors[:, 0].tolist() == [3.0, 4.0, 4.0, 2.0]
+    assert embeddings.embed_documents.call_args_list[-1].args == (["abcd", "abcd"],)
+    assert store.lookup("m", ["abcd", "ab", "abc"]).tolist() == [2, 0, 1]
+    assert (store.hits, store.misses) == (5, 4)
+
+    # A fresh process sees the same rows; another model shares none of them
+    reopened = EmbeddingStore(tmp_path)
+    assert reopened.lookup("m", ["ab", "abcd"]).tolist() == [0, 2]
+    assert reopened.lookup("other", ["ab"]).tolist() == [-1]
+
+
+def test_embedding_store_append_returns_rows(tmp_path):
+    """Test that append returns the row of every text, including stored and repeated ones."""
+    store = EmbeddingStore(tmp_path)
+    assert store.append("m", ["a", "b"], np.ones((2, 3))).tolist() == [0, 1]
+    rows = store.append("m", ["b", "c", "c"], np.arange(9).reshape(3, 3))
+    assert rows.tolist() == [1, 2, 2]
+    assert store.vectors("m", rows)[1].tolist() == [3.0, 4.0, 5.0]
+    with pytest.raises(ValueError, match="3-d vectors"):
+        store.append("m", ["d"], np.ones((1, 2)))
+
+
+def test_embedding_store_overwrites_bytes_of_an_interrupted_append(tmp_path):
+    """Test that vector bytes written without their keys are overwritten by the next append."""
+    store = EmbeddingStore(tmp_path)
+    store.append("m", ["a"], np.ones((1, 2)))
+    _, vectors_path = store._paths("m")
+    with open(vectors_path, "ab") as f:
+        f.write(np.full(2, 7.0, dtype=np.float32).tobytes())
+
+    reopened = EmbeddingStore(tmp_path)
+    assert reopened.append("m", ["b"], np.full((1, 2), 2.0)).tolist() == [1]
+    assert reopened.vectors("m", np.array([0, 1])).tolist() == [[1.0, 1.0], [2.0, 2.0]]
+
+
+def test_lazy_embeddings_are_created_only_for_misses(tmp_path, embeddings):
+    """Test that a build served fully from the store never creates the embeddings client."""
+    store = EmbeddingStore(tmp_path)
+    store.append("m", ["ab"], [[2.0, 1.0]])
+    create = MagicMock(return_value=embeddings)
+    runner = EmbeddingJobRunner(LazyEmbeddings(create))
+
+    assert embed_texts(runner, ["ab"], store, "m").tolist() == [[2.0, 1.0]]
+    create.assert_not_called()
+    embed_texts(runner, ["ab", "abc"], store, "m")
+    embed_texts(runner, ["abcd"], store, "m")
+    create.assert_called_once()
@@ -0,0 +1,126 @@
+from unittest.mock import patch
+
+import faiss
+import numpy as np
+import pandas as pd
+import pytest
+
+from st_app.rag import config
+from st_app.rag.embed_jobs import EmbeddingJobRunner
+from st_app.rag.embedder import create_vector_db
+from st_app.rag.index_store import VERSION_FILE
+from st_app.rag.shards import ShardedIndex, shard_dirs
+from st_app.rag.versions import current_version, list_versions, resolve_index_dir
+
+from .conftest import SITE_FILES
+
+
+def _build_ids(root) -> dict[str, str]:
+    return {site: (path / VERSION_FILE).read_text() for site, path in shard_dirs(resolve_index_dir(root)).items()}
+
+
+def _embedded_texts(build, fail_at: int | None = None) -> list[str]:
+    """
+    Run build() and return every text it sent to an EmbeddingJobRunner;
+    with fail_at, the runner's fail_at-th call (0-based) raises instead.
+    """
+    texts = []
+    run = EmbeddingJobRunner.run
+
+    def record(runner, batch):
+        if fail_at is not None and record.calls == fail_at:
+            raise RuntimeError("interrupted")
+        record.calls += 1
+        texts.extend(batch)
+        return run(runner, batch)
+
+    record.calls = 0
+
+    with patch.object(EmbeddingJobRunner, "run", autospec=True, side_effect=record):
+        build()
+    return texts
+
+
+def test_noop_incremental_rebuild_keeps_build_ids(index_root, data_dir):
+    """Test that rebuilding unchanged data embeds nothing and keeps every shard's build id."""
+    before = _build_ids(index_root)
+    texts = _embedded_texts(lambda: create_vector_db(provider="local", index_dir=index_root, data_dir=data_dir, workers=1))
+    assert texts == []
+    assert len(list_versions(index_root)) == 2
+    assert _build_ids(index_root) == before
+
+
+def test_incremental_rebuild_embeds_only_changed_reviews(index_root, data_dir):
+    """Test that editing one review re-embeds just that review and rebuilds just its shard."""
+    before = _build_ids(index_root)
+    path = data_dir / SITE_FILES["letterboxd"][0]
+    rows = pd.read_csv(path)
+    rows.loc[2, "comment"] = "letterboxd review 2: the sloth scene is even funnier the second time"
+    rows.to_csv(path, index=False)
+
+    texts = _embedded_texts(lambda: create_vector_db(provider="local", index_dir=index_root, data_dir=data_dir, workers=1))
+    assert texts == [rows.loc[2, "comment"]]
+    after = _build_ids(index_root)
+    assert {site for site in after if after[site] != before[site]} == {"letterboxd"}
+
+
+def _contents(root) -> list[tuple]:
+    """Every chunk of the current version of root: (site, text, vector)."""
+    index = ShardedIndex(resolve_index_dir(root))
+    ids = np.arange(len(index))
+    ids = ids[index.review_keys(ids) >= 0]
+    vectors = index.reconstruct(ids)
+    return [(doc.metadata["site"], doc.page_content, vector.round(5).tolist())
+            for doc, vector in zip(index.get_documents(ids), vectors)]
+
+
+def test_interrupted_build_resumes_at_its_checkpoint(index_root, data_dir, tmp_path, monkeypatch):
+    """Test that a rerun skips finished shards, resumes the interrupted one after its cursor and ends up identical."""
+    monkeypatch.setattr(config, "BUILD_BATCH_ROWS", 2)
+    root = tmp_path / "resumed"
+
+    def build():
+        create_vector_db(provider="local", index_dir=root, data_dir=data_dir, workers=1)
+
+    # Three batches per site: the first site and one batch of the second are done
+    with pytest.raises(RuntimeError, match="interrupted"):
+        _embedded_texts(build, fail_at=4)
+    assert not (root / "CURRENT").exists()
+
+    texts = _embedded_texts(build)
+    second, third = list(SITE_FILES)[1:]
+    assert len(texts) == 4 + len(pd.read_csv(data_dir / SITE_FILES[third][0]))
+    assert all(text.startswith(f"{second} review") for text in texts[:4])
+    assert len(list_versions(root)) == 1 and current_version(root)
+    assert _contents(root) == _contents(index_root)
+
+
+def test_restart_ignores_the_checkpoint(data_dir, tmp_path, monkeypatch):
+    """Test that resume=False embeds everything again."""
+    monkeypatch.setattr(config, "BUILD_BATCH_ROWS", 2)
+    root = tmp_path / "restarted"
+    with pytest.raises(RuntimeError):
+        _embedded_texts(lambda: create_vector_db(provider="local", index_dir=root, data_dir=data_dir, workers=1),
+                        fail_at=4)
+    texts = _embedded_texts(
+        lambda: create_vector_db(provider="local", index_dir=root, data_dir=data_dir, workers=1, resume=False)
+    )
+    assert len(texts) == 3 * len(pd.read_csv(data_dir / SITE_FILES["imdb"][0]))
+
+
+def test_parallel_build_matches_serial(index_root, data_dir, tmp_path, monkeypatch):
+    """Test that a build with a worker pool writes the same shards and restores the FAISS thread count."""
+    monkeypatch.setattr(config, "BUILD_BATCH_ROWS", 2)
+    threads = faiss.omp_get_max_threads()
+    root = tmp_path / "parallel"
+    faiss.omp_set_num_threads(3)
+    try:
+        create_vector_db(provider="local", index_dir=root, data_dir=data_dir, workers=2)
+        assert faiss.omp_get_max_threads() == 3
+    finally:
+        faiss.omp_set_num_threads(threads)
+
+    assert _contents(root) == _contents(index_root)
+    for site, shard_dir in shard_dirs(resolve_index_dir(root)).items():
+        serial_dir = resolve_index_dir(index_root) / site
+        assert (shard_dir / "index.faiss").read_bytes() == (serial_dir / "index.faiss").read_bytes()
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from st_app.rag.embeddings import UpstageQueryBatchEmbeddings
+
+
+def _response(input: list[str], model: str) -> SimpleNamespace:
+    return SimpleNamespace(data=[SimpleNamespace(embedding=[float(len(text)), 0.0]) for text in input])
+
+
+@pytest.fixture
+def client():
+    mock = MagicMock()
+    mock.create.side_effect = _response
+    return mock
+
+
+@pytest.mark.parametrize("model", ["embedding", "embedding-passage", "embedding-query"])
+def test_embed_queries_uses_the_query_model(client, model):
+    """Test that queries are sent to "<model>-query" whatever suffix the configured model has."""
+    embeddings = UpstageQueryBatchEmbeddings(model=model, api_key="test", client=client)
+    assert embeddings.embed_queries(["a", "abc"]) == [[1.0, 0.0], [3.0, 0.0]]
+    client.create.assert_called_once_with(input=["a", "abc"], model="embedding-query")
+
+
+def test_embed_queries_splits_requests_at_the_batch_limit(client, monkeypatch):
+    """Test that queries beyond MAX_EMBED_BATCH_SIZE go out in several requests, in order."""
+    monkeypatch.setattr("st_app.rag.embeddings.MAX_EMBED_BATCH_SIZE", 2)
+    embeddings = UpstageQueryBatchEmbeddings(model="embedding", api_key="test", client=client)
+    texts = ["a" * i for i in range(1, 6)]
+    assert [v[0] for v in embeddings.embed_queries(texts)] == [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert [call.kwargs["input"] for call in client.create.call_args_list] == [texts[:2], texts[2:4], texts[4:]]
@@ -0,0 +1,29 @@
+import pytest
+
+from st_app.rag.filters import FILTERS_FILE, FilterIndex, ReviewFilter
+from st_app.rag.reviews import ReviewStore
+from st_app.rag.versions import resolve_index_dir
+
+
+def test_review_filter_bitmaps(index_root):
+    """Test that filter bitmaps select exactly the vectors whose review matches."""
+    shard = resolve_index_dir(index_root) / "letterboxd"
+    filters = FilterIndex(shard / FILTERS_FILE)
+    store = ReviewStore(shard)
+    records = [store.record(int(p)) for p in store.chunk_reviews]
+
+    assert filters.mask(ReviewFilter(sites=["letterboxd"])).all()
+    assert not filters.mask(ReviewFilter(sites=("imdb",))).any()
+    month = filters.mask(ReviewFilter(year_month="2024-02"))
+    assert month.tolist() == [r["date"].startswith("2024-02") for r in records]
+    rated = filters.mask(ReviewFilter(min_rating=8))
+    assert rated.tolist() == [r["rating_value"] * 2 >= 8 for r in records]
+
+
+def test_review_filter_sites_is_hashable():
+    """Test that sites given as a list are stored as a tuple."""
+    review_filter = ReviewFilter(sites=["imdb"])
+    assert review_filter.sites == ("imdb",)
+    assert hash(review_filter) == hash(ReviewFilter(sites=("imdb",)))
+    with pytest.raises(ValueError, match="Unknown site"):
+        ReviewFilter(sites=["netflix"])
@@ -0,0 +1,17 @@
+import faiss
+import numpy as np
+import pytest
+
+from st_app.rag.index_store import _read_index_mmap, build_faiss_index
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_read_index_mmap_opens_every_index_type(tmp_path, index_type):
+    """Test that flat, IVF and HNSW indexes all open memory-mapped with the same results."""
+    vectors = np.random.default_rng(0).standard_normal((2000, 16)).astype(np.float32)
+    index = build_faiss_index(vectors, index_type, nlist=8)
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+
+    mapped = _read_index_mmap(tmp_path / "index.faiss")
+    assert mapped.ntotal == len(vectors)
+    assert np.array_equal(mapped.search(vectors[:5], 3)[1], index.search(vectors[:5], 3)[1])
@@ -0,0 +1,32 @@
+import numpy as np
+
+from st_app.rag.retriever import _mmr_select, retrieve
+
+# Two near-duplicates of the query direction and one distinct, still relevant vector
+CANDIDATES = np.array([[1.0, 0.0, 0.0], [0.99, 0.05, 0.0], [0.7, 0.0, 0.7]], dtype=np.float32)
+QUERY = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+
+def test_mmr_prefers_a_diverse_second_pick():
+    """Test that the near-duplicate of the first pick is passed over for a distinct candidate."""
+    assert _mmr_select(QUERY, CANDIDATES, 2, 0.3).tolist() == [0, 2]
+    assert _mmr_select(QUERY, CANDIDATES, 3, 0.3).tolist() == [0, 2, 1]
+
+
+def test_mmr_with_lambda_one_is_relevance_order():
+    """Test that lambda_mult=1 ranks by query similarity alone."""
+    assert _mmr_select(QUERY, CANDIDATES, 3, 1.0).tolist() == [0, 1, 2]
+
+
+def test_mmr_handles_small_inputs():
+    """Test that k larger than the candidates, a single candidate and k=0 are handled."""
+    assert _mmr_select(QUERY, CANDIDATES, 5, 0.3).tolist() == [0, 2, 1]
+    assert _mmr_select(QUERY, CANDIDATES[:1], 3, 0.3).tolist() == [0]
+    assert _mmr_select(QUERY, CANDIDATES, 0, 0.3).tolist() == []
+
+
+def test_retrieve_with_mmr_returns_distinct_reviews(title):
+    """Test that MMR retrieval returns top_k distinct reviews drawn from the over-fetched candidates."""
+    docs = retrieve("clever rabbit and fox", top_k=3, mmr=True, title=title)
+    review_ids = [doc.metadata["review_id"] for doc in docs]
+    assert len(review_ids) == len(set(review_ids)) == 3
@@ -0,0 +1,97 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from st_app.rag import namespaces
+from st_app.rag.namespaces import IndexHandle
+
+
+@pytest.fixture
+def signature():
+    """Patch the on-disk signature of every index; set .value to simulate a rebuild."""
+    current = MagicMock(value=("v1",))
+    with patch.object(namespaces, "index_signature", side_effect=lambda _: current.value):
+        yield current
+
+
+def test_failed_open_keeps_previous_index_and_is_not_retried(tmp_path, signature, capsys):
+    """Test that a version failing to open is reported once and not reopened on every call."""
+    first = MagicMock()
+    with patch.object(namespaces, "open_index", side_effect=[first, OSError("torn write")]) as open_index:
+        handle = IndexHandle(tmp_path)
+        assert handle.get() is first
+
+        signature.value = ("v2",)
+        assert handle.get() is first
+        assert handle.get() is first
+        assert open_index.call_count == 2
+    assert capsys.readouterr().out.count("could not open the index") == 1
+
+
+def test_failed_open_is_retried_after_backoff_and_for_new_versions(tmp_path, signature, monkeypatch):
+    """Test that the failed version is retried after REOPEN_BACKOFF and a newer one right away."""
+    first, second, third = MagicMock(), MagicMock(), MagicMock()
+    with patch.object(namespaces, "open_index", side_effect=[first, OSError(), second, third]) as open_index:
+        handle = IndexHandle(tmp_path)
+        handle.get()
+        signature.value = ("v2",)
+        assert handle.get() is first
+
+        monkeypatch.setattr(namespaces, "REOPEN_BACKOFF", 0.0)
+        assert handle.get() is second
+
+        signature.value = ("v3",)
+        assert handle.get() is third
+        assert open_index.call_count == 4
+
+
+def test_first_open_failure_raises(tmp_path, signature):
+    """Test that with no previous index the failure propagates."""
+    with patch.object(namespaces, "open_index", side_effect=OSError("missing shard")):
+        with pytest.raises(OSError, match="missing shard"):
+            IndexHandle(tmp_path).get()
+
+
+@pytest.fixture
+def registry(tmp_path):
+    """A registry over three title directories of 100 bytes each, opened as stand-in indexes."""
+    for title in ("cars", "frozen", "moana"):
+        index_dir = tmp_path / title / "faiss_index"
+        index_dir.mkdir(parents=True)
+        (index_dir / "index.faiss").write_bytes(b"x" * 100)
+    with patch.object(namespaces, "open_index", side_effect=lambda *args, **kwargs: MagicMock()):
+        yield namespaces.NamespaceRegistry(tmp_path, max_bytes=250, max_resident=8, pinned=())
+
+
+def test_registry_evicts_least_recently_used(registry):
+    """Test that the least recently used title is closed once the byte budget is exceeded."""
+    cars = registry.get("cars")
+    registry.get("frozen")
+    assert registry.get("cars") is cars
+    registry.get("moana")
+
+    stats = registry.stats()
+    assert stats["resident"] == ["cars", "moana"]
+    assert stats["resident_bytes"] == 200
+    assert (stats["hits"], stats["loads"], stats["evictions"]) == (1, 3, 1)
+    assert stats["hit_rate"] == 0.25
+
+
+def test_registry_never_evicts_pinned_titles(registry):
+    """Test that pinned titles stay resident and the next least recently used one goes instead."""
+    registry.pinned = {"cars"}
+    registry.max_resident = 2
+    registry.get("cars")
+    registry.get("frozen")
+    registry.get("moana")
+    assert registry.stats()["resident"] == ["cars", "moana"]
+
+    assert registry.evict("cars") and not registry.evict("cars")
+    assert registry.stats()["resident"] == ["moana"]
+
+
+def test_registry_drops_titles_that_fail_to_open(registry):
+    """Test that a title whose index is missing is not kept resident."""
+    with pytest.raises(FileNotFoundError):
+        registry.get("missing")
+    assert registry.stats()["resident"] == []
@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+from langchain_core.documents import Document
+
+from st_app.rag.embedder import create_vector_db
+from st_app.rag.index_store import REPORT_FILE, build_faiss_index, recall_report, write_review_index
+from st_app.rag.shards import shard_dirs
+from st_app.rag.versions import resolve_index_dir
+
+
+def test_build_skips_recall_report_by_default(index_root):
+    """Test that a default build writes no recall report."""
+    shards = shard_dirs(resolve_index_dir(index_root))
+    assert shards and not any((path / REPORT_FILE).exists() for path in shards.values())
+
+
+def test_build_writes_recall_report_when_asked(data_dir, tmp_path):
+    """Test that report=True measures every rebuilt shard."""
+    root = tmp_path / "faiss_index"
+    create_vector_db(provider="local", index_dir=root, data_dir=data_dir, workers=1, report=True)
+    for path in shard_dirs(resolve_index_dir(root)).values():
+        report = json.loads((path / REPORT_FILE).read_text())
+        assert report["index"]["recall"] == 1.0
+
+
+def test_recall_report_skips_pq_on_small_samples(tmp_path):
+    """Test that PQ is left out of the codec sweep below 39 points per centroid."""
+    vectors = np.random.default_rng(0).standard_normal((500, 16)).astype(np.float32)
+    index = build_faiss_index(vectors, "flat")
+    write_review_index(tmp_path, index, [Document(page_content=str(i)) for i in range(len(vectors))])
+
+    report = recall_report(tmp_path, vectors, pq_m=4, pq_nbits=4)
+    assert "pq" not in [row["codec"] for row in report["codecs"]]
+    assert report["codecs"][0] == {"codec": "float32", "pca_dim": 16, "recall": 1.0, "bytes_per_vector": 64}
+
+    report = recall_report(tmp_path, vectors, pq_m=4, pq_nbits=3)
+    assert "pq" in [row["codec"] for row in report["codecs"]]
@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from st_app.rag import retriever
+from st_app.rag.retriever import _rerank
+
+
+@pytest.fixture
+def candidate_index():
+    """
+    Four candidate reviews in first-stage order. Reviews 0 and 3 are near ties on
+    dense distance; only review 3 mentions the query term, and it is the longest and most recent.
+    """
+    vectors = np.array([[1.0, 0.0], [0.99, 0.1], [0.98, 0.15], [0.999, 0.01]], dtype=np.float32)
+    index = MagicMock()
+    index.reconstruct.side_effect = lambda ids: vectors[ids]
+    index.lexical.score_chunks.side_effect = lambda query, ids: np.array([0.0, 0.0, 0.2, 3.1])[ids]
+    index.review_features.side_effect = lambda ids: {
+        "word_count": np.array([12.0, 8.0, 30.0, 140.0])[ids],
+        "subjectivity": np.array([2.1, np.nan, 2.7, 3.4])[ids],
+        "days": np.array([19000.0, 19100.0, np.nan, 19700.0])[ids],
+    }
+    return index
+
+
+def test_rerank_off_by_default():
+    """Test that re-ranking is opt-in."""
+    assert retriever.RERANK is False
+
+
+def test_rerank_promotes_the_matching_review(candidate_index):
+    """Test that the review matching the query term moves from last to first."""
+    query_vector = np.array([[1.0, 0.0]], dtype=np.float32)
+    first_stage = np.array([0, 1, 2, 3])
+
+    reranked = _rerank(candidate_index, "sloth", query_vector, first_stage, 2)
+    assert reranked.tolist() == [3, 0]
+    candidate_index.lexical.score_chunks.assert_called_once()
+
+
+def test_rerank_without_query_vector_uses_local_features(candidate_index):
+    """Test that lexical-only queries are re-ranked without the dense feature."""
+    reranked = _rerank(candidate_index, "sloth", None, np.array([0, 1, 2, 3]), 4)
+    assert reranked[0] == 3
+    candidate_index.reconstruct.assert_not_called()
+
+
+def test_rerank_keeps_single_candidate(candidate_index):
+    """Test that one candidate is returned without computing features."""
+    assert _rerank(candidate_index, "sloth", None, np.array([2]), 3).tolist() == [2]
+    candidate_index.review_features.assert_not_called()
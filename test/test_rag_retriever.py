@@ -0,0 +1,74 @@
+import asyncio
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+import pytest
+
+from st_app.graph.nodes import rag_review_node
+from st_app.rag.cache import CachedQueryEmbeddings
+from st_app.rag.filters import ReviewFilter
+from st_app.rag.retriever import _query_embeddings, aretrieve, get_index, retrieve, retrieve_many
+
+
+def _review_ids(docs) -> list[str]:
+    return [doc.metadata["review_id"] for doc in docs]
+
+
+@pytest.mark.parametrize("mode", ["dense", "lexical", "hybrid"])
+def test_aretrieve_matches_retrieve(title, mode):
+    """Test that the async path returns the same reviews as the blocking one."""
+    query = "clever rabbit and fox"
+    docs = asyncio.run(aretrieve(query, top_k=3, mode=mode, title=title))
+    assert len(docs) == 3
+    assert _review_ids(docs) == _review_ids(retrieve(query, top_k=3, mode=mode, title=title))
+
+
+def test_cached_aembed_query_keeps_cache_io_off_the_event_loop():
+    """Test that the blocking query cache is only called from worker threads."""
+    loop_thread = threading.get_ident()
+    threads = []
+    cache = MagicMock()
+    cache.get.side_effect = lambda model, text: threads.append(threading.get_ident())
+    cache.put.side_effect = lambda model, text, vector: threads.append(threading.get_ident())
+    embeddings = MagicMock()
+    embeddings.aembed_query = AsyncMock(return_value=[0.5, 0.5])
+
+    vector = asyncio.run(CachedQueryEmbeddings(embeddings, "model", cache).aembed_query("q"))
+    assert vector == [0.5, 0.5]
+    cache.put.assert_called_once_with("model", "q", [0.5, 0.5])
+    assert len(threads) == 2 and loop_thread not in threads
+
+
+def test_arag_review_node_answers_from_retrieved_reviews(title):
+    """Test that the async review node retrieves from the state's title and grounds the answer."""
+    state = {"messages": [{"role": "user", "content": "funny sloth scene"}], "title": title}
+    with patch.object(rag_review_node, "agenerate_text", AsyncMock(return_value=" Funny. ")) as generate:
+        result = asyncio.run(rag_review_node.arag_review_node(state))
+
+    assert result["messages"] == [{"role": "assistant", "content": "Funny."}]
+    assert len(result["retrieved_docs"]) == 3
+    prompt = generate.call_args.kwargs["user_prompt"]
+    assert all(doc["content"] in prompt for doc in result["retrieved_docs"])
+
+
+def test_retrieve_many_matches_single_query_searches(title):
+    """Test that each row of a batched search equals searching its query alone."""
+    queries = ["clever rabbit and fox", "boring story", "funny sloth scene"]
+    batch = retrieve_many(queries, top_k=4, title=title)
+    assert batch.ids.shape == batch.scores.shape == (3, 4)
+
+    index = get_index(title)
+    embeddings = _query_embeddings(index)
+    for i, query in enumerate(queries):
+        scores, ids = index.search(np.asarray([embeddings.embed_query(query)], dtype=np.float32), 4, None)
+        assert batch.ids[i].tolist() == ids[0].tolist()
+        assert np.allclose(batch.scores[i], scores[0])
+    assert [len(docs) for docs in batch.to_documents()] == [4, 4, 4]
+
+
+def test_retrieve_many_applies_filters_and_accepts_no_queries(title):
+    """Test that the shared filter restricts every row and an empty batch has top_k columns."""
+    batch = retrieve_many(["clever rabbit", "boring story"], top_k=3, filters=ReviewFilter(sites=["imdb"]), title=title)
+    assert all(doc.metadata["site"] == "imdb" for docs in batch.to_documents() for doc in docs)
+    assert retrieve_many([], top_k=3, title=title).ids.shape == (0, 3)
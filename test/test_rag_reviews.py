@@ -0,0 +1,58 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from st_app.rag import retriever
+from st_app.rag.cache import ResultCache
+from st_app.rag.embedder import create_vector_db
+from st_app.rag.retriever import _unique_reviews, retrieve
+from st_app.rag.shards import open_index
+from st_app.rag.versions import resolve_index_dir
+
+from .conftest import WORDS, write_review_csvs
+
+LONG_REVIEW = "the sloth scene was funny and slow " * 100
+
+
+@pytest.fixture
+def chunked_index():
+    """Twelve chunks ranked by id; chunks 0-3 belong to review 0, 4-5 to review 1, the rest have no review."""
+    keys = np.array([0, 0, 0, 0, 1, 1, -7, -8, -9, -10, -11, -12])
+    index = MagicMock()
+    index.__len__.return_value = len(keys)
+    index.review_keys.side_effect = lambda ids: keys[ids]
+    return index
+
+
+def test_unique_reviews_keeps_the_best_chunk_of_each_review(chunked_index, monkeypatch):
+    """Test that hits collapse to the first-ranked chunk of every parent review."""
+    monkeypatch.setattr(retriever, "REVIEW_FETCH_FACTOR", 4)
+    search = MagicMock(side_effect=lambda fetch_k: np.array([5, 0, 4, 1, 6, 2, 7, 3])[:fetch_k])
+    assert _unique_reviews(chunked_index, search, 3).tolist() == [5, 0, 6]
+    search.assert_called_once_with(12)
+
+
+def test_unique_reviews_fetches_more_until_k_reviews(chunked_index, monkeypatch):
+    """Test that the search is repeated with a doubled fetch size while too few reviews were found."""
+    monkeypatch.setattr(retriever, "REVIEW_FETCH_FACTOR", 1)
+    search = MagicMock(side_effect=lambda fetch_k: np.arange(fetch_k))
+    assert _unique_reviews(chunked_index, search, 3).tolist() == [0, 4, 6]
+    assert [c.args[0] for c in search.call_args_list] == [3, 6, 12]
+
+
+def test_retrieve_returns_whole_distinct_reviews(tmp_path, monkeypatch):
+    """Test that a review split into several chunks is returned once, with its whole comment."""
+    data_dir = write_review_csvs(tmp_path / "data", [LONG_REVIEW, *WORDS])
+    root = tmp_path / "faiss_index"
+    create_vector_db(provider="local", index_dir=root, data_dir=data_dir, workers=1)
+    index = open_index(resolve_index_dir(root))
+    monkeypatch.setattr(retriever, "get_index", lambda title=None: index)
+    monkeypatch.setattr(retriever, "_result_cache", ResultCache())
+    keys = index.review_keys(np.arange(len(index)))
+    assert len(np.unique(keys)) < len(keys)
+    for mode in ("dense", "lexical", "hybrid"):
+        docs = retrieve("funny sloth scene", top_k=4, mode=mode, rerank=False)
+        review_ids = [doc.metadata["review_id"] for doc in docs]
+        assert len(review_ids) == len(set(review_ids)) == 4
+        assert any(LONG_REVIEW.strip() in doc.page_content for doc in docs)
@@ -0,0 +1,61 @@
+import numpy as np
+
+from st_app.rag.filters import ReviewFilter
+from st_app.rag.shards import ShardedIndex, _merge_top_k
+from st_app.rag.updates import delete_reviews
+from st_app.rag.versions import resolve_index_dir
+
+
+def test_merge_top_k_orders_across_shards():
+    """Test that per-shard results are merged in score order."""
+    rows = [
+        (np.array([0.1, 0.4, 0.9], dtype=np.float32), np.array([0, 1, 2])),
+        (np.array([0.2, 0.3], dtype=np.float32), np.array([10, 11])),
+    ]
+    scores, ids = _merge_top_k(rows, 4)
+    assert ids.tolist() == [0, 10, 11, 1]
+    assert np.allclose(scores, [0.1, 0.2, 0.3, 0.4])
+
+    rows = [
+        (np.array([0.9, 0.5], dtype=np.float32), np.array([0, 1])),
+        (np.array([0.8, 0.7], dtype=np.float32), np.array([10, 11])),
+    ]
+    _, ids = _merge_top_k(rows, 3, reverse=True)
+    assert ids.tolist() == [0, 10, 11]
+
+
+def test_sharded_search_matches_each_shard(index_root):
+    """Test that the fan-out search returns the best hits of all shards with global ids."""
+    index = ShardedIndex(resolve_index_dir(index_root))
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2, index.dimension)).astype(np.float32)
+
+    distances, ids = index.search(vectors, 5)
+    for q in range(2):
+        expected = []
+        for _, shard, offset in index.shards():
+            shard_distances, shard_ids = shard.search(vectors[q:q + 1], 5)
+            expected += [(d, i + offset) for d, i in zip(shard_distances[0], shard_ids[0]) if i >= 0]
+        expected.sort()
+        assert ids[q].tolist() == [i for _, i in expected[:5]]
+        assert np.allclose(distances[q], [d for d, _ in expected[:5]])
+
+
+def test_sharded_search_skips_filtered_out_shards(index_root):
+    """Test that a site filter only returns ids owned by that site's shard."""
+    index = ShardedIndex(resolve_index_dir(index_root))
+    bitmap = index.filters.bitmap(ReviewFilter(sites=["rottentomatoes"]))
+    _, ids = index.search(np.zeros((1, index.dimension), dtype=np.float32), 4, bitmap)
+    assert {doc.metadata["site"] for doc in index.get_documents(ids[0])} == {"rottentomatoes"}
+
+
+def test_reopen_reuses_unchanged_shards(index_root):
+    """Test that reopening after a one-site update only reopens that site's shard."""
+    before = ShardedIndex(resolve_index_dir(index_root))
+    review_id = before.get_document(0).metadata["review_id"]
+    delete_reviews([review_id], index_dir=index_root)
+
+    after = ShardedIndex(resolve_index_dir(index_root), previous=before)
+    changed = before.get_document(0).metadata["site"]
+    for site, shard in after._shards.items():
+        assert (shard is before._shards[site]) == (site != changed)
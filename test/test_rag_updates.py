@@ -0,0 +1,48 @@
+import numpy as np
+
+from st_app.rag.index_store import DELETED_FILE, ReviewIndex
+from st_app.rag.reviews import ReviewStore
+from st_app.rag.updates import delete_reviews, upsert_reviews
+from st_app.rag.versions import current_version, list_versions, resolve_index_dir, verify_version
+
+REVIEW = {"site": "imdb", "rating": 9, "date": "2024-05-01", "source_id": "abc123",
+          "comment": "A purple platypus conducted the orchestra.", "clean_comment": "purple platypus orchestra"}
+
+
+def test_upsert_then_delete(index_root):
+    """Test that upserting and deleting a review updates counts and the deleted-slot mask."""
+    first = current_version(index_root)
+    shard = resolve_index_dir(index_root) / "imdb"
+    n_reviews, n_vectors = len(ReviewStore(shard)), ReviewIndex(shard).index.ntotal
+
+    summary = upsert_reviews([REVIEW], index_dir=index_root)
+    assert summary["reviews_added"] == 1 and summary["vectors_added"] == 1
+    shard = resolve_index_dir(index_root) / "imdb"
+    assert len(ReviewStore(shard)) == n_reviews + 1
+    assert ReviewIndex(shard).index.ntotal == n_vectors + 1
+
+    summary = delete_reviews(["abc123"], index_dir=index_root)
+    assert summary["reviews_removed"] == 1 and summary["vectors_removed"] == 1
+    shard = resolve_index_dir(index_root) / "imdb"
+    store = ReviewStore(shard)
+    assert len(store) == n_reviews + 1
+    assert store.chunk_reviews[n_vectors] == -1
+    assert np.load(shard / DELETED_FILE).tolist() == [n_vectors]
+    assert ReviewIndex(shard).index.ntotal == n_vectors
+
+    # Each update publishes a new version and leaves the earlier ones intact
+    assert current_version(index_root) == summary["version"] != first
+    assert all(verify_version(index_root / "versions" / v) == [] for v in list_versions(index_root))
+
+
+def test_upsert_replaces_a_review_in_place(index_root):
+    """Test that upserting an existing source id swaps its text and keeps one copy searchable."""
+    upsert_reviews([REVIEW], index_dir=index_root)
+    summary = upsert_reviews([{**REVIEW, "comment": "A teal walrus.", "clean_comment": "teal walrus"}],
+                             index_dir=index_root)
+    assert summary["reviews_added"] == 1 and summary["reviews_removed"] == 1
+
+    index = ReviewIndex(resolve_index_dir(index_root) / "imdb")
+    assert len(index.lexical.search("platypus", 5)[0]) == 0
+    ids, _ = index.lexical.search("walrus", 5)
+    assert [doc.page_content for doc in index.get_reviews(ids)][0].endswith("A teal walrus.")
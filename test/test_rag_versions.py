@@ -0,0 +1,52 @@
+import pytest
+
+from st_app.rag.reviews import ReviewStore
+from st_app.rag.shards import shard_dirs
+from st_app.rag.updates import delete_reviews
+from st_app.rag.versions import (
+    collect_garbage,
+    current_version,
+    list_versions,
+    resolve_index_dir,
+    rollback,
+    verify_version,
+)
+
+from .conftest import SITE_FILES
+
+
+def test_build_publishes_verified_version(index_root):
+    """Test that a build publishes one verified version with a shard per site."""
+    assert list_versions(index_root) == [current_version(index_root)]
+    assert verify_version(resolve_index_dir(index_root)) == []
+    assert set(shard_dirs(resolve_index_dir(index_root))) == set(SITE_FILES)
+
+
+def test_verify_version_reports_damaged_files(index_root):
+    """Test that changed and missing files of a version are reported."""
+    version_dir = resolve_index_dir(index_root)
+    (version_dir / "imdb" / "index.faiss").write_bytes(b"torn")
+    (version_dir / "letterboxd" / "index.faiss").unlink()
+    assert sorted(verify_version(version_dir)) == [
+        "imdb/index.faiss: checksum mismatch", "letterboxd/index.faiss: missing",
+    ]
+
+
+def test_publish_rollback_and_gc(index_root):
+    """Test rollback to the previous version and garbage collection of old ones."""
+    first = current_version(index_root)
+    store = ReviewStore(resolve_index_dir(index_root) / "rottentomatoes")
+    review_ids = [store.record(p)["review_id"] for p in range(3)]
+    published = [delete_reviews([review_id], index_dir=index_root)["version"] for review_id in review_ids]
+    assert current_version(index_root) == published[-1]
+
+    assert rollback(index_root) == published[-2]
+    assert current_version(index_root) == published[-2]
+    rollback(index_root, published[-1])
+
+    # Every publish already kept only RAG_INDEX_KEEP_VERSIONS (3) versions
+    assert first not in list_versions(index_root)
+    assert collect_garbage(index_root, keep=2) == published[:1]
+    assert list_versions(index_root) == published[-2:]
+    with pytest.raises(ValueError, match="Unknown version"):
+        rollback(index_root, first)